@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Clasificación de noches y estadísticas por noche (vectorizadas)
+
+import numpy as np
+import pandas as pd
+
+import rollups
+
+# Night categories, from 'photo_night' thresholds:
+#   photo_night < low: bad; low <= photo_night < high: good; photo_night >= high: excellent
+CATEGORIES = ['bad', 'good', 'excellent']
+THRESHOLDS = (0.5, 0.9)
+
+# Columns returned by 'night_stats'
+STATS_KEYWORDS = ['night', 'position', 'filter_name', 'samples', 'dark_hours',
+                  'sky_median', 'sky_best', 'good_fraction']
+
+
+def classify(photo_night, thresholds=THRESHOLDS):
+    """Classify 'photo_night' values in CATEGORIES.
+
+    Args:
+        photo_night (array-like): 'photo_night' values.
+        thresholds (tuple): (low, high) limits of 'good' category.
+
+    Returns:
+        (pandas.Categorical): categories of input values (missing for NaN).
+    """
+    values = np.asarray(photo_night)
+    # thresholds in column type, so that float32 0.9 is 'excellent'
+    bins = np.asarray(thresholds, dtype=np.float64).astype(values.dtype)
+    codes = np.digitize(values, bins).astype(np.int8)
+    codes[np.isnan(values)] = -1
+    return pd.Categorical.from_codes(codes, categories=CATEGORIES)
+
+
+def sample_periods(datetime_obs, series):
+    """Typical time between consecutive samples of every series (median
+    positive step, in seconds).
+
+    Args:
+        datetime_obs (numpy.ndarray): epoch values (any order).
+        series (numpy.ndarray): non negative integer code of the series
+            (e.g. position and filter) of every value.
+
+    Returns:
+        (numpy.ndarray): period of the series of every value (float), 0 in
+            series with less than two distinct values.
+    """
+    order = np.lexsort((datetime_obs, series))
+    times, codes = datetime_obs[order], series[order]
+    # steps between consecutive samples of the same series
+    steps = np.diff(times)
+    valid = (steps > 0) & (codes[1:] == codes[:-1])
+    medians = pd.Series(steps[valid], dtype=np.float64).groupby(codes[1:][valid]).median()
+    periods = np.zeros(int(series.max()) + 1 if len(series) else 0)
+    periods[medians.index.values.astype(np.int64)] = medians.values
+    return periods[series]
+
+
+def night_stats(data, thresholds=THRESHOLDS, period=None):
+    """Per night statistics for every position and filter, in one grouped pass.
+
+    Nights run from 12:00 to 12:00 UTC (see 'rollups.night_start'). Rows
+    of several stations ('station' column, see 'astmon.get_data_stations')
+    are also grouped by station.
+
+    Args:
+        data (pandas.DataFrame): 'get_data' output ('datetime_obs',
+            'is_moon', 'photo_night', 'sky_bright', 'position' and
+            'filter_name' columns).
+        thresholds (tuple): (low, high) 'classify' thresholds.
+        period (float): seconds represented by every sample. If None, the
+            period of every (station, position, filter_name) series is
+            computed apart with 'sample_periods'.
+
+    Returns:
+        (pandas.DataFrame): STATS_KEYWORDS columns (plus 'station' after
+            'night', if given), one row per (night, [station,] position,
+            filter_name):
+            * 'night': night start (epoch).
+            * 'samples': number of samples.
+            * 'dark_hours': dark time (samples without moon) in hours.
+            * 'sky_median', 'sky_best': median and maximum (darkest) 'sky_bright'.
+            * 'good_fraction': fraction of good or excellent samples.
+    """
+    datetime_obs = data['datetime_obs'].values
+    photo = data['photo_night'].values
+    low = np.asarray(thresholds[0], dtype=np.float64).astype(photo.dtype)
+    keys = ['night', 'station', 'position', 'filter_name'] if 'station' in data \
+        else ['night', 'position', 'filter_name']
+    frame = pd.DataFrame({'night': rollups.night_start(datetime_obs),
+                          **({'station': data['station'].values} if 'station' in data else {}),
+                          'position': data['position'].values,
+                          'filter_name': data['filter_name'].values,
+                          'sky_bright': data['sky_bright'].values,
+                          'dark': data['is_moon'].values == 0,
+                          'good': photo >= low})
+    if period is None:
+        series = frame.groupby(keys[1:], observed=True, sort=False).ngroup().values
+        period = sample_periods(datetime_obs, series)
+    frame['dark_time'] = np.where(frame['dark'].values, period, 0.)
+    stats = frame.groupby(keys, observed=True, sort=True).agg(
+        samples=('sky_bright', 'size'),
+        dark_hours=('dark_time', 'sum'),
+        sky_median=('sky_bright', 'median'),
+        sky_best=('sky_bright', 'max'),
+        good_fraction=('good', 'mean')).reset_index()
+    stats['dark_hours'] = stats['dark_hours'] / 3600
+    return stats[keys + STATS_KEYWORDS[3:]]
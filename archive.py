@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Archivo columnar particionado (año / filtro / posición) de las medidas del Astmon
+
+import argparse
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+import intervals
+
+# 2: float64 values, as stored in the database
+ARCHIVE_VERSION = 2
+INDEX_FILE = 'index.json'
+# 'read_archive' copies up to this number of slices per partition one by
+# one; more of them are gathered with a single index array
+MAX_SLICES = 64
+
+# Stored columns and their types. 'position' and 'filter_name' are given by
+# the partition, so they are not stored. Values keep the float64 precision
+# of the database, so archive and database queries give the same data.
+COLUMNS = {'datetime_obs': np.int64,
+           'is_moon': np.int8,
+           'photo_night': np.float64,
+           'sky_bright': np.float64}
+
+
+def year_start(year):
+    """Epoch of January 1st, 00:00:00 (UTC) of 'year'."""
+    return int(np.datetime64(f"{int(year):04d}-01-01", 's').astype(np.int64))
+
+
+def partition_path(year, filter_name, position):
+    """Relative directory of partition (year, filter_name, position)."""
+    return os.path.join(f"year={year}", f"filter={filter_name}", f"position={position}")
+
+
+def export_archive(conn, archive_dir, verbose=True):
+    """Write 'measurement' table into a columnar archive.
+
+    Every (year, filter_name, position) partition is a directory with one
+    '.npy' file per column in COLUMNS, sorted by 'datetime_obs'. The
+    archive index ('index.json') lists partitions with their number of rows
+    and time range. The archive is built in a temporary directory that
+    replaces 'archive_dir' at the end, so readers never see partial exports.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        archive_dir (str): output archive directory.
+        verbose (bool): print progress information.
+
+    Returns:
+        (int): number of exported rows.
+    """
+    parent = os.path.dirname(os.path.abspath(archive_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.archive-')
+    partitions = []
+    total = 0
+    keys = conn.execute("SELECT filter_name, position, min(datetime_obs), max(datetime_obs) "
+                        "FROM measurement GROUP BY filter_name, position").fetchall()
+    for filter_name, position, first_obs, last_obs in keys:
+        first_year = int(str(np.datetime64(first_obs, 's').astype('datetime64[Y]')))
+        last_year = int(str(np.datetime64(last_obs, 's').astype('datetime64[Y]')))
+        for year in range(first_year, last_year + 1):
+            # primary key range scan: rows come sorted by 'datetime_obs'
+            rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM measurement "
+                                "WHERE filter_name = ? AND position = ? "
+                                "AND datetime_obs BETWEEN ? AND ?",
+                                (filter_name, position, year_start(year), year_start(year + 1) - 1)).fetchall()
+            if not rows:
+                continue
+            path = partition_path(year, filter_name, position)
+            os.makedirs(os.path.join(tmp_dir, path))
+            for (name, dtype), values in zip(COLUMNS.items(), zip(*rows)):
+                np.save(os.path.join(tmp_dir, path, f"{name}.npy"), np.array(values, dtype=dtype))
+            partitions.append({'year': year, 'filter_name': filter_name, 'position': position,
+                               'rows': len(rows), 'first_obs': rows[0][0], 'last_obs': rows[-1][0],
+                               'path': path})
+            total += len(rows)
+            if verbose:
+                print(f"INFO: Exported partition '{path}' ({len(rows)} rows)")
+
+    with open(os.path.join(tmp_dir, INDEX_FILE), 'w') as fout:
+        json.dump({'version': ARCHIVE_VERSION, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'columns': list(COLUMNS), 'partitions': partitions}, fout, indent=1)
+
+    if os.path.isdir(archive_dir):
+        old_dir = tempfile.mkdtemp(dir=parent, prefix='.archive-old-')
+        os.replace(archive_dir, os.path.join(old_dir, 'archive'))
+        os.replace(tmp_dir, archive_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(tmp_dir, archive_dir)
+    return total
+
+
+def read_index(archive_dir):
+    """Read archive index of 'archive_dir'.
+
+    Args:
+        archive_dir (str): archive directory.
+
+    Returns:
+        (dict): archive index (see 'export_archive').
+
+    Raises:
+        FileNotFoundError: if 'archive_dir' is not an archive.
+    """
+    with open(os.path.join(archive_dir, INDEX_FILE)) as fin:
+        return json.load(fin)
+
+
+def archive_version(archive_dir):
+    """Token that changes whenever 'archive_dir' is exported again."""
+    with open(os.path.join(archive_dir, INDEX_FILE), 'rb') as fin:
+        return hashlib.sha1(fin.read()).hexdigest()
+
+
+def select_partitions(index, ranges=None, positions=None, filters=None):
+    """Partitions of 'index' touched by a query.
+
+    Args:
+        index (dict): archive index given by 'read_index'.
+        ranges (numpy.ndarray): merged epoch ranges ('intervals.merge').
+            Every time is allowed if None.
+        positions (list): position values. Every position if empty.
+        filters (list): filter names. Every filter if empty.
+
+    Returns:
+        (list): partition entries sorted by (filter_name, position, year).
+    """
+    positions = {int(p) for p in positions or []}
+    filters = set(filters or [])
+    selected = []
+    for part in index['partitions']:
+        if positions and part['position'] not in positions:
+            continue
+        if filters and part['filter_name'] not in filters:
+            continue
+        if ranges is not None and not intervals.overlaps(ranges, part['first_obs'], part['last_obs']):
+            continue
+        selected.append(part)
+    return sorted(selected, key=lambda p: (p['filter_name'], p['position'], p['year']))
+
+
+def read_archive(archive_dir, ranges=None, positions=None, filters=None, columns=None):
+    """Read measurements from a columnar archive.
+
+    Only the partitions and columns touched by the query are opened, as
+    read-only memory maps. Rows of every time range are located by binary
+    search on the sorted 'datetime_obs' column ('intervals.bounds'), so
+    just the selected slices are copied (gathered at once when there are
+    more than MAX_SLICES of them).
+
+    Args:
+        archive_dir (str): archive directory.
+        ranges (numpy.ndarray): merged epoch ranges ('intervals.merge').
+            Every time is allowed if None.
+        positions (list): position values. Every position if empty.
+        filters (list): filter names. Every filter if empty.
+        columns (list): stored columns to read (COLUMNS keys). All of them
+            if None.
+
+    Returns:
+        (pandas.DataFrame): 'columns' plus 'position' (int8) and
+            'filter_name' (categorical), sorted by (filter_name, position,
+            datetime_obs).
+    """
+    columns = list(COLUMNS) if columns is None else list(columns)
+    parts = select_partitions(read_index(archive_dir), ranges, positions, filters)
+    categories = sorted({p['filter_name'] for p in parts})
+
+    chunks = {name: [] for name in columns + ['position', 'filter_name']}
+    for part in parts:
+        path = os.path.join(archive_dir, part['path'])
+        datetime_obs = np.load(os.path.join(path, 'datetime_obs.npy'), mmap_mode='r')
+        if ranges is not None:
+            lo, hi = intervals.bounds(ranges, datetime_obs)
+        else:
+            lo, hi = np.array([0]), np.array([len(datetime_obs)])
+        if len(lo) == 0:
+            continue
+        n_rows = int((hi - lo).sum())
+        index = intervals.take_index(lo, hi) if len(lo) > MAX_SLICES else None
+        for name in columns:
+            values = datetime_obs if name == 'datetime_obs' \
+                else np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            if index is None:
+                chunks[name].extend(values[a:b] for a, b in zip(lo.tolist(), hi.tolist()))
+            else:
+                chunks[name].append(values[index])
+        chunks['position'].append(np.full(n_rows, part['position'], dtype=np.int8))
+        chunks['filter_name'].append(np.full(n_rows, categories.index(part['filter_name']), dtype=np.int8))
+
+    data = {}
+    for name in columns:
+        dtype = COLUMNS[name]
+        data[name] = np.concatenate(chunks[name]).astype(dtype, copy=False) if chunks[name] \
+            else np.empty(0, dtype=dtype)
+    data['position'] = np.concatenate(chunks['position']) if chunks['position'] \
+        else np.empty(0, dtype=np.int8)
+    codes = np.concatenate(chunks['filter_name']) if chunks['filter_name'] \
+        else np.empty(0, dtype=np.int8)
+    data['filter_name'] = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.DataFrame(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='archive.py',
+                                     conflict_handler='resolve',
+                                     description='''It exports measurements of an astmon
+                                     SQLite database into a columnar archive partitioned by
+                                     year, filter and position (read with
+                                     'astmon.py --source archive').''')
+    parser.add_argument("db_file", help="SQLite file database path")
+    parser.add_argument("archive_dir", help="Output archive directory (replaced if it exists)")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db_file):
+        print(f"ERROR: Database file '{args.db_file}' not found")
+        return 1
+
+    t_ini = time.perf_counter()
+    conn = sqlite3.connect(f"file:{args.db_file}?mode=ro", uri=True)
+    try:
+        total = export_archive(conn, args.archive_dir)
+    finally:
+        conn.close()
+    print(f"INFO: {total} rows exported to '{args.archive_dir}' in {time.perf_counter() - t_ini:.2f} s")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
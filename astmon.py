@@ -4,118 +4,359 @@
 
 import argparse
 import os
-import copy
-import calendar
+import gc
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import seaborn as sns
+# matplotlib and seaborn are slow to import: they are loaded by
+# '_pyplot' only when plots are drawn
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.dates as mdates
 
 import sqlite3
 
-def classify(data):
+import rollups
+import intervals
+import schema
+import shards
+import cache
+import archive
+import downsample
+import analytics
+import instrument
+
+# Columns returned by 'get_data' and their types
+KEYWORDS = ['datetime_obs', 'is_moon', 'photo_night', \
+    'sky_bright', 'position', 'filter_name']
+DTYPES = [np.int64, np.int8, np.float64, np.float64, np.int8, np.int8]
+# Compact layout (see 'schema.LAYOUTS'): scaled integer values are fetched
+# as float64 (exact) and decoded by 'get_data'
+COMPACT_DTYPES = [np.int64, np.int8, np.float64, np.float64, np.int8, np.int8]
+# Columns returned by 'get_data' for rollup resolutions ('night', 'month')
+ROLLUP_KEYWORDS = ['datetime_obs', 'position', 'count'] + rollups.VALUE_COLUMNS[1:] + ['filter_name']
+ROLLUP_DTYPES = [np.int64, np.int8, np.int32] + [np.float64] * (len(rollups.VALUE_COLUMNS) - 1) + [np.int8]
+
+# 'plot_batch' split keys
+BATCH_KEYS = ['station', 'filter', 'position', 'year', 'month']
+# 'main' output formats
+OUTPUT_FORMATS = ['plot', 'csv', 'json', 'summary']
+# 'plot_data' render modes
+RENDER_MODES = ['auto', 'points', 'pixels', 'minmax', 'lttb', 'density']
+# Stages measured by 'instrument' ('--profile' report)
+STAGES = ['cache', 'query', 'archive read', 'get_data', 'classify', 'stats', 'output', 'render',
+          'batch render']
+# 'auto' render mode draws every sample up to this number of samples
+MAX_POINTS = 50000
+
+def classify(data, thresholds=analytics.THRESHOLDS):
     """
     Classify 'data' in three categories: bad, good or excellent night.
 
     It evaluates values from 'photo_night' column of input data and
-    classify them following next criteria:
+    classify them following next criteria (default thresholds):
         * 'photo_night' < 0.5, bad night
         * 0.5 <= 'photo_night' < 0.9, good night
         * 'photo_night' >= 0.9, excellent night
 
     Args:
         data (pandas dataframe): Information from skyQuality network.
+        thresholds (tuple): (low, high) limits of good night.
 
     Returns:
-        array: Classification following 'photo_night' values.
+        pandas.Categorical: Classification following 'photo_night' values
+            (see 'analytics.classify').
 
     Raises:
         keyError: if 'photo_night' keyword doesn't exists.
 
     """
-    # classifying data: criterium photo_night
-    bad_night = data['photo_night'] < 0.5
-    good_night = (data['photo_night'] >= 0.5) & (data['photo_night'] < 0.9)
-    excellent_night = data['photo_night'] >= 0.9
-    cat = list()
-    for b, g, e in zip(bad_night, good_night, excellent_night):
-        value = ''
-        if b:
-            value = 'bad'
-        if g:
-            value = 'good'
-        if e:
-            value = 'excellent'
-        cat.append(value)
-    return np.array(cat)
-
-def time_intervals(period=None, years=None, months=None, days=None):
-    """Get time interval for data to plot.
-    
+    return analytics.classify(data['photo_night'].values, thresholds)
+
+def epoch_ranges(period=None, years=None, months=None, days=None, hours=None, nights=False):
+    """Time intervals of a query as merged epoch ranges ('intervals.build').
+
+    Every combination of 'years', 'months' and 'days' is selected.
+
     Args:
-        period (list): [(date_ini, date_final),...] list of tuple format.
-            dates are given by "YYYY-MM-DD hh:mm:ss" string pattern.
+        period (list): [date_ini, date_final, ...] dates given by
+            "YYYY-MM-DD hh:mm:ss" string pattern. If period is given,
+            'years', 'months', 'days' and 'nights' are ignored.
         years (list): integer values.
         months (list): integer values in [1, 12].
         days (list): integer values in [1, 31].
+        hours (list): daily (hour_ini, hour_final) UTC window, e.g. (20, 4).
+        nights (bool): days are nights (12:00 to 12:00 UTC).
 
-        If period is given, all other parameters are ignored.
-    
-    Return:
-        (list): of tuples. Format given by [(data_ini, date_final),...]
-        
+    Returns:
+        (numpy.ndarray): sorted (n, 2) int64 array of disjoint
+            (epoch_ini, epoch_final) ranges, or None if every time is
+            selected.
     """
-    dts = []
-    dts_ini = []
-    dts_final = []
+    return intervals.build(period, years, months, days, hours, nights)
+
+def build_query(positions=None, filters=None, ranges=None, max_inline_ranges=16, \
+    resolution='raw', table='measurement'):
+    """Build parameterized SQL query for 'measurement' table (or rollup
+    tables, depending on 'resolution').
+
+    Positions and filters are turned into 'IN' lists. Time ranges are
+    compared against raw epoch values so that indexes are used. If there
+    are more than 'max_inline_ranges' ranges, they must be loaded into the
+    temporary table 'query_interval' (see 'load_ranges') and the query
+    joins with it, one index range scan per interval.
 
-    if period is None and years is None and months is None and days is None:
-        return dts
+    When positions are not given, the time index is always the access
+    path of time ranges: filters are compared with a unary '+', so that
+    the primary key (led by 'filter_name') is never chosen to read every
+    row of a filter once per interval.
+
+    Args:
+        positions (list) integer values in [1, 10].
+        filters (list): string values allowed are ('B', 'V', 'R', 'I').
+        ranges (numpy.ndarray): merged epoch ranges given by 'epoch_ranges'
+            (every time if None, no time if empty).
+        max_inline_ranges (int): maximum number of ranges written in the
+            query itself.
+        resolution (str): 'raw' for measurements, 'night' or 'month' for
+            rollup statistics (time ranges select periods by their start).
+        table (str): measurements table for 'raw' resolution
+            ('schema.MEASUREMENT_TABLE'; compact layout 'filters' are codes).
 
-    if period:
-        if isinstance(period, list):
-            dts = [copy.deepcopy(period)]
+    Returns:
+        (tuple): (sql, params, use_table). 'use_table' is True when ranges
+            must be loaded in 'query_interval' before running the query.
+    """
+    if resolution == 'raw':
+        time_column = 'm.datetime_obs'
+        columns = [f"m.{k}" for k in KEYWORDS]
     else:
-        # Checking input types and values
-        ye = mo = da = None
-        if years is not None:
-            ye = years
-            if not isinstance(years, list):
-                ye = list(years)
-        if months is not None:
-            mo = months
-            if not isinstance(months, list):
-                mo = list(months)
-        if days is not None:
-            da = days
-            if not isinstance(days, list):
-                da = list(days)
-    
-        # Processing dates...
-        if da and mo and ye:
-            dts_ini = [f"{y}-{m}-{d} 00:00:00" for d, m, y in zip(da, mo, ye)]
-            dts_final = [dt.replace('00:00:00', '23:59:59') for dt in dts_ini]
-        if (not da) and mo and ye:
-            dts_ini = [f"{y}-{int(m):0>2d}-01 00:00:00" for m, y in zip(mo, ye)]
-            month_days = [calendar.monthrange(int(y), int(m))[1] for m, y in zip(mo, ye)]
-            dts_final = ["{}-{:0>2d}-{:0>2d} 23:59:59".format(y, int(m), md) for y, m, md in zip(ye, mo, month_days)]
-        if  (not da) and (not mo) and ye:
-            dts_ini = [f"{y}-01-01 00:00:00" for y in ye]
-            dts_final = [f"{y}-12-31 23:59:59" for y in ye]
-
-        dts = zip(dts_ini, dts_final)
-
-    return dts
+        table, time_column = rollups.RESOLUTIONS[resolution], 'm.period_start'
+        columns = [f"{time_column} AS datetime_obs"] + [f"m.{k}" for k in ROLLUP_KEYWORDS[1:]]
+
+    sql = f"SELECT {', '.join(columns)} FROM {table} AS m"
+    wheres = []
+    params = []
+    use_table = ranges is not None and len(ranges) > max_inline_ranges
+    if use_table:
+        # interval table drives the loop: one range scan per interval
+        sql = f"SELECT {', '.join(columns)} FROM temp.query_interval AS i " \
+            f"CROSS JOIN {table} AS m"
+        wheres.append(f"{time_column} BETWEEN i.ini AND i.final")
+    if positions:
+        positions = sorted({int(pos) for pos in positions})
+        wheres.append(f"m.position IN ({', '.join(['?'] * len(positions))})")
+        params.extend(positions)
+    if filters:
+        filters = sorted(set(filters))
+        # '+' disables the primary key on 'filter_name' (see above)
+        time_path = resolution == 'raw' and not positions and ranges is not None and len(ranges)
+        wheres.append(f"{'+' if time_path else ''}m.filter_name IN ({', '.join(['?'] * len(filters))})")
+        params.extend(filters)
+    if ranges is not None and not use_table:
+        if len(ranges):
+            wheres.append(f"({' OR '.join([f'{time_column} BETWEEN ? AND ?'] * len(ranges))})")
+            params.extend(intervals.as_array(ranges).ravel().tolist())
+        else:
+            wheres.append("0")
+
+    if wheres:
+        sql += " WHERE " + ' AND '.join(wheres)
+
+    return sql, params, use_table
+
+def fetch_columns(cursor, keywords=KEYWORDS, dtypes=DTYPES, chunk_rows=65536):
+    """Fetch query results of 'cursor' into typed numpy arrays.
+
+    Rows are read with 'fetchmany' and copied into preallocated arrays,
+    whose capacity is doubled when needed, so no list with every row is
+    ever built. Query columns must be those given by 'keywords'; the last
+    one ('filter_name') is returned as categorical.
+
+    Args:
+        cursor (sqlite3.Cursor): cursor with an executed query.
+        keywords (list): names of query columns.
+        dtypes (list): numpy types of query columns.
+        chunk_rows (int): number of rows per 'fetchmany' call.
+
+    Returns:
+        (pandas.DataFrame): columns 'datetime_obs' (int64 epoch seconds),
+            'is_moon' (int8), 'photo_night' and 'sky_bright' (float64),
+            'position' (int8) and 'filter_name' (categorical).
+    """
+    arrays = [np.empty(chunk_rows, dtype=dtype) for dtype in dtypes]
+    categories = {}
+    size = 0
+    # Rows are short-lived acyclic tuples: garbage collection passes
+    # triggered by their allocation are pure overhead.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if size + len(rows) > len(arrays[0]):
+                capacity = max(2 * len(arrays[0]), size + len(rows))
+                arrays = [np.resize(a, capacity) for a in arrays]
+            cols = list(zip(*rows))
+            for array, col in zip(arrays[:-1], cols[:-1]):
+                array[size:size + len(rows)] = col
+            # filter names as categorical codes
+            for name in set(cols[-1]):
+                categories.setdefault(name, len(categories))
+            arrays[-1][size:size + len(rows)] = np.fromiter( \
+                map(categories.__getitem__, cols[-1]), dtype=np.int8, count=len(rows))
+            size += len(rows)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    data = {k: a[:size] for k, a in zip(keywords[:-1], arrays[:-1])}
+    data[keywords[-1]] = pd.Categorical.from_codes(arrays[-1][:size], categories=list(categories))
+    return pd.DataFrame(data)
+
+def load_ranges(conn, ranges):
+    """Load 'ranges' into the temporary table 'query_interval'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        ranges (numpy.ndarray): merged epoch ranges given by 'epoch_ranges'.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_interval " \
+        "(ini INTEGER PRIMARY KEY, final INTEGER NOT NULL)")
+    conn.execute("DELETE FROM temp.query_interval")
+    conn.executemany("INSERT INTO temp.query_interval (ini, final) VALUES (?, ?)", \
+        intervals.as_array(ranges).tolist())
+    return 0
+
+def query_db(conn, ranges, positions=None, filters=None, resolution='raw', db='main'):
+    """Run the query of 'get_data' on database opened in 'conn'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        ranges (numpy.ndarray): merged epoch ranges given by 'epoch_ranges'.
+        positions (list) integer values in [1, 10].
+        filters (list): string values allowed are ('B', 'V', 'R', 'I').
+        resolution (str): 'raw', 'night' or 'month' (see 'get_data').
+        db (str): schema name of the queried database ('main' or an
+            attached shard, only for 'raw' resolution).
+
+    Returns:
+        (pandas.DataFrame): 'get_data' output.
+    """
+    c = conn.cursor()
+    # compact layout: stored table is queried (the decoding view can't use
+    # the time index) and values are decoded after fetching
+    table = schema.measurement_table(conn, db) if resolution == 'raw' else None
+    if table == 'measurement_data' and filters:
+        filters = [code for code in schema.encode_filters(conn, filters, db=db) \
+            if code is not None] or [-1]
+    sql, params, use_table = build_query(positions, filters, ranges, resolution=resolution, \
+        table=table if db == 'main' or table is None else f"{db}.{table}")
+    if use_table:
+        load_ranges(conn, ranges)
+
+    instrument.explain(conn, sql, params)
+    with instrument.stage('query') as stage:
+        c.execute(sql, params)
+        if table == 'measurement':
+            df = fetch_columns(c)
+        elif table == 'measurement_data':
+            df = fetch_columns(c, KEYWORDS, COMPACT_DTYPES)
+            for key in ('photo_night', 'sky_bright'):
+                # nearest float64 of the decimal value: same as standard layout
+                df[key] = df[key].values / schema.VALUE_SCALE
+            names = dict(conn.execute(f"SELECT code, filter_name FROM {db}.filter_code"))
+            df['filter_name'] = df['filter_name'].cat.rename_categories( \
+                [names[code] for code in df['filter_name'].cat.categories])
+        else:
+            df = fetch_columns(c, ROLLUP_KEYWORDS, ROLLUP_DTYPES)
+        stage['rows'] = len(df.index)
+    c.close()
+
+    if resolution != 'raw':
+        df['sky_bright'] = df['sky_q50']
+        df['photo_night'] = df['photo_q50']
+    return df
+
+def _query_shard(path, ranges, positions, filters):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return query_db(conn, ranges, positions, filters)
+    finally:
+        conn.close()
+
+def get_shard_data(conn, ranges, positions=None, filters=None, workers=1):
+    """Query measurements of a sharded database ('shards.py').
+
+    Only shards overlapping 'ranges' are read: they are attached to 'conn'
+    (at most 'shards.MAX_ATTACHED' at a time) and queried one after
+    another, or queried by 'workers' processes with their own read-only
+    connections.
+
+    Args:
+        conn (sqlite3.Connection): catalog connection ('uri=True').
+        ranges (numpy.ndarray): merged epoch ranges given by 'epoch_ranges'.
+        positions (list) integer values in [1, 10].
+        filters (list): string values allowed are ('B', 'V', 'R', 'I').
+        workers (int): number of processes querying shards.
+
+    Returns:
+        (pandas.DataFrame): 'get_data' output, shard after shard in time
+            order.
+    """
+    found = shards.list_shards(conn, ranges)
+    print(f"Shards = {[shard[0] for shard in found]}")
+    if not found:
+        df = pd.DataFrame({k: np.empty(0, dtype=t) for k, t in zip(KEYWORDS[:-1], DTYPES[:-1])})
+        df['filter_name'] = pd.Categorical([])
+        return df
+    if workers > 1 and len(found) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(found))) as pool:
+            frames = list(pool.map(_query_shard, [shard[3] for shard in found], [ranges] * len(found), \
+                [positions] * len(found), [filters] * len(found)))
+    else:
+        frames = []
+        for k in range(0, len(found), shards.MAX_ATTACHED):
+            names = shards.attach(conn, found[k:k + shards.MAX_ATTACHED], read_only=True)
+            try:
+                frames.extend(query_db(conn, ranges, positions, filters, db=name) for name in names)
+            finally:
+                # 'query_interval' inserts leave a transaction open
+                conn.rollback()
+                shards.detach(conn, names)
+    return concat_data(frames)
+
+def concat_data(frames):
+    """Concatenate 'get_data' results (categories of categorical columns
+    are merged: 'pandas.concat' would give objects).
+
+    Args:
+        frames (list): 'get_data' outputs.
+
+    Returns:
+        (pandas.DataFrame): rows of every frame, in order.
+    """
+    data = pd.concat(frames, ignore_index=True)
+    for key, column in frames[0].items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            data[key] = pd.api.types.union_categoricals([df[key] for df in frames], sort_categories=True)
+    return data
 
 def get_data(db_file, period=None, years=None, months=None, \
-    days=None, positions=None, filters=None):
+    days=None, positions=None, filters=None, resolution='raw', \
+    cache_dir=None, cache_size=cache.DEFAULT_SIZE, source='sqlite', conn=None, shard_workers=1, \
+    *, hours=None, nights=False):
     """Filter input data accesible by 'db_file' taken into account
     values given by the rest of parameters.
     
     Args:
-        db_file (str): path to SQLite database file.
+        db_file (str): path to SQLite database file (archive directory
+            if 'source' is 'archive').
         period (list): time intervals given by (data_ini, date_final)
             data_ini and data_final are given by strings like 'YYYY-MM-DD hh:mm:ss'
         years (list): integer values.
@@ -123,60 +364,261 @@ def get_data(db_file, period=None, years=None, months=None, \
         days (list): integer values in [1, 31].
         positions (list) integer values in [1, 10].
         filters (list): string values allowed are ('B', 'V', 'R', 'I').
+        resolution (str): 'raw' (measurements), 'night' or 'month' (rollup
+            statistics per period, position and filter).
+        cache_dir (str): directory of the persistent result cache. Results
+            are not cached if None (default): callers opt in, only the
+            command line uses 'cache.DEFAULT_DIR' by default.
+        cache_size (int): maximum size of cache (bytes).
+        source (str): 'sqlite' (database) or 'archive' (columnar archive
+            written by 'archive.py', only 'raw' resolution).
+        conn (sqlite3.Connection): open connection to 'db_file' (e.g. taken
+            from a pool, 'uri=True'), left open. A new connection is opened
+            and closed if None.
+        shard_workers (int): number of processes querying shards of a sharded
+            database (see 'get_shard_data').
+        hours (list): daily (hour_ini, hour_final) UTC window (only 'raw'
+            resolution, keyword only).
+        nights (bool): 'days' are nights (12:00 to 12:00 UTC, keyword only).
 
     Returns:
         (pandas.DataFrame): Returned keywords are
             ('datetime_obs', 'is_moon', 'photo_night', 
-            'sky_bright', 'position', 'filter_name')
+            'sky_bright', 'position', 'filter_name'). See 'fetch_columns'
+            for types ('datetime_obs' is given in UTC epoch seconds).
+            For rollup resolutions keywords are ROLLUP_KEYWORDS, with
+            'datetime_obs' the period start, plus 'sky_bright' and
+            'photo_night' (period medians).
     """
 
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    if hours and resolution != 'raw':
+        raise ValueError(f"Hour windows are not available with resolution '{resolution}'")
+    ranges = epoch_ranges(period, years, months, days, hours, nights)
+    if ranges is None or len(ranges) <= 16:
+        print(f"Time ranges (epoch) = {None if ranges is None else ranges.tolist()}")
+    else:
+        print(f"Time ranges (epoch) = {len(ranges)} ranges from {ranges[0, 0]} to {ranges[-1, 1]}")
 
-    keywords = ['datetime_obs', 'is_moon', 'photo_night', \
-        'sky_bright', 'position', 'filter_name']
+    if source == 'archive' and resolution != 'raw':
+        raise ValueError(f"Resolution '{resolution}' is not available in archives")
 
-    sql = f"SELECT datetime(datetime_obs, 'unixepoch') as datetime_obs, \
-        {','.join(keywords[1:])} FROM measurement "
-    wheres = []
-    if positions:
-        lpos = [f"position = '{pos}'" for pos in positions]
-        wheres.append(f"({' OR '.join(lpos)})")
-    if filters:
-        lfilt = [f"filter_name = '{fi}'" for fi in filters]
-        wheres.append(f"({' OR '.join(lfilt)})")
-    intervals = []
-    for t_interval in time_intervals(period, years, months, days):
-        print(f"Time interval = {t_interval}")
-        intervals.append(f"(datetime_obs BETWEEN strftime('%s', '{t_interval[0]}') and strftime('%s', '{t_interval[1]}'))")
-    if intervals:
-        wheres.append(f"({' OR '.join(intervals)})")
-    
-    if wheres:
-        sql += " WHERE "
-        sql += ' AND '.join(wheres)
+    if cache_dir:
+        version = archive.archive_version(db_file) if source == 'archive' else None
+        key = cache.query_key(db_file, ranges, positions, filters, resolution, version)
+        with instrument.stage('cache'):
+            df = cache.load(cache_dir, key)
+            stats = cache.update_stats(cache_dir, df is not None)
+        print(f"Cache {'hit' if df is not None else 'miss'} " \
+            f"(hits = {stats['hits']}, misses = {stats['misses']})")
+        if df is not None:
+            return df
 
-    print(f"sql = {sql}")
-    c.execute(sql)
+    if source == 'archive':
+        with instrument.stage('archive read') as stage:
+            df = archive.read_archive(db_file, ranges, positions, filters)
+            stage['rows'] = len(df.index)
+        if cache_dir:
+            cache.store(cache_dir, key, df, cache_size)
+        return df
 
-    res = c.fetchall()
+    own_conn = conn is None
+    if own_conn:
+        # queries never write: read-only, so no lock is ever taken on the database
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    if resolution == 'raw' and shards.is_catalog(conn):
+        # sharded database: rollups are stored in the catalog itself
+        df = get_shard_data(conn, ranges, positions, filters, shard_workers)
+    else:
+        df = query_db(conn, ranges, positions, filters, resolution)
+
+    if own_conn:
+        conn.close()
 
-    df = pd.DataFrame(res, columns=keywords)
+    if cache_dir:
+        cache.store(cache_dir, key, df, cache_size)
 
     return df
 
-def plot_data(data, out_plot, title, field_group='category_night'):
+def find_databases(paths, source='sqlite'):
+    """Station names and databases of 'paths'.
+
+    Directories are searched for database files ('*.db') and station
+    subdirectories ('*/astmonDB.db'). Stations are named after their
+    database file, or their directory for 'astmonDB.db' files. Archive
+    directories ('source' is 'archive') are stations themselves.
+
+    Args:
+        paths (list): database files and directories.
+        source (str): 'sqlite' or 'archive' (see 'get_data').
+
+    Returns:
+        (dict): {station: database path}, in 'paths' order.
+
+    Raises:
+        ValueError: no database found in some directory.
+    """
+    files = []
+    for path in paths:
+        if source == 'sqlite' and os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, '*.db')) + \
+                glob.glob(os.path.join(path, '*', 'astmonDB.db')))
+            if not found:
+                raise ValueError(f"No database found in '{path}'")
+            files.extend(found)
+        else:
+            files.append(path)
+    stations = {}
+    for db_file in files:
+        name = os.path.splitext(os.path.basename(os.path.normpath(db_file)))[0]
+        if name == 'astmonDB':
+            name = os.path.basename(os.path.dirname(os.path.abspath(db_file)))
+        station, n = name, 1
+        while station in stations:
+            n += 1
+            station = f"{name}-{n}"
+        stations[station] = db_file
+    return stations
+
+def _station_data(station, db_file, kwargs):
+    t_ini = time.perf_counter()
+    try:
+        data = get_data(db_file, **kwargs)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        # station is named in the message of the same exception type
+        raise type(e)(f"station '{station}': {e}") from e
+    return data, time.perf_counter() - t_ini
+
+def get_data_stations(stations, workers=None, **kwargs):
+    """Run 'get_data' on the database of every station, in parallel, and
+    merge results in one frame sorted by time.
+
+    Every station is queried in its own process (read-only connection), so
+    total time is close to that of the slowest station.
+
+    Args:
+        stations (dict): {station: database path} ('find_databases').
+        workers (int): number of processes. One per station if None.
+        kwargs: 'get_data' keyword arguments.
+
+    Returns:
+        (pandas.DataFrame): 'get_data' columns plus 'station'
+            (categorical), sorted by 'datetime_obs' (stable).
+    """
+    names = list(stations)
+    workers = min(workers or len(names), len(names))
+    t_ini = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_station_data, names, stations.values(), [kwargs] * len(names)))
+    else:
+        results = list(map(_station_data, names, stations.values(), [kwargs] * len(names)))
+    for name, (data, elapsed) in zip(names, results):
+        print(f"INFO: Station '{name}': {len(data.index)} rows in {elapsed:.2f} s")
+    print(f"INFO: {len(names)} stations queried in {time.perf_counter() - t_ini:.2f} s " \
+        f"({workers} processes)")
+    return merge_stations(dict(zip(names, [data for data, _ in results])))
+
+def merge_stations(frames):
+    """Merge 'get_data' results of several stations, sorted by time.
+
+    Args:
+        frames (dict): {station: 'get_data' output}.
+
+    Returns:
+        (pandas.DataFrame): same columns plus 'station' (categorical).
+    """
+    names = list(frames)
+    sizes = [len(df.index) for df in frames.values()]
+    data = concat_data(list(frames.values()))
+    data['station'] = pd.Categorical.from_codes(np.repeat(np.arange(len(names), dtype=np.int8), sizes), \
+        categories=names)
+    order = np.argsort(data['datetime_obs'].values, kind='stable')
+    return data.iloc[order].reset_index(drop=True)
+
+def summary(data):
+    """Summary of 'get_data' output.
+
+    Args:
+        data (pandas.DataFrame): 'get_data' output, with 'category_night'
+            column.
+
+    Returns:
+        (dict): number of rows, time range (UTC), rows per filter,
+            position and category, and 'sky_bright' range and median.
+    """
+    def counts(values):
+        # hash counts: no sort of millions of (categorical) values
+        n = pd.Series(values).value_counts(sort=False, dropna=False).sort_index()
+        return {str(k): int(v) for k, v in n.items() if v}
+
+    sky = data['sky_bright'].values
+    epoch = data['datetime_obs'].values
+    return {'Rows': len(data.index),
+            'First datetime': str(np.datetime64(int(epoch.min()), 's')),
+            'Last datetime': str(np.datetime64(int(epoch.max()), 's')),
+            'Rows per filter': counts(data['filter_name']),
+            'Rows per position': counts(data['position']),
+            'Rows per category': counts(data['category_night']),
+            **({'Rows per station': counts(data['station'])} if 'station' in data else {}),
+            'Sky brightness (min, median, max)': \
+                tuple(round(float(v), 3) for v in np.nanpercentile(sky, [0, 50, 100]))}
+
+def write_data(data, out_file, fmt):
+    """Write 'data' into 'out_file' as CSV or JSON (list of records).
+
+    Dates are written as 'YYYY-MM-DD hh:mm:ss' (CSV) or ISO 8601 (JSON)
+    UTC strings. JSON values keep 6 decimals, as data files.
+
+    Args:
+        data (pandas.DataFrame): data to write.
+        out_file (str): output file path.
+        fmt (str): 'csv' or 'json'.
+
+    Returns:
+        int: 0 - everything was fine.
+    """
+    if fmt == 'csv':
+        data.to_csv(out_file, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    else:
+        data.to_json(out_file, orient='records', date_format='iso', date_unit='s', double_precision=6)
+    return 0
+
+def _pyplot():
+    """Import plotting modules and set plot style (first call only).
+
+    Returns:
+        (module): matplotlib.pyplot.
+    """
+    import matplotlib
+    # plots are only saved to files: no interactive backend is needed
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style("darkgrid")
+    return plt
+
+def plot_data(data, out_plot, title, field_group='category_night', mode='auto', dpi=200):
     """
     Plot information contained in input argument 'data'.
 
-    A bit longer description.
+    Series are reduced to the pixel width of the output plot before
+    drawing, so render time doesn't depend on the number of samples
+    (see 'downsample'). Artists are rasterized.
 
     Args:
-        data (pandas.dataframe): Fields are 
-            ['date', 'time', 'is_moon', 'photo_night', 'sky_bright', 'category_night'].
+        data (pandas.dataframe): datetime index and fields
+            ['sky_bright', field_group].
         out_plot (str): Path for output plot.
         title (str): Title for output plot.
         field_group (str): Field used for grouping.
+        mode (str): one of RENDER_MODES:
+            * 'points': every sample.
+            * 'pixels': one marker per pixel holding some sample.
+            * 'minmax': minimum and maximum per pixel column.
+            * 'lttb': Largest-Triangle-Three-Buckets per group.
+            * 'density': number of samples per 4x4 pixels cell (no groups).
+            * 'auto': 'points' up to MAX_POINTS samples, 'pixels' above.
+        dpi (int): resolution of output plot.
 
     Returns:
         int: 0 - everything was fine.
@@ -185,32 +627,169 @@ def plot_data(data, out_plot, title, field_group='category_night'):
         Exception: Exception type depends on failed line of code.
 
     """
-    # Grouping dataframe
-    groups = data.groupby(field_group)
-
-    # Plotting with pandas
+    plt = _pyplot()
     fig, ax = plt.subplots()
+    _draw_axes(fig, ax, data, title, field_group, mode, dpi)
+
+    # saving plot
+    fig.savefig(out_plot, dpi=dpi)
+    # closing plot
+    plt.close(fig)
+
+    return 0
+
+def plot_stations(data, out_plot, title, field_group='category_night', mode='auto', dpi=200):
+    """Plot every station of 'data' in its own panel (one row per station,
+    shared time and magnitude axes).
+
+    Args:
+        data (pandas.dataframe): datetime index and fields
+            ['sky_bright', 'station', field_group].
+        out_plot (str): Path for output plot.
+        title (str): Title for output plot.
+        field_group (str): Field used for grouping.
+        mode (str): render mode (see 'plot_data').
+        dpi (int): resolution of output plot.
+
+    Returns:
+        int: 0 - everything was fine.
+    """
+    plt = _pyplot()
+    stations = sorted(data.groupby('station', observed=True).indices.items())
+    fig, axes = plt.subplots(len(stations), 1, sharex=True, squeeze=False, \
+        figsize=(6.4, 1.2 + 2.4 * len(stations)))
+    for ax, (station, index) in zip(axes[:, 0], stations):
+        _draw_axes(fig, ax, data.iloc[index], station, field_group, mode, dpi)
+        if ax is not axes[-1, 0]:
+            ax.set_xlabel('')
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(out_plot, dpi=dpi)
+    plt.close(fig)
+
+    return 0
+
+def _draw_axes(fig, ax, data, title, field_group, mode, dpi):
+    """Draw 'data' in axes 'ax' of figure 'fig' (see 'plot_data')."""
+    import matplotlib.dates as mdates
+    from matplotlib.colors import LogNorm
+
     # Datetime format
     locator = mdates.AutoDateLocator(minticks=3, maxticks=12)
     formatter = mdates.ConciseDateFormatter(locator)
     ax.xaxis.set_major_locator(locator)
     ax.xaxis.set_major_formatter(formatter)
-    for name, group in groups:
-        ax.plot(group.sky_bright, marker='o', linestyle='', ms=5, label=name)
-    ax.legend(loc="lower left")
+
+    x = mdates.date2num(data.index.values)
+    y = data['sky_bright'].values
+    # pixel columns of axes in output plot
+    n_bins = max(int(ax.get_window_extent().width * dpi / fig.dpi), 1)
+    if mode == 'auto':
+        mode = 'points' if len(y) <= MAX_POINTS else 'pixels'
+
+    height = max(int(ax.get_window_extent().height * dpi / fig.dpi), 1)
+    if mode == 'density':
+        # one cell every 4x4 pixels, empty cells are not drawn
+        extent = (x.min(), x.max(), 17, 23)
+        counts = downsample.density_grid(x, y, (max(n_bins // 4, 1), max(height // 4, 1)), \
+            extent[:2], extent[2:])
+        im = ax.imshow(np.ma.masked_equal(counts, 0), extent=extent, origin='lower', \
+            aspect='auto', interpolation='nearest', norm=LogNorm(), rasterized=True)
+        fig.colorbar(im, ax=ax, label='Samples')
+    else:
+        x_range = (x.min(), x.max())
+        for name, index in sorted(data.groupby(field_group, observed=True).indices.items()):
+            gx, gy = x[index], y[index]
+            if mode == 'pixels':
+                gx, gy = downsample.pixel_cells(gx, gy, (n_bins, height), x_range, (17, 23))
+            elif mode == 'minmax':
+                xc, y_min, y_max = downsample.minmax_bins(gx, gy, n_bins, x_range)
+                gx, gy = np.concatenate([xc, xc]), np.concatenate([y_min, y_max])
+            elif mode == 'lttb':
+                order = np.argsort(gx, kind='stable')
+                order = order[downsample.lttb(gx[order], gy[order], 2 * n_bins)]
+                gx, gy = gx[order], gy[order]
+            ax.plot(gx, gy, marker='o', linestyle='', ms=5, label=name, rasterized=True)
+        ax.legend(loc="lower left")
     ax.set_title(title)
     ax.set_ylim([17,23])
     ax.set_xlabel('Datetime')
     ax.set_ylabel('Magnitude')
 #    ax.grid()
 
-    plt.show()
-    # saving plot
-    plt.savefig(out_plot, dpi=200)
-    # closing plot
-    plt.close()
+def split_data(data, keys):
+    """Split 'data' in groups given by 'keys'.
 
-    return 0
+    Args:
+        data (pandas.DataFrame): 'get_data' output.
+        keys (list): BATCH_KEYS values ('station', 'filter', 'position',
+            'year' or 'month').
+
+    Returns:
+        (list): sorted (labels, group) tuples, where 'labels' are
+            (key, value) tuples and 'group' the rows of 'data' in group.
+    """
+    values = []
+    for key in keys:
+        if key == 'filter':
+            values.append(np.asarray(data['filter_name']).astype(str))
+        elif key == 'station':
+            values.append(np.asarray(data['station']).astype(str))
+        elif key == 'position':
+            values.append(data['position'].values)
+        else:
+            unit = 'datetime64[Y]' if key == 'year' else 'datetime64[M]'
+            values.append(data['datetime_obs'].values.astype('datetime64[s]').astype(unit).astype(str))
+    groups = []
+    for group_values, index in sorted(data.groupby(values, sort=True).indices.items()):
+        if not isinstance(group_values, tuple):
+            group_values = (group_values,)
+        groups.append((tuple(zip(keys, group_values)), data.iloc[index]))
+    return groups
+
+def _render_plot(data, out_plot, title, mode):
+    t_ini = time.perf_counter()
+    if 'station' in data:
+        plot_stations(data, out_plot, title, mode=mode)
+    else:
+        plot_data(data, out_plot, title, mode=mode)
+    return time.perf_counter() - t_ini
+
+def plot_batch(data, keys, out_dir, prefix='sky_measures', mode='auto', workers=1):
+    """Plot every group of 'data' given by 'keys' (see 'split_data').
+
+    Data are loaded once by the caller and plots are rendered in
+    'workers' processes. Output names are deterministic:
+    '<prefix>_<key>-<value>[_<key>-<value>...].jpg'.
+
+    Args:
+        data (pandas.DataFrame): 'get_data' output with datetime index and
+            'category_night' column.
+        keys (list): BATCH_KEYS values.
+        out_dir (str): output plot directory.
+        prefix (str): output plot name prefix.
+        mode (str): render mode (see 'plot_data').
+        workers (int): number of rendering processes.
+
+    Returns:
+        (list): (out_plot, rows, seconds) for every plot.
+    """
+    plots, titles, groups = [], [], []
+    for labels, group in split_data(data, keys):
+        name = '_'.join([prefix] + [f"{key}-{value}" for key, value in labels])
+        plots.append(os.path.join(out_dir, name + '.jpg'))
+        titles.append(name)
+        # only plotted columns are sent to rendering processes
+        groups.append(group[['sky_bright', 'category_night']])
+
+    modes = [mode] * len(plots)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            elapsed = list(pool.map(_render_plot, groups, plots, titles, modes))
+    else:
+        elapsed = list(map(_render_plot, groups, plots, titles, modes))
+
+    return [(p, len(g.index), t) for p, g, t in zip(plots, groups, elapsed)]
 
 def main():
     parser = argparse.ArgumentParser(prog='astmon.py',
@@ -234,10 +813,15 @@ def main():
 
                                      Query for one month in two years, all filters and all positions
                                      python astmon.py --years 2020 2021 --months 4 -v astmonDB.db
-          
+
+                                     Query from 20:00 to 04:00 UTC of the first night of every month in 2020
+                                     python astmon.py --years 2020 --days 1 --nights --hours 20 4 -v astmonDB.db
+
 ''')
     parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-    parser.add_argument("db_file", help="SQLite file database path")
+    parser.add_argument("db_file", nargs="+",
+                        help="""SQLite database files or directories of them, one per station
+                        (archive directories with '--source archive')""")
     parser.add_argument("--output_plot_dir",
                         action="store",
                         dest="output_plot_dir",
@@ -267,6 +851,17 @@ def main():
                         action="store",
                         dest="days",
                         help="Numerical list of days to plot (allowed values: [1, 31]) [default: %(default)s]")
+    parser.add_argument("--hours",
+                        nargs=2,
+                        default=None,
+                        type=float,
+                        dest="hours",
+                        help="""Daily UTC hour window (hour_ini, hour_final), crossing midnight if
+                        hour_final <= hour_ini (e.g. 20 4) [default: %(default)s]""")
+    parser.add_argument("--nights",
+                        action="store_true",
+                        dest="nights",
+                        help="Days are nights, from 12:00 to 12:00 UTC of next day [default: %(default)s]")
     parser.add_argument("--positions",
                         nargs="+", 
                         default=[],
@@ -279,48 +874,181 @@ def main():
                         action="store",
                         dest="filters",
                         help="List of filter names to plot (allowed values: ('B', 'V', 'R', 'I') [default: %(default)s]")
+    parser.add_argument("--resolution",
+                        action="store",
+                        dest="resolution",
+                        default="raw",
+                        choices=["raw", "night", "month"],
+                        help="""Raw measurements or precomputed per night/month statistics
+                        (median values are plotted) [default: %(default)s]""")
+    parser.add_argument("--source",
+                        action="store",
+                        dest="source",
+                        default="sqlite",
+                        choices=["sqlite", "archive"],
+                        help="""Read SQLite database or columnar archive exported by
+                        'archive.py' [default: %(default)s]""")
+    parser.add_argument("--render",
+                        action="store",
+                        dest="render",
+                        default="auto",
+                        choices=RENDER_MODES,
+                        help=f"""Plot every sample ('points'), one marker per occupied pixel ('pixels'),
+                        min/max per pixel column ('minmax'), LTTB downsampled series ('lttb') or
+                        sample density map ('density'). 'auto' uses 'pixels' above {MAX_POINTS}
+                        samples [default: %(default)s]""")
+    parser.add_argument("--thresholds",
+                        nargs=2,
+                        type=float,
+                        default=list(analytics.THRESHOLDS),
+                        action="store",
+                        dest="thresholds",
+                        metavar=("LOW", "HIGH"),
+                        help="""'photo_night' limits of good nights: bad below LOW, excellent
+                        from HIGH [default: %(default)s]""")
+    parser.add_argument("--stats",
+                        action="store_true",
+                        dest="stats",
+                        help="""Print per night statistics (dark time, median and best sky
+                        brightness, fraction of good samples) per position and filter
+                        instead of plotting""")
+    parser.add_argument("--format",
+                        action="store",
+                        dest="format",
+                        default="plot",
+                        choices=OUTPUT_FORMATS,
+                        help="""Plot data, write them as CSV or JSON file in output directory,
+                        or print a summary. Only 'plot' loads plotting modules [default: %(default)s]""")
+    parser.add_argument("--batch",
+                        nargs="+",
+                        default=[],
+                        action="store",
+                        dest="batch",
+                        choices=BATCH_KEYS,
+                        help="""Load data once and write one plot per group of these keys,
+                        e.g. '--batch filter position month' [default: %(default)s]""")
+    parser.add_argument("--workers",
+                        action="store",
+                        dest="workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes rendering '--batch' plots [default: %(default)s]")
+    parser.add_argument("--shard-workers",
+                        action="store",
+                        dest="shard_workers",
+                        type=int,
+                        default=1,
+                        help="""Number of processes querying shards of a sharded database
+                        (attached one after another if 1) [default: %(default)s]""")
+    parser.add_argument("--station-workers",
+                        action="store",
+                        dest="station_workers",
+                        type=int,
+                        default=None,
+                        help="""Number of processes querying stations (one per station if not
+                        given) [default: %(default)s]""")
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        dest="no_cache",
+                        help="Don't use the persistent query result cache")
+    parser.add_argument("--cache-dir",
+                        action="store",
+                        dest="cache_dir",
+                        default=cache.DEFAULT_DIR,
+                        help="Query result cache directory [default: %(default)s]")
+    parser.add_argument("--cache-size",
+                        action="store",
+                        dest="cache_size",
+                        type=int,
+                        default=cache.DEFAULT_SIZE // 2**20,
+                        help="Maximum query result cache size (MiB) [default: %(default)s]")
+    parser.add_argument("--profile",
+                        action="store",
+                        dest="profile",
+                        default=None,
+                        help="""Write a JSON report with time, CPU, rows and peak memory per
+                        stage and the query plan of every executed query [default: %(default)s]""")
+    parser.add_argument("--profile-stage",
+                        action="store",
+                        dest="profile_stage",
+                        default=None,
+                        choices=STAGES,
+                        help="""Run this stage under cProfile ('--profile' report name with
+                        '.pstats' extension) [default: %(default)s]""")
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="Show running and progress information [default: %(default)s].")
     args = parser.parse_args()
 
-    # args = vars(parser.parse_args())
-    print(args)
-
-    # return 2
+    if args.profile:
+        instrument.start('astmon.py', args.profile_stage)
+    try:
+        return run(args)
+    finally:
+        if args.profile and instrument.finish(args.profile) is not None:
+            print(f"INFO: Profile report written to '{args.profile}'")
 
-    data = get_data(args.db_file, args.period, args.years, args.months, \
-        args.days, args.positions, args.filters)
 
-    if len(data.index) == 0:
-        print("WARNING: No data registered for these parameters")
-        return 1
+def run(args):
+    """Run the program with parsed command line arguments 'args' (see 'main').
 
-    class_data = classify(data)
+    Returns:
+        (int): 0 if everything was fine, error code otherwise.
+    """
 
-    data['category_night'] = class_data
+    if args.batch and args.format != 'plot':
+        print("ERROR: '--batch' needs '--format plot'")
+        return 2
+    if args.stats and args.resolution != 'raw':
+        print("ERROR: '--stats' needs raw resolution")
+        return 2
+    if (args.months or args.days) and not (args.years or args.period):
+        print("WARNING: '--months' and '--days' are ignored without '--years'")
 
-    print(data.info())
-    print(data.head())
-    # return 1
+    try:
+        stations = find_databases(args.db_file, args.source)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 2
+    if 'station' in (args.batch or []) and len(stations) == 1:
+        print("ERROR: '--batch station' needs several stations")
+        return 2
 
-    # Changing str to datetime type
-    data['datetime'] = pd.to_datetime(data['datetime_obs'], dayfirst=True)
-    print(data)
+    t_ini = time.perf_counter()
+    query = dict(period=args.period, years=args.years, months=args.months, days=args.days, \
+        hours=args.hours, nights=args.nights, \
+        positions=args.positions, filters=args.filters, resolution=args.resolution, \
+        cache_dir=None if args.no_cache else args.cache_dir, cache_size=args.cache_size * 2**20, \
+        source=args.source, shard_workers=args.shard_workers)
+    try:
+        with instrument.stage('get_data'):
+            if len(stations) == 1:
+                data = get_data(next(iter(stations.values())), **query)
+            else:
+                # 'station' column tags rows of every database
+                data = get_data_stations(stations, args.station_workers, **query)
+    except sqlite3.OperationalError as e:
+        db_file = args.db_file[0] if len(stations) == 1 else 'DB_FILE'
+        print(f"ERROR: Query failed ({e}). Upgrade database with 'python schema.py {db_file}'.")
+        return 2
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Query failed ({e})")
+        return 2
 
-    print(f"Included filters = {np.unique(data['filter_name'].values)}")
-    print(f"Included positions = {np.unique(data['position'].values)}")
+    t_load = time.perf_counter() - t_ini
 
-    # Setting datetime as index for dataframe (useful for time series works)
-    data.set_index("datetime", inplace = True)
+    if len(data.index) == 0:
+        print("WARNING: No data registered for these parameters")
+        return 1
 
-    # classifying data: criterium photo_night
-    data['category_night'] = classify(data)
+    with instrument.stage('classify') as stage:
+        data['category_night'] = classify(data, args.thresholds)
+        stage['rows'] = len(data.index)
 
-    # Plotting 
+    # Output name (plots, CSV and JSON files)
     # input_name = os.path.splitext(os.path.split(args.input_file)[1])[0]
     input_name = 'sky_measures'
     if args.positions:
-        input_name += f"_positions-{','.join(args.filters)}"
+        input_name += f"_positions-{','.join(args.positions)}"
     else:
         input_name += "_positions-all"
 
@@ -329,10 +1057,78 @@ def main():
     else:
         input_name += "_filters-all"
 
+    if args.resolution != 'raw':
+        input_name += f"_{args.resolution}"
+
+    if len(stations) > 1:
+        input_name += f"_stations-{','.join(stations)}"
+
+    if args.stats:
+        with instrument.stage('stats') as stage:
+            stats = analytics.night_stats(data, args.thresholds)
+            stage['rows'] = len(data.index)
+        stats['night'] = pd.to_datetime(stats['night'], unit='s')
+        if args.format in ('csv', 'json'):
+            out_file = os.path.join(args.output_plot_dir, f"{input_name}_night_stats.{args.format}")
+            with instrument.stage('output'):
+                write_data(stats, out_file, args.format)
+            print(f"INFO: Night statistics written to '{out_file}'")
+            return 0
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(stats.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        return 0
+
+    # Changing epoch seconds to datetime type
+    data['datetime'] = pd.to_datetime(data['datetime_obs'], unit='s')
+
+    if args.format == 'summary':
+        for key, value in summary(data).items():
+            print(f"{key} = {value}")
+        print(f"Query time = {t_load:.3f} s")
+        return 0
+    if args.format in ('csv', 'json'):
+        out_file = os.path.join(args.output_plot_dir, f"{input_name}.{args.format}")
+        with instrument.stage('output') as stage:
+            write_data(data, out_file, args.format)
+            stage['rows'] = len(data.index)
+        print(f"INFO: {len(data.index)} rows written to '{out_file}'")
+        return 0
+
+    print(data.info())
+    print(data.head())
+    # return 1
+
+    print(data)
+
+    print(f"Included filters = {np.unique(np.asarray(data['filter_name']))}")
+    print(f"Included positions = {np.unique(data['position'].values)}")
+
+    # Setting datetime as index for dataframe (useful for time series works)
+    data.set_index("datetime", inplace = True)
+
+    # Plotting 
     out_plot = os.path.join(args.output_plot_dir, input_name + '.jpg')
     title = input_name
-    sns.set_style("darkgrid")
-    return plot_data(data, out_plot, title)
+    if not args.batch:
+        with instrument.stage('render') as stage:
+            stage['rows'] = len(data.index)
+            if 'station' in data:
+                # one panel per station
+                return plot_stations(data, out_plot, title, mode=args.render)
+            return plot_data(data, out_plot, title, mode=args.render)
+
+    prefix = 'sky_measures' if args.resolution == 'raw' else f"sky_measures_{args.resolution}"
+    t_ini = time.perf_counter()
+    with instrument.stage('batch render') as stage:
+        stage['rows'] = len(data.index)
+        results = plot_batch(data, args.batch, args.output_plot_dir, prefix, args.render, args.workers)
+    t_render = time.perf_counter() - t_ini
+    print(f"{'plot':<60} {'rows':>10} {'time (s)':>9}")
+    for plot, rows, elapsed in results:
+        print(f"{os.path.basename(plot):<60} {rows:>10} {elapsed:>9.2f}")
+    print(f"INFO: {len(results)} plots in {t_load + t_render:.2f} s " \
+        f"(data load {t_load:.2f} s, rendering {t_render:.2f} s with {args.workers} processes)")
+    return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Lectura original de ficheros .dat (referencia de 'bench_parser.py')
+
+import os
+import re
+
+import pandas as pd
+
+# good line example:
+# 01/05/2020 03:02:05      0      0.819527      20.402396
+LINE_PATTERN = re.compile(r'(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2}\s+\d\s+\d.\d+\s+\d+.\d+)')
+
+def fix_file(file_path):
+    """Procesa el fichero de entrada 'file_path'.
+    
+    Si hay líneas que no verifican el patrón esperado
+        01/05/2020 03:02:05      0      0.819527      20.402396
+    se ignoran. En ese caso se genera un fichero con las líneas
+    válidas y el orginal se copia un fichero con el mismo
+    nombre que el original pero con sufijo '.ori'.
+    
+    Args:
+        file_path (str): Ruta al fichero de datos.
+        
+    Returns:
+        (int): 0, si el procesado se realizó con éxito.
+               1, si la ruta al fichero de datos no es correcta.
+    """
+    if not os.path.isfile(file_path):
+        return 1
+
+    lines = [l for l in open(file_path).read().split('\n') if len(l) > 0]
+    good_lines = []
+    bad_lines = False
+    # good line example: 
+    # 01/05/2020 03:02:05      0      0.819527      20.402396
+    for l in lines:
+        value = LINE_PATTERN.findall(l)
+        if len(value):
+            good_lines.append(value[0])
+        else:
+            bad_lines = True
+            print(f"\tWARNING: Bad line '{l}'")
+    if bad_lines:
+        new_name = file_path.replace('.dat', '.dat.ori')
+        os.rename(file_path, new_name)
+        with open(file_path, 'w') as fout:
+            fout.write('\n'.join(good_lines))
+
+    return 0
+
+def proc_file(file_path):
+    """Lee el fichero "file_path" y procesa sólo las líneas que
+    verfican el patrón de campos válido. Agrega al pandas.dataframe
+    de salida los campos "position" y "filter", necesarios para
+    el análisis de la información.
+    
+    Args:
+        file_path (str): ruta al fichero de datos.
+        
+    Returns:
+        (pandas.dataframe): con los campos 
+            ['date', 'time', 'is_moon', 'photo_night', 'sky_bright',
+            'position', 'filter', 'datetime']
+            siendo este último la combinación de los dos primeros.
+
+            Devuelve None si el patrón del nombre del fichero no es correcto.
+    """
+    # file_path example pattern: abr2020pos2_V.dat
+    values = re.findall(r'/(\w{3})(\d{4})pos(\d{1})_(\w{1}).dat', file_path)
+    if not len(values):
+        print(f"WARNING: Non valid file data name pattern ('{file_path}')")
+        return None
+    # Fixed field with format file
+    data = pd.read_fwf(file_path, header=None, \
+        names=['date', 'time', 'is_moon', 'photo_night', 'sky_bright'], \
+        index_col=False)
+    # combining two columns
+    try:
+        dt = data['date'] + ' ' + data['time']
+    except TypeError:
+        print(data.info())
+        print(data.head())
+        return None
+
+    dt_size = len(dt.index)
+    
+    # Additional info
+    data['position'] = [int(values[0][2])] * dt_size
+    data['filter'] = [values[0][3]] * dt_size
+
+
+    # Changing str to datetime type
+    data['datetime'] = pd.to_datetime(dt, dayfirst=True)
+
+    return data
+
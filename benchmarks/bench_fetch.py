@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Benchmark: lectura de resultados (fetchall + DataFrame vs fetch_columns)
+
+import argparse
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import astmon
+import schema
+
+
+def fill_db(db_file, n_rows, seed=0):
+    """Create 'db_file' with 'n_rows' synthetic measurements (one every 5 s)."""
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_file)
+    schema.create_schema(conn)
+    t0 = 1577836800  # 2020-01-01
+    rows = zip((t0 + 5 * np.arange(n_rows)).tolist(),
+               rng.integers(0, 2, n_rows).tolist(),
+               rng.random(n_rows).round(6).tolist(),
+               rng.uniform(17, 22, n_rows).round(6).tolist(),
+               rng.integers(1, 11, n_rows).tolist(),
+               rng.choice(['B', 'V', 'R', 'I'], n_rows).tolist())
+    conn.executemany("INSERT INTO measurement (datetime_obs, is_moon, photo_night, sky_bright, "
+                     "position, filter_name) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def current(db_file):
+    """Previous path: SQLite formats dates, fetchall, strings parsed back."""
+    conn = sqlite3.connect(db_file)
+    c = conn.execute("SELECT datetime(datetime_obs, 'unixepoch') as datetime_obs, is_moon, "
+                     "photo_night, sky_bright, position, filter_name FROM measurement")
+    df = pd.DataFrame(c.fetchall(), columns=astmon.KEYWORDS)
+    conn.close()
+    # explicit format: 'dayfirst=True' misreads ISO strings in pandas >= 2
+    df['datetime'] = pd.to_datetime(df['datetime_obs'], format='%Y-%m-%d %H:%M:%S')
+    return df
+
+
+def columnar(db_file):
+    """New path: raw epoch values into typed arrays."""
+    conn = sqlite3.connect(db_file)
+    c = conn.execute(f"SELECT {', '.join(astmon.KEYWORDS)} FROM measurement")
+    df = astmon.fetch_columns(c)
+    conn.close()
+    df['datetime'] = pd.to_datetime(df['datetime_obs'], unit='s')
+    return df
+
+
+def measure(func, db_file):
+    # time and memory are measured in different runs (tracemalloc overhead)
+    t_ini = time.perf_counter()
+    func(db_file)
+    elapsed = time.perf_counter() - t_ini
+    tracemalloc.start()
+    df = func(db_file)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, df.memory_usage(deep=True).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_fetch.py',
+                                     description='Time and memory of get_data result paths.')
+    parser.add_argument("--rows", nargs="+", type=int, default=[100000, 1000000, 3000000],
+                        help="Number of rows in test database [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'path':>9} {'time (s)':>9} {'peak (MiB)':>11} {'frame (MiB)':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in args.rows:
+            db_file = os.path.join(tmp_dir, f'bench_{n_rows}.db')
+            fill_db(db_file, n_rows)
+            for name, func in (('current', current), ('columnar', columnar)):
+                elapsed, peak, size = measure(func, db_file)
+                print(f"{n_rows:>9} {name:>9} {elapsed:>9.2f} {peak / 2**20:>11.1f} {size / 2**20:>12.1f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Benchmark: tamaño y velocidad de consulta de las disposiciones 'standard' y 'compact'
+
+import argparse
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+import sqlite3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import astmon
+import schema
+import create_database
+import generate_data
+from run_benchmarks import QUERIES, best_of, quiet, environment
+
+
+def make_copy(db_file, out_file, layout):
+    """Copy 'db_file' into 'out_file' with 'layout', vacuumed."""
+    shutil.copyfile(db_file, out_file)
+    conn = sqlite3.connect(out_file)
+    schema.migrate(conn, verbose=False)
+    schema.convert_layout(conn, layout)
+    schema.analyze(conn)
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def object_sizes(db_file):
+    """Bytes used by every table and index (None if SQLite lacks 'dbstat')."""
+    conn = sqlite3.connect(db_file)
+    try:
+        return dict(conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"))
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def same_result(a, b):
+    """True if two 'get_data' results are identical (values and types)."""
+    if list(a.columns) != list(b.columns) or len(a.index) != len(b.index):
+        return False
+    # row order follows each table's key order
+    key = ['datetime_obs', 'position']
+    a = a.assign(filter_str=np.asarray(a['filter_name']).astype(str)).sort_values(key + ['filter_str'])
+    b = b.assign(filter_str=np.asarray(b['filter_name']).astype(str)).sort_values(key + ['filter_str'])
+    return all(a[c].dtype == b[c].dtype and
+               np.array_equal(a[c].values, b[c].values, equal_nan=a[c].dtype.kind == 'f')
+               for c in a.columns if c != 'filter_name')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_layout.py',
+                                     description='''Compare database size and get_data time of
+                                     standard and compact layouts, checking results are identical.''')
+    parser.add_argument("--db", default=None,
+                        help="Database to compare (synthetic data are generated if None) [default: %(default)s]")
+    parser.add_argument("--years", type=int, default=1,
+                        help="Years of synthetic data [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Repetitions per measure (best is kept) [default: %(default)s]")
+    parser.add_argument("--output", default=None,
+                        help="Output JSON file [default: %(default)s]")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = args.db
+        if db_file is None:
+            data_dir = os.path.join(tmp_dir, 'data')
+            generate_data.generate(data_dir, list(range(2020, 2020 + args.years)))
+            argv, sys.argv = sys.argv, ['create_database.py', data_dir, '--output_dir', tmp_dir]
+            try:
+                quiet(create_database.main)
+            finally:
+                sys.argv = argv
+            db_file = os.path.join(tmp_dir, 'astmonDB.db')
+
+        files = {layout: os.path.join(tmp_dir, f"{layout}.db") for layout in schema.LAYOUTS}
+        for layout, out_file in files.items():
+            make_copy(db_file, out_file, layout)
+        conn = sqlite3.connect(files['standard'])
+        n_rows, first_obs = conn.execute("SELECT count(*), min(datetime_obs) FROM measurement").fetchone()
+        conn.close()
+        first_year = int(str(np.datetime64(first_obs, 's').astype('datetime64[Y]')))
+
+        sizes = {layout: {'file_bytes': os.path.getsize(f), 'bytes_per_row': os.path.getsize(f) / n_rows,
+                          'objects': object_sizes(f)} for layout, f in files.items()}
+        print(f"{'layout':<10} {'size (MiB)':>11} {'bytes/row':>10}")
+        for layout, size in sizes.items():
+            print(f"{layout:<10} {size['file_bytes'] / 2**20:>11.1f} {size['bytes_per_row']:>10.1f}")
+            # tables and indexes over 1% of the file
+            for name, pgsize in (size['objects'] or {}).items():
+                if pgsize > size['file_bytes'] / 100:
+                    print(f"{'':<10} {pgsize / 2**20:>11.1f} {name}")
+        print(f"INFO: Compact layout is {sizes['compact']['file_bytes'] / sizes['standard']['file_bytes']:.0%} "
+              f"of standard layout size ({n_rows} rows)")
+
+        results = []
+        print(f"\n{'query':<32} {'rows':>9} {'standard (s)':>13} {'compact (s)':>12} {'ratio':>6} identical")
+        for name, query in QUERIES.items():
+            kwargs = query(first_year)
+            times, data = {}, {}
+            for layout, f in files.items():
+                times[layout], _, data[layout] = best_of(lambda: quiet(astmon.get_data, f, **kwargs),
+                                                         args.repeat)
+            identical = same_result(data['standard'], data['compact'])
+            results.append({'query': name, 'rows': len(data['standard'].index), 'seconds': times,
+                            'identical': identical})
+            print(f"{name:<32} {len(data['standard'].index):>9} {times['standard']:>13.3f} "
+                  f"{times['compact']:>12.3f} {times['compact'] / times['standard']:>6.2f} {identical}")
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'environment': environment(), 'rows': n_rows, 'sizes': sizes, 'queries': results},
+                      fout, indent=1)
+        print(f"INFO: Results written to '{args.output}'")
+    return 0 if all(r['identical'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
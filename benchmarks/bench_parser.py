@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Benchmark: lectura de ficheros .dat (fix_file + proc_file vs dat_parser)
+
+import argparse
+import os
+import sys
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import baseline_reader
+import dat_parser
+
+
+def write_dat(file_path, n_lines, seed=0):
+    """Write 'n_lines' synthetic Astmon lines (one every 5 s) to 'file_path'."""
+    rnd = random.Random(seed)
+    t = datetime(2020, 4, 1, 20)
+    with open(file_path, 'w') as fout:
+        for _ in range(n_lines):
+            fout.write(f"{t:%d/%m/%Y %H:%M:%S}      {rnd.randint(0, 1)}      "
+                       f"{rnd.random():.6f}      {rnd.uniform(17, 22):.6f}\n")
+            t += timedelta(seconds=5)
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t_ini = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t_ini
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_parser.py',
+                                     description='Lines/sec of the .dat readers.')
+    parser.add_argument("--lines", nargs="+", type=int, default=[10000, 100000, 1000000],
+                        help="Number of lines per test file [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Repetitions per measure (best is kept) [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f"{'lines':>10} {'current (lines/s)':>18} {'dat_parser (lines/s)':>21} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_lines in args.lines:
+            file_path = os.path.join(tmp_dir, 'abr2020pos2_V.dat')
+            write_dat(file_path, n_lines)
+
+            def current():
+                baseline_reader.fix_file(file_path)
+                baseline_reader.proc_file(file_path)
+
+            t_cur = timeit(current, args.repeat)
+            t_new = timeit(lambda: dat_parser.parse_dat(file_path), args.repeat)
+            print(f"{n_lines:>10} {n_lines / t_cur:>18.0f} {n_lines / t_new:>21.0f} {t_cur / t_new:>7.1f}x")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Benchmark: tiempo de dibujo y fidelidad de los modos de 'plot_data'
+
+import argparse
+import calendar
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import astmon
+import generate_data
+
+
+def make_data(n_points, year=2020, seed=0):
+    """Synthetic 'plot_data' input like data files of one year: 'n_points'
+    samples taken at night only (10 hours, see 'generate_data'), so every
+    day has a gap, with simulated moon, clouds and twilight, grouped in
+    three categories."""
+    rng = np.random.default_rng(seed)
+    nights = generate_data.night_samples(year, 1, 86400)[:1]
+    days = 366 if calendar.isleap(year) else 365
+    starts = nights[0] + 86400 * np.arange(days, dtype=np.int64)
+    offsets = rng.integers(0, generate_data.NIGHT_HOURS * 3600, n_points)
+    t = np.sort(starts[rng.integers(0, days, n_points)] + offsets)
+    _, photo, sky = generate_data.simulate(t, 3, 'V', rng)
+    data = pd.DataFrame({'sky_bright': sky, 'photo_night': photo},
+                        index=pd.to_datetime(t, unit='s'))
+    data['category_night'] = pd.Categorical.from_codes(
+        np.digitize(photo, [0.5, 0.9]).astype(np.int8), categories=['bad', 'good', 'excellent'])
+    return data
+
+
+def render(data, out_plot, mode):
+    t_ini = time.perf_counter()
+    astmon.plot_data(data, out_plot, f"{len(data.index)} points ({mode})", mode=mode)
+    return time.perf_counter() - t_ini
+
+
+def fidelity(out_plot, ref_plot):
+    """Fraction of pixels equal (within 10% per channel) to reference plot."""
+    img, ref = plt.imread(out_plot), plt.imread(ref_plot)
+    return float((np.abs(img - ref).max(axis=-1) < 0.1).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_render.py',
+                                     description='Render time and fidelity of plot_data modes.')
+    parser.add_argument("--points", nargs="+", type=int, default=[1000000, 10000000, 50000000],
+                        help="Number of plotted samples [default: %(default)s]")
+    parser.add_argument("--modes", nargs="+", default=['pixels', 'minmax', 'lttb', 'density'],
+                        choices=astmon.RENDER_MODES[1:],
+                        help="Compared render modes [default: %(default)s]")
+    parser.add_argument("--reference-max", type=int, default=10000000,
+                        help="""Largest series drawn with every sample ('points' mode), used as
+                        fidelity reference [default: %(default)s]""")
+    parser.add_argument("--keep", default=None,
+                        help="Directory to keep output plots [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'mode':>8} {'time (s)':>9} {'fidelity':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = args.keep or tmp_dir
+        os.makedirs(out_dir, exist_ok=True)
+        for n_points in args.points:
+            data = make_data(n_points)
+            ref_plot = None
+            if n_points <= args.reference_max:
+                ref_plot = os.path.join(out_dir, f"render_{n_points}_points.png")
+                elapsed = render(data, ref_plot, 'points')
+                print(f"{n_points:>10} {'points':>8} {elapsed:>9.2f} {1:>9.3f}")
+            for mode in args.modes:
+                if mode == 'points':
+                    continue
+                out_plot = os.path.join(out_dir, f"render_{n_points}_{mode}.png")
+                elapsed = render(data, out_plot, mode)
+                score = f"{fidelity(out_plot, ref_plot):>9.3f}" if ref_plot else f"{'-':>9}"
+                print(f"{n_points:>10} {mode:>8} {elapsed:>9.2f} {score}")
+            del data
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Benchmark: tiempo de arranque de los programas (python -X importtime)
+
+import argparse
+import os
+import re
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported when loading each program (they are
+# only needed to draw plots)
+FORBIDDEN = {'astmon': ['matplotlib', 'seaborn'],
+             'create_database': ['matplotlib', 'seaborn']}
+
+# "import time: self [us] | cumulative | imported package"
+IMPORT_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)')
+
+
+def import_times(module):
+    """Import 'module' in a new interpreter with '-X importtime'.
+
+    Returns:
+        (dict): {imported module: cumulative time (s)}.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_startup.py',
+                                     description='''Import time of astmon programs. It fails
+                                     (exit code 1) if plotting modules are imported at load
+                                     time or a program is slower than '--max-time'.''')
+    parser.add_argument("--modules", nargs="+", default=list(FORBIDDEN),
+                        help="Measured programs [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Repetitions per measure (best is kept) [default: %(default)s]")
+    parser.add_argument("--max-time", type=float, default=None,
+                        help="Maximum import time (s) of every program [default: %(default)s]")
+    parser.add_argument("--top", type=int, default=5,
+                        help="Number of slowest imported packages shown [default: %(default)s]")
+    args = parser.parse_args()
+
+    status = 0
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda t: t[module])
+        print(f"{module}: {best[module]:.3f} s")
+        top_level = {name: t for name, t in best.items() if '.' not in name and name != module}
+        for name, t in sorted(top_level.items(), key=lambda i: -i[1])[:args.top]:
+            print(f"\t{name:<20} {t:.3f} s")
+        loaded = [name for name in FORBIDDEN.get(module, []) if name in best]
+        if loaded:
+            print(f"FAIL: '{module}' imports {', '.join(loaded)} at load time")
+            status = 1
+        if args.max_time is not None and best[module] > args.max_time:
+            print(f"FAIL: '{module}' import time is over {args.max_time} s")
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
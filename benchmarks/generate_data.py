@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Generador de ficheros de datos sintéticos del Astmon (mmmYYYYposN_F.dat)
+
+import argparse
+import os
+import sys
+import calendar
+
+import numpy as np
+
+# Month abbreviations used in data file names (e.g. 'abr2020pos2_V.dat')
+MONTHS = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+FILTERS = ['B', 'V', 'R', 'I']
+# File name pattern allows one digit per position: 10 positions are 0-9
+POSITIONS = list(range(10))
+
+# Sky brightness model (mag/arcsec^2): dark sky at midnight, brighter at
+# twilight, with moon and clouds. Filter offsets make redder bands brighter.
+DARK_SKY = 21.6
+FILTER_OFFSET = {'B': 0.6, 'V': 0.0, 'R': -0.6, 'I': -1.3}
+SYNODIC_MONTH = 29.530589 * 86400
+NEW_MOON = 947182440  # 2000-01-06 18:14 UTC
+NIGHT_START, NIGHT_HOURS = 20, 10  # 20:00 to 06:00 (UTC)
+
+# Malformed lines, rejected by 'baseline_reader' and 'dat_parser'
+BAD_LINES = ['{date} {time}      {moon}      {photo}',  # missing field
+             '{date} {time}      {moon}      ------      ------',  # no values
+             'ERROR: sensor timeout at {date} {time}']  # log message
+
+
+def night_samples(year, month, step):
+    """Epochs of samples taken every 'step' seconds during the nights of a month."""
+    days = calendar.monthrange(year, month)[1]
+    first = int(np.datetime64(f"{year:04d}-{month:02d}-01", 's').astype(np.int64)) + NIGHT_START * 3600
+    starts = first + 86400 * np.arange(days, dtype=np.int64)
+    offsets = np.arange(0, NIGHT_HOURS * 3600, step, dtype=np.int64)
+    return (starts[:, None] + offsets[None, :]).ravel()
+
+
+def simulate(epoch, position, filter_name, rng):
+    """Simulated (is_moon, photo_night, sky_bright) values at 'epoch' samples."""
+    n = len(epoch)
+    phase = ((epoch - NEW_MOON) % SYNODIC_MONTH) / SYNODIC_MONTH
+    illumination = (1 - np.cos(2 * np.pi * phase)) / 2
+    # moon rises about 50 minutes later every day and stays up ~12 hours
+    hour = (epoch % 86400) / 3600
+    moon_rise = (18 + 24 * phase) % 24
+    is_moon = (((hour - moon_rise) % 24) < 12) & (illumination > 0.05)
+
+    # cloudiness changes from night to night, photometric quality follows it
+    night = (epoch - NIGHT_START * 3600) // 86400
+    nights, night_index = np.unique(night, return_inverse=True)
+    clouds = rng.beta(0.6, 1.2, len(nights))[night_index]
+    photo_night = np.clip(1 - clouds + rng.normal(0, 0.08, n), 0, 1)
+
+    twilight = np.minimum((hour - NIGHT_START) % 24, (NIGHT_START + NIGHT_HOURS - hour) % 24)
+    sky = DARK_SKY + FILTER_OFFSET[filter_name] + 0.05 * (position - 4.5) \
+        - 3.0 * np.exp(-twilight / 0.6) - 2.5 * illumination * is_moon - 1.5 * clouds \
+        + rng.normal(0, 0.08, n)
+    return is_moon.astype(np.int8), photo_night, sky
+
+
+def write_file(file_path, epoch, is_moon, photo_night, sky_bright, bad_fraction, rng):
+    """Write one data file. Returns (valid lines, malformed lines)."""
+    dt = epoch.astype('datetime64[s]').astype(object)
+    bad = rng.random(len(epoch)) < bad_fraction
+    kinds = rng.integers(0, len(BAD_LINES), len(epoch))
+    lines = []
+    for t, m, p, s, b, k in zip(dt, is_moon.tolist(), photo_night.tolist(), sky_bright.tolist(),
+                                bad.tolist(), kinds.tolist()):
+        date, time = f"{t:%d/%m/%Y}", f"{t:%H:%M:%S}"
+        if b:
+            lines.append(BAD_LINES[k].format(date=date, time=time, moon=m, photo=f"{p:.6f}"))
+        else:
+            lines.append(f"{date} {time}      {m}      {p:.6f}      {s:.6f}")
+    with open(file_path, 'w') as fout:
+        fout.write('\n'.join(lines) + '\n')
+    n_bad = int(bad.sum())
+    return len(lines) - n_bad, n_bad
+
+
+def generate(out_dir, years, positions=POSITIONS, filters=FILTERS, step=300, bad_fraction=0.001,
+             seed=0):
+    """Write synthetic data files, one per month, position and filter.
+
+    Args:
+        out_dir (str): output directory (created if needed).
+        years (list): generated years (every month is generated).
+        positions (list): positions (0 to 9).
+        filters (list): filter names.
+        step (int): seconds between samples.
+        bad_fraction (float): fraction of malformed lines.
+        seed (int): random generator seed (same seed, same files).
+
+    Returns:
+        (dict): 'files', 'rows' (valid lines) and 'bad_lines' counts.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    counts = {'files': 0, 'rows': 0, 'bad_lines': 0}
+    for year in years:
+        for month in range(1, 13):
+            epoch = night_samples(year, month, step)
+            for position in positions:
+                for filter_name in filters:
+                    values = simulate(epoch, position, filter_name, rng)
+                    file_path = os.path.join(out_dir, f"{MONTHS[month - 1]}{year}pos{position}_{filter_name}.dat")
+                    rows, bad = write_file(file_path, epoch, *values, bad_fraction, rng)
+                    counts['files'] += 1
+                    counts['rows'] += rows
+                    counts['bad_lines'] += bad
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='generate_data.py',
+                                     description='''It writes synthetic Astmon data files
+                                     (mmmYYYYposN_F.dat) for benchmarks and tests.''')
+    parser.add_argument("out_dir", help="Output directory")
+    parser.add_argument("--years", nargs="+", type=int, default=[2020],
+                        help="Generated years [default: %(default)s]")
+    parser.add_argument("--positions", nargs="+", type=int, default=POSITIONS,
+                        help="Positions (one digit) [default: %(default)s]")
+    parser.add_argument("--filters", nargs="+", default=FILTERS,
+                        help="Filters [default: %(default)s]")
+    parser.add_argument("--step", type=int, default=300,
+                        help="Seconds between samples [default: %(default)s]")
+    parser.add_argument("--bad-fraction", type=float, default=0.001,
+                        help="Fraction of malformed lines [default: %(default)s]")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random generator seed [default: %(default)s]")
+    args = parser.parse_args()
+
+    counts = generate(args.out_dir, args.years, args.positions, args.filters, args.step,
+                      args.bad_fraction, args.seed)
+    print(f"INFO: {counts['files']} files, {counts['rows']} rows and "
+          f"{counts['bad_lines']} malformed lines written to '{args.out_dir}'")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
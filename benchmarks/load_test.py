@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Prueba de carga del servicio HTTP ('server.py'): peticiones concurrentes sostenidas
+
+import argparse
+import os
+import sys
+import json
+import time
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Request mix (dashboard refresh): paths with '{year}' placeholders
+REQUESTS = ['/summary?years={year}&months=4',
+            '/data?years={year}&months=4&days=1,2,3&filters=B,V&format=csv',
+            '/data?years={year}&resolution=night&format=json',
+            '/stats?years={year}&months=4&filters=V&format=csv',
+            '/plot?years={year}&months=4&filters=B,V&render=minmax']
+
+
+def fetch(url, timeout=60):
+    """GET 'url'. Returns (HTTP status, body size, seconds)."""
+    t_ini = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status, size = e.code, 0
+    except OSError:
+        status, size = None, 0
+    return status, size, time.perf_counter() - t_ini
+
+
+def client(base_url, paths, end_time, offset):
+    """Send requests of 'paths' in a loop until 'end_time'. Returns
+    (path, status, seconds) records."""
+    records = []
+    i = offset
+    while time.perf_counter() < end_time:
+        path = paths[i % len(paths)]
+        status, _, seconds = fetch(base_url + path)
+        records.append((path, status, seconds))
+        i += 1
+    return records
+
+
+def start_server(db_file, port, workers):
+    """Start 'server.py' and wait until it answers. Returns the process."""
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), db_file,
+                                '--port', str(port), '--workers', str(workers)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/health"
+    for _ in range(300):
+        if fetch(url, timeout=1)[0] == 200:
+            return process
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def baseline(db_file, year, runs):
+    """Seconds of 'runs' 'astmon.py --format summary' processes (one
+    process per request, as before the server)."""
+    times = []
+    for _ in range(runs):
+        t_ini = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'astmon.py'), db_file, '--years', str(year),
+                        '--months', '4', '--format', 'summary', '--no-cache'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t_ini)
+    return times
+
+
+def report(records, elapsed):
+    """Throughput and latency percentiles (ms), overall and per path."""
+    def stats(rows):
+        ms = np.array([r[2] for r in rows]) * 1000
+        return {'requests': len(rows),
+                'errors': sum(1 for r in rows if r[1] != 200),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'max_ms': float(ms.max())}
+    result = dict(stats(records), seconds=elapsed, requests_per_second=len(records) / elapsed)
+    result['paths'] = {path: stats([r for r in records if r[0] == path])
+                       for path in sorted({r[0] for r in records})}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='load_test.py',
+                                     description='''Send concurrent dashboard-like requests to
+                                     'server.py' for a while and report throughput and latency.''')
+    parser.add_argument("--url", default=None,
+                        help="Base URL of a running server [default: %(default)s]")
+    parser.add_argument("--db", default=None,
+                        help="Database file: a server is started for the test [default: %(default)s]")
+    parser.add_argument("--port", type=int, default=8051,
+                        help="Port of the started server [default: %(default)s]")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Rendering processes of the started server [default: %(default)s]")
+    parser.add_argument("--year", type=int, default=2020,
+                        help="Queried year [default: %(default)s]")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="Concurrent clients [default: %(default)s]")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Test duration (s) [default: %(default)s]")
+    parser.add_argument("--baseline", type=int, default=0,
+                        help="Also time this number of 'astmon.py' processes [default: %(default)s]")
+    parser.add_argument("--output", default=None,
+                        help="Output JSON file [default: %(default)s]")
+    args = parser.parse_args()
+
+    if (args.url is None) == (args.db is None):
+        print("ERROR: Give '--url' or '--db'")
+        return 2
+
+    process = None
+    base_url = args.url
+    if args.db:
+        process = start_server(args.db, args.port, args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+    base_url = base_url.rstrip('/')
+    paths = [p.format(year=args.year) for p in REQUESTS]
+
+    try:
+        # first round out of measures: caches are warm in a running service
+        for path in paths:
+            fetch(base_url + path)
+        t_ini = time.perf_counter()
+        end_time = t_ini + args.duration
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(client, [base_url] * args.clients, [paths] * args.clients,
+                                    [end_time] * args.clients, range(args.clients)))
+        elapsed = time.perf_counter() - t_ini
+        with urllib.request.urlopen(base_url + '/metrics') as response:
+            server_metrics = json.load(response)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    result = report([r for records in results for r in records], elapsed)
+    result['clients'] = args.clients
+    result['server_metrics'] = server_metrics
+    print(f"{'path':<70} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for path, s in result['paths'].items():
+        print(f"{path:<70} {s['requests']:>8} {s['errors']:>6} {s['p50_ms']:>8.1f} "
+              f"{s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}")
+    print(f"INFO: {result['requests']} requests in {elapsed:.1f} s with {args.clients} clients: "
+          f"{result['requests_per_second']:.1f} requests/s, {result['errors']} errors, "
+          f"p95 {result['p95_ms']:.1f} ms")
+
+    if args.baseline and args.db:
+        times = baseline(args.db, args.year, args.baseline)
+        result['baseline_process_seconds'] = times
+        print(f"INFO: One 'astmon.py' process per request: {np.median(times):.2f} s (median of "
+              f"{len(times)}), {1 / np.median(times):.1f} requests/s")
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(result, fout, indent=1)
+        print(f"INFO: Results written to '{args.output}'")
+    return 0 if result['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Batería de benchmarks reproducibles (ingestión, consultas, clasificación y gráficas)
+
+import argparse
+import os
+import io
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import astmon
+import analytics
+import create_database
+import generate_data
+
+# Representative 'get_data' queries: name -> keyword arguments. Years are
+# relative to the first generated year.
+QUERIES = {
+    'period + filters': lambda y: dict(period=[f'{y}-03-01 00:00:00', f'{y}-04-15 23:59:59'],
+                                       filters=['B', 'V']),
+    'period + filters + positions': lambda y: dict(period=[f'{y}-03-01 00:00:00', f'{y}-04-15 23:59:59'],
+                                                   filters=['B', 'V'], positions=[3, 4, 5]),
+    'full year': lambda y: dict(years=[str(y)]),
+    'one month per year': lambda y: dict(years=[str(y)], months=['4']),
+    'many days (interval table)': lambda y: dict(years=[str(y)], days=[str(d) for d in range(1, 29, 2)]),
+    'full year per night (rollups)': lambda y: dict(years=[str(y)], resolution='night'),
+}
+
+
+def best_of(func, repeat):
+    """Best elapsed time (s) of 'repeat' calls to 'func' and its last result."""
+    times, result = [], None
+    for _ in range(repeat):
+        t_ini = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t_ini)
+    return min(times), times, result
+
+
+def quiet(func, *args, **kwargs):
+    """Call 'func' discarding its standard output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """Software and hardware description stored with results."""
+    return {'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def run_size(tmp_dir, n_years, args):
+    """Benchmarks for one data size. Returns list of result records."""
+    years = list(range(args.first_year, args.first_year + n_years))
+    data_dir = os.path.join(tmp_dir, f'data_{n_years}')
+    db_dir = os.path.join(tmp_dir, f'db_{n_years}')
+    counts = generate_data.generate(data_dir, years, args.positions, args.filters, args.step,
+                                    args.bad_fraction, args.seed)
+    size = f"{n_years}y"
+    results = []
+
+    def record(name, best, times, **extra):
+        results.append(dict(size=size, rows=counts['rows'], benchmark=name, seconds=best,
+                            runs=times, **extra))
+        print(f"{size:>5} {counts['rows']:>10} {name:<40} {best:>9.3f}")
+
+    # ingestion: a new database every run
+    def ingest():
+        argv = sys.argv
+        sys.argv = ['create_database.py', data_dir, '--output_dir', db_dir, '--overwrite', 'True',
+                    '--workers', str(args.workers)]
+        try:
+            return quiet(create_database.main)
+        finally:
+            sys.argv = argv
+    best, times, _ = best_of(ingest, args.repeat)
+    record('create_database.main', best, times, rows_per_second=counts['rows'] / best)
+
+    db_file = os.path.join(db_dir, 'astmonDB.db')
+    for name, query in QUERIES.items():
+        kwargs = query(years[0])
+        best, times, data = best_of(lambda: quiet(astmon.get_data, db_file, **kwargs), args.repeat)
+        record(f"get_data: {name}", best, times, result_rows=len(data.index))
+
+    data = quiet(astmon.get_data, db_file)
+    best, times, _ = best_of(lambda: astmon.classify(data), args.repeat)
+    record('classify', best, times)
+    best, times, _ = best_of(lambda: analytics.night_stats(data), args.repeat)
+    record('analytics.night_stats', best, times)
+
+    data['category_night'] = astmon.classify(data)
+    data.index = pd.to_datetime(data['datetime_obs'], unit='s')
+    out_plot = os.path.join(tmp_dir, 'plot.jpg')
+    # plotting modules are imported once, out of timed runs
+    astmon._pyplot()
+    for mode in args.render:
+        best, times, _ = best_of(lambda: astmon.plot_data(data, out_plot, 'benchmark', mode=mode),
+                                 args.repeat)
+        record(f"plot_data ({mode})", best, times)
+    return results
+
+
+def compare(results, previous_file):
+    """Print time ratio of every benchmark against a previous results file."""
+    with open(previous_file) as fin:
+        previous = {(r['size'], r['benchmark']): r['seconds'] for r in json.load(fin)['results']}
+    print(f"\nComparison with '{previous_file}' (previous / current time):")
+    for r in results:
+        old = previous.get((r['size'], r['benchmark']))
+        if old is not None:
+            print(f"{r['size']:>5} {r['benchmark']:<40} {old:>9.3f} {r['seconds']:>9.3f} {old / r['seconds']:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='run_benchmarks.py',
+                                     description='''Time ingestion, queries, classification and
+                                     plotting on synthetic data (see 'generate_data.py') and save
+                                     results as JSON.''')
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 2],
+                        help="Data sizes, in years of data [default: %(default)s]")
+    parser.add_argument("--first-year", type=int, default=2020,
+                        help="First generated year [default: %(default)s]")
+    parser.add_argument("--positions", nargs="+", type=int, default=generate_data.POSITIONS,
+                        help="Generated positions [default: %(default)s]")
+    parser.add_argument("--filters", nargs="+", default=generate_data.FILTERS,
+                        help="Generated filters [default: %(default)s]")
+    parser.add_argument("--step", type=int, default=300,
+                        help="Seconds between generated samples [default: %(default)s]")
+    parser.add_argument("--bad-fraction", type=float, default=0.001,
+                        help="Fraction of malformed lines [default: %(default)s]")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random generator seed [default: %(default)s]")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="'create_database.py' workers [default: %(default)s]")
+    parser.add_argument("--render", nargs="+", default=['auto'], choices=astmon.RENDER_MODES,
+                        help="Timed 'plot_data' render modes [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Repetitions per measure (best is kept) [default: %(default)s]")
+    parser.add_argument("--output", default='benchmark_results.json',
+                        help="Output JSON file [default: %(default)s]")
+    parser.add_argument("--compare", default=None,
+                        help="Previous JSON results file to compare with [default: %(default)s]")
+    args = parser.parse_args()
+
+    print(f"{'size':>5} {'rows':>10} {'benchmark':<40} {'time (s)':>9}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_years in args.sizes:
+            results.extend(run_size(tmp_dir, n_years, args))
+
+    with open(args.output, 'w') as fout:
+        json.dump({'environment': environment(), 'arguments': vars(args), 'results': results},
+                  fout, indent=1)
+    print(f"INFO: Results written to '{args.output}'")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Caché persistente de resultados de consultas del Astmon
+
+import os
+import json
+import hashlib
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+import schema
+import shards
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'astmon')
+DEFAULT_SIZE = 512 * 2**20  # bytes
+STATS_FILE = 'stats.json'
+LOCK_FILE = 'stats.lock'
+# Layout of stored results: entries of other formats are never loaded
+FORMAT = 2
+
+
+def db_version(db_file, conn=None):
+    """Token that changes whenever data stored in 'db_file' changes.
+
+    It combines ingest manifest summary, schema version and last stored
+    measurement (shard list of sharded databases). Databases without manifest use file size and
+    modification times (database and WAL files).
+
+    Args:
+        db_file (str): path to SQLite database file.
+        conn (sqlite3.Connection): open connection to 'db_file', left
+            open. A read-only connection is opened if None.
+
+    Returns:
+        (str): version token.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        marker = conn.execute("SELECT count(*), total(offset), total(size), max(mtime) "
+                              "FROM ingest_manifest").fetchone()
+        marker += conn.execute("SELECT max(version) FROM schema_version").fetchone()
+        if shards.is_catalog(conn):
+            # shards are rewritten by rebuilds too
+            marker += conn.execute("SELECT count(*), max(updated) FROM shard").fetchone()
+        else:
+            # stored table: 'max' optimization doesn't apply to views
+            marker += conn.execute(f"SELECT max(datetime_obs) FROM {schema.measurement_table(conn)}").fetchone()
+    except sqlite3.OperationalError:
+        marker = tuple((st.st_size, st.st_mtime_ns) for st in
+                       (os.stat(p) for p in (db_file, db_file + '-wal') if os.path.exists(p)))
+    finally:
+        if own_conn:
+            conn.close()
+    return hashlib.sha1(repr(marker).encode()).hexdigest()
+
+
+def query_key(db_file, ranges, positions, filters, resolution='raw', version=None):
+    """Cache key of a normalized query.
+
+    Args:
+        db_file (str): path to SQLite database file.
+        ranges (numpy.ndarray): merged epoch ranges given by 'astmon.epoch_ranges'.
+        positions (list): position values (order and type are normalized).
+        filters (list): filter names (order is normalized).
+        resolution (str): 'raw', 'night' or 'month'.
+        version (str): database version token. Computed if None.
+
+    Returns:
+        (str): hexadecimal key.
+    """
+    if version is None:
+        version = db_version(db_file)
+    query = {'db': os.path.realpath(db_file),
+             'format': FORMAT,
+             'version': version,
+             'ranges': None if ranges is None else np.asarray(ranges, dtype=np.int64).tolist(),
+             'positions': sorted({int(p) for p in positions or []}),
+             'filters': sorted(set(filters or [])),
+             'resolution': resolution}
+    return hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+
+def load(cache_dir, key):
+    """Get cached result for 'key'.
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): cache key given by 'query_key'.
+
+    Returns:
+        (pandas.DataFrame): cached result or None if not found.
+    """
+    path = os.path.join(cache_dir, f"{key}.npz")
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            columns = json.loads(str(npz['__columns__']))
+            data = {}
+            for name in columns:
+                if f"{name}__codes" in npz:
+                    data[name] = pd.Categorical.from_codes(npz[f"{name}__codes"],
+                                                           categories=npz[f"{name}__categories"].tolist())
+                else:
+                    data[name] = npz[name]
+    except (OSError, KeyError, ValueError):
+        return None
+    # least recently used entries are evicted first
+    os.utime(path)
+    return pd.DataFrame(data, columns=columns)
+
+
+def store(cache_dir, key, data, max_size=DEFAULT_SIZE):
+    """Store query result 'data' (binary columnar '.npz' file).
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): cache key given by 'query_key'.
+        data (pandas.DataFrame): query result.
+        max_size (int): maximum cache size (bytes).
+
+    Returns:
+        (int): number of evicted entries.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {'__columns__': np.array(json.dumps(list(data.columns)))}
+    for name in data.columns:
+        column = data[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays[f"{name}__codes"] = column.cat.codes.values
+            arrays[f"{name}__categories"] = np.array([str(c) for c in column.cat.categories], dtype=str)
+        else:
+            arrays[name] = column.values
+    # atomic write: readers never see partial files
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fout:
+        np.savez(fout, **arrays)
+    os.replace(tmp_path, os.path.join(cache_dir, f"{key}.npz"))
+    return evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size=DEFAULT_SIZE):
+    """Remove least recently used entries until cache size <= 'max_size'.
+
+    Args:
+        cache_dir (str): cache directory.
+        max_size (int): maximum cache size (bytes).
+
+    Returns:
+        (int): number of evicted entries.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            st = os.stat(os.path.join(cache_dir, name))
+            entries.append((st.st_mtime, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    evicted = 0
+    for _, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    return evicted
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Exclusive lock of file 'path' (created if needed) between processes."""
+    with open(path, 'a+') as flock:
+        if fcntl is not None:
+            fcntl.flock(flock, fcntl.LOCK_EX)
+        else:
+            flock.seek(0)
+            msvcrt.locking(flock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(flock, fcntl.LOCK_UN)
+            else:
+                flock.seek(0)
+                msvcrt.locking(flock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def update_stats(cache_dir, hit):
+    """Update persistent hit/miss counters.
+
+    Counters are read and written under a lock ('LOCK_FILE'), so
+    concurrent processes (CLI runs, server workers) never lose counts.
+
+    Args:
+        cache_dir (str): cache directory.
+        hit (bool): True for a cache hit, False for a miss.
+
+    Returns:
+        (dict): counters 'hits' and 'misses'.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, STATS_FILE)
+    with _locked(os.path.join(cache_dir, LOCK_FILE)):
+        try:
+            with open(path) as fin:
+                stats = json.load(fin)
+        except (OSError, ValueError):
+            stats = {'hits': 0, 'misses': 0}
+        stats['hits' if hit else 'misses'] += 1
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fout:
+            json.dump(stats, fout)
+        os.replace(tmp_path, path)
+    return stats
@@ -8,26 +8,47 @@ from datetime import datetime
 import os
 import glob
 import re
+import itertools
+import hashlib
+import io
+import time
+import signal
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # import seaborn as sns
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import matplotlib.dates as mdates
 
 import sqlite3
 
-def db_creation(db_file, overwrite=False):
+import dat_parser
+import schema
+import rollups
+import shards
+import instrument
+
+# Stages measured by 'instrument' ('--profile' report)
+STAGES = ['manifest', 'read', 'parse', 'hash', 'remove', 'insert', 'rollups', 'commit', 'analyze']
+
+def db_creation(db_file, overwrite=False, layout='standard', shard=None):
     """Crea la base de datos SQLite en la ruta dada por 'db_file'.
     La base de datos puede generarse de nuevo si el parámetro 
     'overwrite' es True.
+
+    Si se da 'shard', 'db_file' es el catálogo de una base de datos
+    fragmentada: las medidas se guardan en un fichero por periodo
+    ('shards.py'), que se crea al ingerir sus primeros datos.
     
     Args:
         db_file (str): ruta al fichero que contendrá la base de
             datos SQLite.
         overwrite (bool): si es True, se borra y se genera de 
             nuevo la base de datos con la tabla 'measurement'.
+        layout (str): disposición de las medidas en una base de datos
+            nueva ('schema.LAYOUTS').
+        shard (str): periodo de cada fragmento ('shards.PERIODS') o None
+            para una base de datos de un solo fichero.
     
     Returns: 
         (int): 0, si la creación de la base de datos fue exitosa.
@@ -39,159 +60,824 @@ def db_creation(db_file, overwrite=False):
             create = True
         else: 
             print("INFO: Database exists previously. Nothing done!")
+            conn = sqlite3.connect(db_file)
+            version = schema.get_schema_version(conn)
+            if shards.is_catalog(conn):
+                current_shard, current_layout = shards.get_config(conn)
+            else:
+                current_shard, current_layout = None, schema.get_layout(conn)
+            conn.close()
+            if shard is not None and current_shard != shard:
+                print(f"WARNING: Database shards are '{current_shard}'. " \
+                    f"'--shard {shard}' is only used by new databases.")
+            if version < schema.SCHEMA_VERSION:
+                print(f"WARNING: Database schema version is {version}. " \
+                    f"Upgrade it with 'python schema.py {db_file}'.")
+            if current_layout != layout:
+                print(f"WARNING: Database layout is '{current_layout}'. " \
+                    f"Convert it with 'python schema.py --layout {layout} {db_file}'.")
     else:
         create = True
     
     if create:
         conn = sqlite3.connect(db_file)
-        c = conn.cursor()
 
         print(f"INFO: Creating '{db_file}' SQLite database.")
-        # Create table measurement
-        c.execute('''CREATE TABLE measurement
-                    ([datetime_obs] INTEGER, 
-                    [is_moon] INTEGER, 
-                    [photo_night] REAL, 
-                    [sky_bright] REAL, 
-                    [position] INTEGER, 
-                    [filter_name] TEXT, 
-                    PRIMARY KEY ([datetime_obs], [position], [filter_name]))''')
-        conn.commit()
+        if shard:
+            # catalog: shards are created when data arrive
+            shards.create_catalog(conn, shard, layout)
+        else:
+            # Create table measurement (last schema version)
+            schema.create_schema(conn)
+            schema.convert_layout(conn, layout)
+        conn.close()
 
     return 0
 
-def fix_file(file_path):
-    """Procesa el fichero de entrada 'file_path'.
-    
-    Si hay líneas que no verifican el patrón esperado
-        01/05/2020 03:02:05      0      0.819527      20.402396
-    se ignoran. En ese caso se genera un fichero con las líneas
-    válidas y el orginal se copia un fichero con el mismo
-    nombre que el original pero con sufijo '.ori'.
-    
+def connect_db(db_file, journal_mode='WAL', synchronous='NORMAL', \
+    cache_size=-65536):
+    """Abre una conexión a la base de datos "db_file" ajustada para
+    inserciones masivas.
+
     Args:
-        file_path (str): Ruta al fichero de datos.
-        
+        db_file (str): ruta al fichero SQLite que contiene la base de datos.
+        journal_mode (str): valor de 'PRAGMA journal_mode'.
+        synchronous (str): valor de 'PRAGMA synchronous'.
+        cache_size (int): valor de 'PRAGMA cache_size' (negativo: KiB).
+
     Returns:
-        (int): 0, si el procesado se realizó con éxito.
-               1, si la ruta al fichero de datos no es correcta.
+        (sqlite3.Connection): conexión abierta.
     """
-    if not os.path.isfile(file_path):
-        return 1
-
-    lines = [l for l in open(file_path).read().split('\n') if len(l) > 0]
-    good_lines = []
-    bad_lines = False
-    # good line example: 
-    # 01/05/2020 03:02:05      0      0.819527      20.402396
-    for l in lines:
-        value = re.findall(r'(\d{2}/\d{2}/\d{4}\s+\d{2}:\d{2}:\d{2}\s+\d\s+\d.\d+\s+\d+.\d+)', l)
-        if len(value):
-            good_lines.append(value[0])
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"PRAGMA journal_mode = {journal_mode};")
+    conn.execute(f"PRAGMA synchronous = {synchronous};")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)};")
+    return conn
+
+def columns2db(columns, conn, batch_size=50000):
+    """
+    Inserta las columnas "columns" en la base de datos abierta en "conn".
+
+    Los duplicados se descartan mediante la clave primaria
+    (datetime_obs, position, filter_name) con 'INSERT OR IGNORE'.
+    No se hace commit: la transacción la gestiona quien llama.
+    En la disposición compacta ('schema.LAYOUTS') filtros y valores se
+    codifican antes de insertarlos. En un catálogo ('shards.py') cada
+    fila se inserta en el fragmento de su periodo.
+
+    Args:
+        columns (dict): columnas (listas o numpy.array) 'datetime_obs'
+            (epoch UTC en segundos), 'is_moon', 'photo_night', 'sky_bright',
+            'position' y 'filter_name' ('dat_parser.parse_dat' y 'add_keys').
+        conn (sqlite3.Connection): conexión a la base de datos.
+        batch_size (int): número de filas por llamada a 'executemany'.
+
+    Return:
+        (int): número de filas nuevas insertadas.
+
+    Raises:
+        ValueError: valores con más decimales de los que admite la
+            disposición compacta.
+    """
+    if shards.is_catalog(conn):
+        return sum(columns2db(part, shard_conn, batch_size) \
+            for shard_conn, part in shards.route(conn, columns))
+
+    keys = ('datetime_obs', 'is_moon', 'photo_night', 'sky_bright', 'position', 'filter_name')
+    table = schema.measurement_table(conn)
+    sql = f"""INSERT OR IGNORE INTO 
+    {table} (datetime_obs, is_moon, photo_night, sky_bright, position, filter_name) 
+    VALUES (?, ?, ?, ?, ?, ?)"""
+
+    instrument.explain(conn, sql)
+    with instrument.stage('insert') as stage:
+        stage['rows'] = len(columns['datetime_obs'])
+        # numpy arrays are converted to native Python types for sqlite3
+        values = {k: np.asarray(columns[k]).tolist() for k in keys[:2] + keys[4:5]}
+        if table == 'measurement':
+            values.update({k: np.asarray(columns[k]).tolist() for k in keys[2:4] + keys[5:]})
         else:
-            bad_lines = True
-            print(f"\tWARNING: Bad line '{l}'")
-    if bad_lines:
-        new_name = file_path.replace('.dat', '.dat.ori')
-        os.rename(file_path, new_name)
-        with open(file_path, 'w') as fout:
-            fout.write('\n'.join(good_lines))
+            values.update({k: schema.encode_values(columns[k]) for k in keys[2:4]})
+            values['filter_name'] = schema.encode_filters(conn, columns['filter_name'], create=True)
+        rows = zip(*[values[k] for k in keys])
+
+        changes = conn.total_changes
+        c = conn.cursor()
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            c.executemany(sql, batch)
 
+    return conn.total_changes - changes
+
+def manifest_creation(conn):
+    """Crea (si no existe) la tabla 'ingest_manifest', que guarda para
+    cada fichero ingerido su ruta, tamaño, fecha de modificación, hash
+    del contenido ingerido, posición (en bytes) hasta la que se ha
+    ingerido y rango temporal de sus datos.
+
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+
+    Returns:
+        (int): 0, si la creación fue exitosa.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS ingest_manifest
+                    ([path] TEXT PRIMARY KEY,
+                    [size] INTEGER,
+                    [mtime] REAL,
+                    [hash] TEXT,
+                    [offset] INTEGER,
+                    [first_obs] INTEGER,
+                    [last_obs] INTEGER)''')
     return 0
 
-def proc_file(file_path):
-    """Lee el fichero "file_path" y procesa sólo las líneas que
-    verfican el patrón de campos válido. Agrega al pandas.dataframe
-    de salida los campos "position" y "filter", necesarios para
-    el análisis de la información.
-    
+def read_manifest(conn):
+    """Lee la tabla 'ingest_manifest'.
+
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+
+    Returns:
+        (dict): entradas del manifiesto indexadas por ruta de fichero.
+    """
+    keys = ['path', 'size', 'mtime', 'hash', 'offset', 'first_obs', 'last_obs']
+    sql = f"SELECT {', '.join(keys)} FROM ingest_manifest"
+    instrument.explain(conn, sql)
+    c = conn.execute(sql)
+    return {row[0]: dict(zip(keys, row)) for row in c.fetchall()}
+
+def update_manifest(conn, entry):
+    """Inserta o actualiza la entrada 'entry' del manifiesto.
+
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        entry (dict): entrada con el formato de 'read_manifest'.
+
+    Returns:
+        (int): 0, si la operación resultó exitosa.
+    """
+    keys = ['path', 'size', 'mtime', 'hash', 'offset', 'first_obs', 'last_obs']
+    sql = f"INSERT OR REPLACE INTO ingest_manifest ({', '.join(keys)}) " \
+        f"VALUES ({', '.join(['?'] * len(keys))})"
+    instrument.explain(conn, sql)
+    conn.execute(sql, [entry[k] for k in keys])
+    return 0
+
+def content_hash(content, size):
+    """Calcula el hash SHA-1 de los primeros 'size' bytes de 'content'.
+
+    Args:
+        content (bytes or mmap.mmap): contenido de un fichero.
+        size (int): número de bytes considerados.
+
+    Returns:
+        (str): hash en hexadecimal.
+    """
+    with memoryview(content) as view:
+        return hashlib.sha1(view[:size]).hexdigest()
+
+def file_status(content, stat, entry):
+    """Compara el contenido actual de un fichero con su entrada del
+    manifiesto.
+
+    Args:
+        content (bytes or mmap.mmap): contenido actual del fichero.
+        stat (os.stat_result): estado actual del fichero.
+        entry (dict): entrada del manifiesto o None si no existe.
+
+    Returns:
+        (tuple): (estado, offset). Estado es 'new', 'unchanged',
+            'appended' o 'rewritten' (contenido ya ingerido modificado
+            o fichero truncado). Offset es la posición desde la que hay
+            que leer.
+    """
+    if entry is None:
+        return 'new', 0
+    if len(content) < entry['offset']:
+        return 'rewritten', 0
+    if content_hash(content, entry['offset']) != entry['hash']:
+        return 'rewritten', 0
+    if len(content) == entry['offset']:
+        return 'unchanged', entry['offset']
+    return 'appended', entry['offset']
+
+def add_keys(columns, keys):
+    """Añade a 'columns' las columnas 'position' y 'filter_name'.
+
+    Args:
+        columns (dict): columnas devueltas por 'dat_parser.parse_buffer'.
+        keys (tuple): (position, filter_name) de 'dat_parser.file_keys'.
+
+    Returns:
+        (dict): las mismas columnas de entrada.
+    """
+    size = len(columns['datetime_obs'])
+    columns['position'] = np.full(size, keys[0], dtype=np.int8)
+    columns['filter_name'] = np.full(size, keys[1])
+    return columns
+
+def update_obs_range(entry, datetime_obs):
+    """Amplía el rango temporal ('first_obs', 'last_obs') de la entrada
+    'entry' del manifiesto con las fechas 'datetime_obs'.
+
+    Args:
+        entry (dict): entrada del manifiesto.
+        datetime_obs (numpy.array): fechas (epoch) de las filas ingeridas.
+
+    Returns:
+        (dict): la entrada actualizada.
+    """
+    if len(datetime_obs) == 0:
+        return entry
+    first_obs = int(datetime_obs.min())
+    last_obs = int(datetime_obs.max())
+    if entry['first_obs'] is not None:
+        first_obs = min(first_obs, entry['first_obs'])
+        last_obs = max(last_obs, entry['last_obs'])
+    entry['first_obs'] = first_obs
+    entry['last_obs'] = last_obs
+    return entry
+
+def parse_file(file_path, entry=None):
+    """Lee el fichero 'file_path' teniendo en cuenta su entrada 'entry'
+    del manifiesto de ingestión.
+
+    Los ficheros sin cambios no se leen; si han crecido sólo se procesan
+    las líneas añadidas; si son nuevos o han sido reescritos se leen
+    completos. La lectura se hace en una sola pasada con
+    'dat_parser.parse_buffer' y el fichero nunca se reescribe: las líneas
+    no válidas sólo se notifican.
+
+    Pensada para ejecutarse en un proceso del pool de lectura: los
+    mensajes se devuelven para que el proceso principal los muestre
+    en orden.
+
     Args:
         file_path (str): ruta al fichero de datos.
-        
+        entry (dict): entrada del manifiesto ('read_manifest') o None.
+
     Returns:
-        (pandas.dataframe): con los campos 
-            ['date', 'time', 'is_moon', 'photo_night', 'sky_bright',
-            'position', 'filter', 'datetime']
-            siendo este último la combinación de los dos primeros.
+        (tuple): (file_path, columnas, mensajes, estado, entrada). Las
+            columnas tienen el formato de 'dat_parser.parse_dat' o son None
+            si no hay datos nuevos válidos. La entrada es la nueva entrada
+            del manifiesto para el fichero.
+    """
+    messages = []
+    columns = None
+    stat = os.stat(file_path)
+    if entry is not None and stat.st_size == entry['size'] \
+        and stat.st_mtime == entry['mtime']:
+        return file_path, None, messages, 'unchanged', entry
+
+    keys = dat_parser.file_keys(file_path)
+    with dat_parser.open_buffer(file_path) as buf:
+        status, offset = file_status(buf, stat, entry)
+        # Only complete lines are ingested: a trailing partial line (file
+        # still being written) is read next time, once it is completed.
+        new_offset = buf.rfind(b'\n') + 1
+        if status != 'unchanged':
+            if keys is None:
+                messages.append(f"WARNING: Non valid file data name pattern ('{file_path}')")
+            else:
+                with instrument.stage('parse') as stage:
+                    columns, bad_lines = dat_parser.parse_buffer(buf, offset, max(offset, new_offset))
+                    stage['rows'] = len(columns['datetime_obs'])
+                for line in bad_lines:
+                    messages.append(f"\tWARNING: Bad line '{line}'")
+                if bad_lines:
+                    messages.append(f"WARNING: Bad format for some line in file '{file_path}'.")
+        with instrument.stage('hash'):
+            sha = content_hash(buf, new_offset)
+        new_entry = {'path': file_path, 'size': len(buf),
+            'mtime': stat.st_mtime, 'hash': sha,
+            'offset': new_offset, 'first_obs': None, 'last_obs': None}
+
+    if status == 'appended' or status == 'unchanged':
+        new_entry['first_obs'] = entry['first_obs']
+        new_entry['last_obs'] = entry['last_obs']
+    if columns is not None and len(columns['datetime_obs']) == 0:
+        if status != 'appended':
+            messages.append(f"WARNING: Couldn't insert info from file '{file_path}' in database.")
+        columns = None
+    if columns is not None:
+        add_keys(columns, keys)
+        update_obs_range(new_entry, columns['datetime_obs'])
+
+    return file_path, columns, messages, status, new_entry
+
+def remove_file_data(conn, file_path, entry, dirty=None):
+    """Borra de la tabla 'measurement' los datos ingeridos previamente
+    desde 'file_path' (misma posición y filtro, dentro del rango
+    temporal registrado en el manifiesto).
 
-            Devuelve None si el patrón del nombre del fichero no es correcto.
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        file_path (str): ruta al fichero de datos.
+        entry (dict): entrada previa del manifiesto.
+        dirty (dict): rangos modificados, como en 'ingest_files'.
+
+    Returns:
+        (int): número de filas borradas.
     """
-    # file_path example pattern: abr2020pos2_V.dat
-    values = re.findall(r'/(\w{3})(\d{4})pos(\d{1})_(\w{1}).dat', file_path)
-    if not len(values):
-        print(f"WARNING: Non valid file data name pattern ('{file_path}')")
-        return None
-    # Fixed field with format file
-    data = pd.read_fwf(file_path, header=None, \
-        names=['date', 'time', 'is_moon', 'photo_night', 'sky_bright'], \
-        index_col=False)
-    # combining two columns
-    try:
-        dt = data['date'] + ' ' + data['time']
-    except TypeError:
-        print(data.info())
-        print(data.head())
-        return None
+    values = re.findall(r'(\w{3})(\d{4})pos(\d{1})_(\w{1}).dat', os.path.basename(file_path))
+    if not len(values) or entry['first_obs'] is None:
+        return 0
+    if shards.is_catalog(conn):
+        deleted = sum(remove_file_data(shard_conn, file_path, entry) for shard_conn in \
+            shards.overlapping_writers(conn, entry['first_obs'], entry['last_obs']))
+        if dirty is not None:
+            rollups.mark_range(dirty, (int(values[0][2]), values[0][3]), \
+                entry['first_obs'], entry['last_obs'])
+        return deleted
+    table = schema.measurement_table(conn)
+    filter_name = values[0][3]
+    if table != 'measurement':
+        filter_name = schema.encode_filters(conn, [filter_name])[0]
+    sql = f"""DELETE FROM {table} WHERE position = ? AND filter_name = ?
+        AND datetime_obs BETWEEN ? AND ?"""
+    params = (int(values[0][2]), filter_name, entry['first_obs'], entry['last_obs'])
+    instrument.explain(conn, sql, params)
+    with instrument.stage('remove') as stage:
+        c = conn.execute(sql, params)
+        stage['rows'] = c.rowcount
+    if dirty is not None:
+        rollups.mark_range(dirty, (int(values[0][2]), values[0][3]), \
+            entry['first_obs'], entry['last_obs'])
+    return c.rowcount
 
-    dt_size = len(dt.index)
-    
-    # Additional info
-    data['position'] = [int(values[0][2])] * dt_size
-    data['filter'] = [values[0][3]] * dt_size
+def restore_overlapping(conn, file_path, entry, batch_size=50000):
+    """Inserta de nuevo las filas de otros ficheros borradas por
+    'remove_file_data' al reescribirse 'file_path'.
 
+    Las filas no guardan el fichero del que proceden: se leen otra vez
+    los ficheros del manifiesto con la misma posición y filtro cuyo rango
+    temporal solapa con el borrado (p. ej. un volcado anual y los
+    ficheros mensuales) y se insertan sus filas de ese rango.
 
-    # Changing str to datetime type
-    data['datetime'] = pd.to_datetime(dt, dayfirst=True)
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        file_path (str): ruta al fichero de datos reescrito.
+        entry (dict): entrada previa del manifiesto de 'file_path'.
+        batch_size (int): número de filas por llamada a 'executemany'.
+
+    Returns:
+        (int): número de filas insertadas de nuevo.
+    """
+    keys = dat_parser.file_keys(file_path)
+    if keys is None or entry['first_obs'] is None:
+        return 0
+    first_obs, last_obs = entry['first_obs'], entry['last_obs']
+    paths = [path for path, other in sorted(read_manifest(conn).items()) \
+        if path != file_path and other['first_obs'] is not None \
+            and dat_parser.file_keys(path) == keys \
+            and other['first_obs'] <= last_obs and other['last_obs'] >= first_obs]
+    restored = 0
+    for source, columns, messages in read_sources(paths):
+        if columns is None:
+            continue
+        mask = (columns['datetime_obs'] >= first_obs) & (columns['datetime_obs'] <= last_obs)
+        restored += columns2db({k: v[mask] for k, v in columns.items()}, conn, batch_size)
+    return restored
+
+def stream_file(conn, file_path, entry=None, chunk_rows=100000, batch_size=50000, \
+    dirty=None):
+    """Ingiere el fichero 'file_path' por bloques de 'chunk_rows' líneas.
 
-    return data
+    Lectura, validación, conversión e inserción se encadenan bloque a
+    bloque (generadores), de modo que el consumo de memoria no depende
+    del tamaño del fichero. Respeta el manifiesto igual que 'parse_file'
+    y actualiza su entrada.
 
-def data2db(data, db_file):
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        file_path (str): ruta al fichero de datos.
+        entry (dict): entrada del manifiesto ('read_manifest') o None.
+        chunk_rows (int): número máximo de líneas por bloque.
+        batch_size (int): número de filas por llamada a 'executemany'.
+        dirty (dict): rangos modificados, como en 'ingest_files'.
+
+    Returns:
+        (int): número de filas nuevas insertadas.
     """
-    Inserta el contenido "data" en la base de datos SQLite "db_file".
-    
+    stat = os.stat(file_path)
+    if entry is not None and stat.st_size == entry['size'] \
+        and stat.st_mtime == entry['mtime']:
+        print(f"INFO: Skipping unchanged data file '{file_path}'")
+        return 0
+
+    with open(file_path, 'rb') as fin:
+        return stream_source(conn, file_path, fin, stat, entry, chunk_rows, \
+            batch_size, dirty)
+
+def _parsed_blocks(fin, chunk_rows, sha):
+    """Bloques de 'fin' ya analizados: (bytes completos, bytes leídos,
+    columnas, líneas no válidas). Actualiza 'sha' con las líneas
+    completas."""
+    for block in dat_parser.iter_blocks(fin, chunk_rows):
+        # Only complete lines are ingested (see 'parse_file'): an unfinished
+        # line is parsed when it is completed
+        complete = block.rfind(b'\n') + 1
+        with memoryview(block) as view:
+            sha.update(view[:complete])
+        with instrument.stage('parse') as stage:
+            columns, bad_lines = dat_parser.parse_buffer(block, 0, complete)
+            stage['rows'] = len(columns['datetime_obs'])
+        yield complete, len(block), columns, bad_lines
+
+def stream_source(conn, source, fin, stat, entry=None, chunk_rows=100000, \
+    batch_size=50000, dirty=None, archive=False):
+    """Ingiere por bloques el flujo de datos 'fin' (fichero de datos o
+    miembro de un archivo comprimido) llamado 'source' en el manifiesto.
+
+    Si 'archive' es True, lectura (descompresión) y análisis de los
+    bloques se hacen en un hilo aparte ('dat_parser.prefetch'), mientras
+    el bloque anterior se inserta en la base de datos.
+
     Args:
-        data (pandas.dataframe): dataframe con información a insertar.
-        db_file (str): ruta al fichero SQLite que contiene la base de datos.
-    
-    Return:
-        (int): 0 si la operación resultó exitosa.
+        conn (sqlite3.Connection): conexión a la base de datos.
+        source (str): ruta al fichero de datos o nombre del miembro
+            ('dat_parser.member_path').
+        fin (file): flujo binario con el contenido de 'source'.
+        stat (os.stat_result): estado del fichero de datos (del archivo
+            comprimido si 'archive' es True).
+        entry (dict): entrada del manifiesto ('read_manifest') o None.
+        chunk_rows (int): número máximo de líneas por bloque.
+        batch_size (int): número de filas por llamada a 'executemany'.
+        dirty (dict): rangos modificados, como en 'ingest_files'.
+        archive (bool): 'fin' es un miembro de un archivo comprimido.
+
+    Returns:
+        (int): número de filas nuevas insertadas.
     """
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    keys = dat_parser.file_keys(source)
+    inserted = 0
+    # Checking ingested prefix without loading it in memory
+    status, offset, sha = 'new', 0, hashlib.sha1()
+    if entry is not None:
+        status = 'appended'
+        remaining = entry['offset']
+        prefix = []
+        while remaining:
+            block = fin.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            sha.update(block)
+            remaining -= len(block)
+            if archive:
+                prefix.append(block)
+        if remaining or sha.hexdigest() != entry['hash']:
+            status, sha = 'rewritten', hashlib.sha1()
+            if archive:
+                # compressed streams can't seek back: member is read again
+                # from memory (rewritten members only)
+                fin = io.BytesIO(b''.join(prefix) + fin.read())
+            else:
+                fin.seek(0)
+        else:
+            offset = entry['offset']
+            # compressed size is not known in advance
+            if (not fin.peek(1)) if archive else stat.st_size == offset:
+                status = 'unchanged'
+
+    new_entry = {'path': source, 'size': stat.st_size,
+        'mtime': stat.st_mtime, 'hash': sha.hexdigest(), 'offset': offset,
+        'first_obs': None, 'last_obs': None}
+    if status in ('appended', 'unchanged'):
+        new_entry['first_obs'] = entry['first_obs']
+        new_entry['last_obs'] = entry['last_obs']
+
+    if status == 'unchanged':
+        print(f"INFO: Skipping unchanged data file '{source}'")
+    elif keys is None:
+        print(f"WARNING: Non valid file data name pattern ('{source}')")
+    else:
+        print(f"INFO: Working on {status} data file '{source}'")
+        if status == 'rewritten':
+            deleted = remove_file_data(conn, source, entry, dirty)
+            print(f"INFO: {deleted} rows from previous version of '{source}' removed.")
+            restored = restore_overlapping(conn, source, entry, batch_size)
+            if restored:
+                print(f"INFO: {restored} rows of other files overlapping '{source}' restored.")
+        bad_format = False
+        new_entry['size'] = offset
+        blocks = _parsed_blocks(fin, chunk_rows, sha)
+        if archive:
+            # decompression and parsing overlap with insertion
+            blocks = dat_parser.prefetch(blocks)
+        for complete, size, columns, bad_lines in blocks:
+            new_entry['offset'] += complete
+            new_entry['size'] += size
+            for line in bad_lines:
+                print(f"\tWARNING: Bad line '{line}'")
+            bad_format = bad_format or bool(bad_lines)
+            inserted += columns2db(add_keys(columns, keys), conn, batch_size)
+            if dirty is not None:
+                rollups.mark_dirty(dirty, columns)
+            update_obs_range(new_entry, columns['datetime_obs'])
+        if bad_format:
+            print(f"WARNING: Bad format for some line in file '{source}'.")
+        new_entry['hash'] = sha.hexdigest()
+        if archive:
+            # unchanged archives are skipped by their own entry
+            new_entry['size'] = stat.st_size
+
+    if new_entry != entry:
+        update_manifest(conn, new_entry)
+
+    return inserted
+
+def archive_changed(manifest, archive_path, stat):
+    """True if archive 'archive_path' (with 'stat') has changed since it
+    was completely ingested (see 'ingest_archive')."""
+    entry = manifest.get(archive_path)
+    return entry is None or stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']
+
+def ingest_archive(conn, archive_path, manifest, chunk_rows=100000, batch_size=50000, \
+    dirty=None):
+    """Ingiere los ficheros de datos contenidos en el archivo comprimido
+    'archive_path' ('.dat.gz', '.zip', '.tar', '.tar.gz' o '.tgz') sin
+    extraerlos a disco.
+
+    Cada miembro se lee como un flujo ('dat_parser.iter_members') y se
+    ingiere con 'stream_source', con su propia entrada en el manifiesto
+    ('archivo::miembro'): de los miembros ya ingeridos sólo se procesan
+    las líneas nuevas. Un archivo sin cambios (tamaño y fecha de
+    modificación de su entrada en el manifiesto, que sólo se escribe al
+    terminar de leerlo) no se descomprime.
+
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        archive_path (str): ruta al archivo comprimido.
+        manifest (dict): manifiesto ('read_manifest').
+        chunk_rows (int): número máximo de líneas por bloque.
+        batch_size (int): número de filas por llamada a 'executemany'.
+        dirty (dict): rangos modificados, como en 'ingest_files'.
+
+    Returns:
+        (int): número de filas nuevas insertadas.
 
-    # Create table measurement (one sentence each time)
-    c.execute("BEGIN TRANSACTION;")
-    sql = """INSERT INTO 
-    'measurement' ('datetime_obs', 'is_moon', 'photo_night', 'sky_bright', 'position', 'filter_name') 
-    VALUES
+    Raises:
+        OSError, EOFError, zipfile.BadZipFile, tarfile.TarError: archivo
+            dañado o incompleto.
     """
-    values = []
-    for index, row in data.iterrows():
-        # checking if data was previously inserted
-        sql_check = "SELECT count(*) FROM measurement WHERE "
-        sql_check += f"datetime_obs = strftime ('%s', '{row['datetime']}') AND position = {row['position']} AND filter_name = '{row['filter']}';"
-        c.execute(sql_check)
-        rows = c.fetchall()
-        if rows[0][0] > 0: # previously inserted => do nothing
+    stat = os.stat(archive_path)
+    if not archive_changed(manifest, archive_path, stat):
+        print(f"INFO: Skipping unchanged archive '{archive_path}'")
+        return 0
+
+    print(f"INFO: Working on archive '{archive_path}'")
+    inserted = 0
+    members = 0
+    for name, fin in dat_parser.iter_members(archive_path):
+        source = dat_parser.member_path(archive_path, name)
+        inserted += stream_source(conn, source, fin, stat, manifest.get(source), \
+            chunk_rows, batch_size, dirty, archive=True)
+        members += 1
+    if not members:
+        print(f"WARNING: No data files ('*.dat') in archive '{archive_path}'")
+    update_manifest(conn, {'path': archive_path, 'size': stat.st_size, \
+        'mtime': stat.st_mtime, 'hash': None, 'offset': stat.st_size, \
+        'first_obs': None, 'last_obs': None})
+    return inserted
+
+def ingest_files(conn, file_paths, entries, workers=1, batch_size=50000, dirty=None):
+    """Lee los ficheros 'file_paths' (en paralelo si 'workers' > 1) e
+    inserta sus datos en la base de datos abierta en 'conn'.
+
+    Los resultados se escriben en el orden de 'file_paths', sea cual sea
+    el orden en que terminen los procesos de lectura.
+
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos.
+        file_paths (list): rutas a los ficheros de datos.
+        entries (list): entradas del manifiesto para cada fichero (o None).
+        workers (int): número de procesos de lectura.
+        batch_size (int): número de filas por llamada a 'executemany'.
+        dirty (dict): si se da, se anotan en él los rangos temporales
+            modificados por clave (position, filter_name) para actualizar
+            las tablas de estadísticas ('rollups.mark_dirty').
+
+    Returns:
+        (int): número de filas nuevas insertadas.
+    """
+    inserted = 0
+    # Files are parsed in worker processes, but results are consumed
+    # (and written) in sorted file order, whatever the completion order.
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        parsed = pool.map(parse_file, file_paths, entries)
+    else:
+        parsed = map(parse_file, file_paths, entries)
+    # time waiting for parsed files (parsing itself when 'workers' is 1)
+    parsed = instrument.iterate('read', parsed)
+
+    try:
+        for (file_data, columns, messages, status, entry), old_entry in zip(parsed, entries):
+            if status == 'unchanged':
+                print(f"INFO: Skipping unchanged data file '{file_data}'")
+            else:
+                print(f"INFO: Working on {status} data file '{file_data}'")
+            for message in messages:
+                print(message)
+            if status == 'rewritten':
+                deleted = remove_file_data(conn, file_data, old_entry, dirty)
+                print(f"INFO: {deleted} rows from previous version of '{file_data}' removed.")
+                restored = restore_overlapping(conn, file_data, old_entry, batch_size)
+                if restored:
+                    print(f"INFO: {restored} rows of other files overlapping '{file_data}' restored.")
+            if columns is not None:
+                # insert file in database
+                inserted += columns2db(columns, conn, batch_size)
+                if dirty is not None:
+                    rollups.mark_dirty(dirty, columns)
+            if entry != old_entry:
+                update_manifest(conn, entry)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return inserted
+
+def rebuild_shards(conn, names, batch_size=50000, dirty=None):
+    """Vacía los fragmentos 'names' del catálogo abierto en 'conn' y los
+    llena de nuevo con las filas de su periodo.
+
+    Se leen completos los ficheros del manifiesto cuyo rango temporal
+    solapa con algún fragmento y sólo se insertan las filas de esos
+    fragmentos: el resto de fragmentos y el manifiesto no se modifican.
+
+    Args:
+        conn (sqlite3.Connection): conexión al catálogo.
+        names (list): nombres de los fragmentos ('YYYY' o 'YYYY-MM').
+        batch_size (int): número de filas por llamada a 'executemany'.
+        dirty (dict): rangos modificados, como en 'ingest_files'.
+
+    Returns:
+        (int): número de filas insertadas.
+    """
+    period = shards.get_config(conn)[0]
+    ranges = [shards.shard_range(name) for name in names]
+    for name in names:
+        shards.reset(conn, name)
+        print(f"INFO: Shard '{name}' emptied")
+    if dirty is not None:
+        # rollups of keys with no data left are removed too
+        for position, filter_name in conn.execute("SELECT DISTINCT position, filter_name FROM rollup_month"):
+            for first_obs, last_obs in ranges:
+                rollups.mark_range(dirty, (position, filter_name), first_obs, last_obs)
+
+    inserted = 0
+    paths = [path for path, entry in sorted(read_manifest(conn).items()) \
+        if entry['first_obs'] is not None and any(entry['first_obs'] <= last_obs \
+            and entry['last_obs'] >= first_obs for first_obs, last_obs in ranges)]
+    for file_path, columns, messages in read_sources(paths):
+        for message in messages:
+            print(message)
+        if columns is None:
             continue
+        # rows of other shards are left out
+        mask = np.isin(shards.shard_names(columns['datetime_obs'], period), names)
+        columns = {k: v[mask] for k, v in columns.items()}
+        inserted += columns2db(columns, conn, batch_size)
+        if dirty is not None:
+            rollups.mark_dirty(dirty, columns)
+    return inserted
 
-        print(f"sql_check = '{sql_check}'")
+def read_sources(paths):
+    """Lee completos los ficheros de datos o miembros de archivos
+    comprimidos 'paths' (rutas del manifiesto). Cada archivo comprimido
+    se recorre una sola vez.
 
-        # new value for inserting in database
-        str_val = f"(strftime ('%s', '{row['datetime']}'), {row['is_moon']}, {row['photo_night']}, {row['sky_bright']}, {row['position']}, '{row['filter']}')"
-        values.append(str_val)
-        # if index ==  2: # for testing purposes
-        #     break
-    if len(values) > 0:
-        sql = f"{sql} {','.join(values)};" 
-        # print(sql) # Testing
-        c.execute(sql)
-        c.execute('COMMIT;')
-        # conn.commit()
+    Args:
+        paths (list): rutas de ficheros y miembros ('archivo::miembro').
 
-    return 0
+    Yields:
+        (tuple): (ruta, columnas, mensajes). Las columnas tienen el
+            formato de 'parse_file' (None si no hay datos válidos).
+    """
+    members = {}
+    for path in paths:
+        archive_path, _, name = path.partition(dat_parser.MEMBER_SEPARATOR)
+        if name:
+            members.setdefault(archive_path, set()).add(name)
+        elif not os.path.exists(path):
+            print(f"WARNING: Data file '{path}' not found")
+        else:
+            print(f"INFO: Working on data file '{path}'")
+            file_path, columns, messages, _, _ = parse_file(path)
+            yield file_path, columns, messages
+    for archive_path, names in sorted(members.items()):
+        if not os.path.exists(archive_path):
+            print(f"WARNING: Archive '{archive_path}' not found")
+            continue
+        print(f"INFO: Working on archive '{archive_path}'")
+        for name, fin in dat_parser.iter_members(archive_path):
+            if name not in names:
+                continue
+            source = dat_parser.member_path(archive_path, name)
+            data = fin.read()
+            with instrument.stage('parse') as stage:
+                # complete lines only, like 'parse_file'
+                columns, bad_lines = dat_parser.parse_buffer(data, 0, data.rfind(b'\n') + 1)
+                stage['rows'] = len(columns['datetime_obs'])
+            messages = [f"\tWARNING: Bad line '{line}'" for line in bad_lines]
+            keys = dat_parser.file_keys(source)
+            if keys is None or not len(columns['datetime_obs']):
+                columns = None
+            else:
+                add_keys(columns, keys)
+            yield source, columns, messages
+
+def scan_data_dir(data_dir):
+    """Devuelve el estado de los ficheros de datos ('*.dat') y archivos
+    comprimidos ('dat_parser.ARCHIVE_SUFFIXES') de 'data_dir'.
+
+    Args:
+        data_dir (str): directorio de ficheros de datos.
+
+    Returns:
+        (dict): {ruta absoluta: os.stat_result}.
+    """
+    files = {}
+    with os.scandir(data_dir) as it:
+        for item in it:
+            if (item.name.endswith('.dat') or dat_parser.is_archive(item.name)) \
+                and item.is_file():
+                files[os.path.abspath(item.path)] = item.stat()
+    return files
+
+def watch_dir(conn, data_dir, interval=0.5, chunk_rows=100000, batch_size=50000, \
+    cycles=None):
+    """Vigila el directorio 'data_dir' e ingiere las líneas nuevas de
+    sus ficheros de datos hasta recibir Ctrl+C (o SIGTERM).
+
+    Cada 'interval' segundos se comparan tamaño y fecha de modificación
+    de los ficheros con el manifiesto y sólo los ficheros nuevos o
+    modificados se leen ('stream_file', desde la última línea ingerida).
+    Cada ciclo con cambios se confirma en una transacción corta sobre la
+    misma conexión: en modo WAL los lectores ('astmon.py') consultan la
+    base de datos mientras tanto sin bloquearse.
 
+    Args:
+        conn (sqlite3.Connection): conexión a la base de datos (modo WAL).
+        data_dir (str): directorio de ficheros de datos.
+        interval (float): segundos entre comprobaciones.
+        chunk_rows (int): número máximo de líneas por bloque.
+        batch_size (int): número de filas por llamada a 'executemany'.
+        cycles (int): número de comprobaciones (None: sin límite).
+
+    Returns:
+        (int): número de filas nuevas insertadas.
+    """
+    manifest = read_manifest(conn)
+    use_rollups = schema.get_schema_version(conn) >= 3
+    inserted = 0
+    cycle = 0
+    print(f"INFO: Watching '{data_dir}' every {interval} s (Ctrl+C to stop)")
+    try:
+        while cycles is None or cycle < cycles:
+            cycle += 1
+            t_ini = time.perf_counter()
+            changed = []
+            for file_path, stat in sorted(scan_data_dir(data_dir).items()):
+                entry = manifest.get(file_path)
+                if dat_parser.is_archive(file_path):
+                    if archive_changed(manifest, file_path, stat):
+                        changed.append(file_path)
+                elif entry is None or stat.st_size != entry['size'] \
+                    or stat.st_mtime != entry['mtime']:
+                    changed.append(file_path)
+            if changed:
+                dirty = {} if use_rollups else None
+                rows = 0
+                for file_path in changed:
+                    if not dat_parser.is_archive(file_path):
+                        rows += stream_file(conn, file_path, manifest.get(file_path), \
+                            chunk_rows, batch_size, dirty)
+                        continue
+                    try:
+                        rows += ingest_archive(conn, file_path, manifest, chunk_rows, \
+                            batch_size, dirty)
+                    except dat_parser.ARCHIVE_ERRORS as e:
+                        # e.g. still being copied: read again next cycle
+                        print(f"WARNING: Couldn't read archive '{file_path}' ({e})")
+                if dirty:
+                    shards.refresh_rollups(conn, dirty)
+                shards.commit(conn)
+                manifest = read_manifest(conn)
+                inserted += rows
+                print(f"INFO: {rows} new rows from {len(changed)} files " \
+                    f"in {time.perf_counter() - t_ini:.3f} s")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        # uncommitted cycle is discarded (data and manifest together)
+        conn.rollback()
+        print(f"INFO: Watch stopped ({inserted} new rows inserted)")
 
+    return inserted
 
 def main():
     parser = argparse.ArgumentParser(prog='create_database.py',
@@ -214,10 +900,111 @@ def main():
                         default=False,
                         help="""It True, database is dropped, dreated and 
                         filled again [default: %(default)s]""")
+    parser.add_argument("--workers",
+                        action="store",
+                        dest="workers",
+                        type=int,
+                        default=1,
+                        help="Number of processes parsing data files [default: %(default)s]")
+    parser.add_argument("--chunk-rows",
+                        action="store",
+                        dest="chunk_rows",
+                        type=int,
+                        default=0,
+                        help="""If greater than 0, files are streamed in chunks of this
+                        number of lines, keeping memory usage bounded [default: %(default)s]""")
+    parser.add_argument("--batch-size",
+                        action="store",
+                        dest="batch_size",
+                        type=int,
+                        default=50000,
+                        help="Rows per 'executemany' call [default: %(default)s]")
+    parser.add_argument("--layout",
+                        action="store",
+                        dest="layout",
+                        default="standard",
+                        choices=schema.LAYOUTS,
+                        help="""Storage layout of a new database ('compact': filter codes
+                        and scaled integer values, see 'schema.py') [default: %(default)s]""")
+    parser.add_argument("--shard",
+                        action="store",
+                        dest="shard",
+                        default=None,
+                        choices=shards.PERIODS,
+                        help="""Create a new database as a catalog plus one SQLite file per
+                        year or month of data (see 'shards.py') [default: %(default)s]""")
+    parser.add_argument("--rebuild-shard",
+                        action="store",
+                        dest="rebuild_shard",
+                        nargs="+",
+                        default=[],
+                        help="""Empty these shards ('YYYY' or 'YYYY-MM') of a sharded database
+                        and ingest their data again, without touching other shards
+                        [default: %(default)s]""")
+    parser.add_argument("--journal-mode",
+                        action="store",
+                        dest="journal_mode",
+                        default="WAL",
+                        choices=["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"],
+                        help="SQLite journal mode during ingestion [default: %(default)s]")
+    parser.add_argument("--synchronous",
+                        action="store",
+                        dest="synchronous",
+                        default="NORMAL",
+                        choices=["OFF", "NORMAL", "FULL", "EXTRA"],
+                        help="SQLite synchronous mode during ingestion [default: %(default)s]")
+    parser.add_argument("--cache-size",
+                        action="store",
+                        dest="cache_size",
+                        type=int,
+                        default=-65536,
+                        help="""SQLite page cache size (pages, or KiB if negative)
+                        [default: %(default)s]""")
+    parser.add_argument("--watch",
+                        action="store_true",
+                        dest="watch",
+                        help="""After ingesting, keep watching 'data_dir' and ingest new
+                        files and appended lines (WAL mode, one persistent connection) until
+                        interrupted. Lines are ingested once terminated by a newline
+                        [default: %(default)s]""")
+    parser.add_argument("--watch-interval",
+                        action="store",
+                        dest="watch_interval",
+                        type=float,
+                        default=0.5,
+                        help="Seconds between '--watch' directory checks [default: %(default)s]")
+    parser.add_argument("--profile",
+                        action="store",
+                        dest="profile",
+                        default=None,
+                        help="""Write a JSON report with time, CPU, rows and peak memory per
+                        stage and the query plan of every executed query [default: %(default)s]""")
+    parser.add_argument("--profile-stage",
+                        action="store",
+                        dest="profile_stage",
+                        default=None,
+                        choices=STAGES,
+                        help="""Run this stage under cProfile ('--profile' report name with
+                        '.pstats' extension) [default: %(default)s]""")
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help="Show running and progress information [default: %(default)s].")
     args = parser.parse_args()
 
+    if args.profile:
+        instrument.start('create_database.py', args.profile_stage)
+    try:
+        return run(args)
+    finally:
+        if args.profile and instrument.finish(args.profile) is not None:
+            print(f"INFO: Profile report written to '{args.profile}'")
+
+def run(args):
+    """Ejecuta el programa con los argumentos de línea de comandos 'args'
+    ya analizados (ver 'main').
+
+    Returns:
+        (int): 0, si todo fue bien; código de error en otro caso.
+    """
     if not os.path.isdir(args.output_dir):
         try:
             os.makedirs(args.output_dir)
@@ -227,43 +1014,132 @@ def main():
     
     ficheros_con_datos = glob.glob(os.path.join(args.data_dir, '*.dat'))
     ficheros_con_datos.sort()
+    # compressed data are read without extracting them
+    archivos = sorted(os.path.abspath(f) for suffix in dat_parser.ARCHIVE_SUFFIXES \
+        for f in glob.glob(os.path.join(args.data_dir, '*' + suffix)))
 
-    if not len(ficheros_con_datos):
+    if not len(ficheros_con_datos) and not len(archivos) and not args.watch:
         print(f"WARNING: No data files availables in '{ficheros_con_datos}'")
         return 2
 
+    if args.watch and args.journal_mode != 'WAL':
+        # concurrent readers need WAL mode
+        print(f"WARNING: '--journal-mode {args.journal_mode}' ignored, '--watch' uses WAL.")
+        args.journal_mode = 'WAL'
+
     print(f"INFO: {len(ficheros_con_datos)} data files found.")
+    if archivos:
+        print(f"INFO: {len(archivos)} compressed data files or archives found.")
     
     # Database file
     db_file = os.path.join(args.output_dir, 'astmonDB.db')
 
     if args.overwrite and os.path.exists(db_file):
-        # deleting previous database file
+        # deleting previous database file (and shards)
         try:
             os.remove(db_file)
+            if os.path.isdir(os.path.splitext(db_file)[0] + '_shards'):
+                shutil.rmtree(os.path.splitext(db_file)[0] + '_shards')
         except IOError:
             print(f"ERROR: Problems deleting database file '{db_file}'")
             return 3
     
     # Database creation
-    db_creation(db_file)
-
-    # return 1
-
-    for file_data in ficheros_con_datos:
-        if fix_file(file_data):
-            print(f"WARNING: Bad format for some line in file '{file_data}'.")
-        # insert data file in database
-        print(f"INFO: Working on data file '{file_data}'")
-        dt = proc_file(file_data)
-            
-        if dt is not None:
-            if len(dt.index) == 0:
-                print(f"WARNING: Couldn't insert info from file '{file_data}' in database.")
-            else:
-                # insert file in database
-                data2db(dt, db_file)
-        # break
+    db_creation(db_file, layout=args.layout, shard=args.shard)
+
+    # One connection and one transaction for the whole run (one per
+    # shard in sharded databases)
+    conn = connect_db(db_file, args.journal_mode, args.synchronous, args.cache_size)
+    if args.rebuild_shard:
+        if not shards.is_catalog(conn):
+            print(f"ERROR: '{db_file}' is not a sharded database ('--shard')")
+            conn.close()
+            return 5
+        period = shards.get_config(conn)[0]
+        for name in args.rebuild_shard:
+            try:
+                valid = str(np.datetime64(name, 'Y' if period == 'year' else 'M')) == name
+            except ValueError:
+                valid = False
+            if not valid:
+                print(f"ERROR: Non valid shard name '{name}' ({period} shards)")
+                conn.close()
+                return 5
+    inserted = 0
+    t_ini = time.perf_counter()
+
+    # Files already ingested are skipped or tailed using the manifest
+    with instrument.stage('manifest'):
+        manifest_creation(conn)
+        manifest = read_manifest(conn)
+    ficheros_con_datos = [os.path.abspath(f) for f in ficheros_con_datos]
+    entries = [manifest.get(f) for f in ficheros_con_datos]
+
+    # Rollup tables are refreshed only where data changed
+    dirty = {} if schema.get_schema_version(conn) >= 3 else None
+
+    try:
+        if args.rebuild_shard:
+            inserted += rebuild_shards(conn, args.rebuild_shard, args.batch_size, dirty)
+        elif args.chunk_rows > 0:
+            # Streaming mode: bounded memory, one file and one chunk at a time
+            if args.workers > 1:
+                print("WARNING: '--workers' is ignored when '--chunk-rows' is given.")
+            for file_data, entry in zip(ficheros_con_datos, entries):
+                inserted += stream_file(conn, file_data, entry, args.chunk_rows, \
+                    args.batch_size, dirty)
+        else:
+            inserted += ingest_files(conn, ficheros_con_datos, entries, \
+                args.workers, args.batch_size, dirty)
+        if not args.rebuild_shard:
+            # archive members are streamed (decompression overlaps insertion)
+            for archive_path in archivos:
+                try:
+                    inserted += ingest_archive(conn, archive_path, manifest, \
+                        args.chunk_rows if args.chunk_rows > 0 else 100000, args.batch_size, dirty)
+                except dat_parser.ARCHIVE_ERRORS as e:
+                    # members read so far are kept, the rest is read next time
+                    print(f"WARNING: Couldn't read archive '{archive_path}' ({e})")
+    except ValueError as e:
+        # e.g. values not stored exactly by compact layout
+        print(f"ERROR: Ingestion aborted, no data stored ({e})")
+        shards.close(conn)
+        return 4
+
+    if dirty:
+        t_rollup = time.perf_counter()
+        try:
+            with instrument.stage('rollups') as stage:
+                written = stage['rows'] = shards.refresh_rollups(conn, dirty)
+        except sqlite3.Error as e:
+            # manifest not updated: new data are read (and rolled up) next time
+            print(f"ERROR: Rollup refresh failed, ingest manifest not updated ({e})")
+            shards.close(conn)
+            return 6
+        print(f"INFO: {written} rollup rows refreshed in {time.perf_counter() - t_rollup:.2f} s")
+
+    with instrument.stage('commit'):
+        shards.commit(conn)
+    if inserted:
+        # planner statistics for index range scans
+        with instrument.stage('analyze'):
+            for shard_conn in shards.writers(conn).values():
+                schema.analyze(shard_conn)
+            schema.analyze(conn)
+
+    elapsed = time.perf_counter() - t_ini
+    print(f"INFO: {inserted} new rows inserted in {elapsed:.2f} s " \
+        f"({inserted / elapsed if elapsed else 0:.0f} rows/s)")
+    memory = instrument.peak_memory()
+    if memory is not None:
+        print(f"INFO: Peak memory (RSS high-water mark) = {memory:.1f} MiB")
+
+    if args.watch:
+        # SIGTERM (daemon stop) ends watching like Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        watch_dir(conn, args.data_dir, args.watch_interval, \
+            args.chunk_rows if args.chunk_rows > 0 else 100000, args.batch_size)
+    shards.close(conn)
 
     return 0
 
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Lector rápido de ficheros de datos del Astmon (una sola pasada)
+
+import os
+import re
+import mmap
+import gzip
+import queue
+import tarfile
+import zipfile
+import threading
+import itertools
+import contextlib
+
+import numpy as np
+
+# good line example:
+# 01/05/2020 03:02:05      0      0.819527      20.402396
+LINE_PATTERN = re.compile(rb'[ \t]*(\d{2}/\d{2}/\d{4})[ \t]+(\d{2}:\d{2}:\d{2})'
+                          rb'[ \t]+(\d)[ \t]+(\d\.\d+)[ \t]+(\d+\.\d+)[ \t\r]*$')
+N_FIELDS = 5
+
+# file name example: abr2020pos2_V.dat
+FILE_PATTERN = re.compile(r'(\w{3})(\d{4})pos(\d{1})_(\w{1})\.dat')
+
+# Compressed data: gzip files ('abr2020pos2_V.dat.gz') and zip or tar
+# archives of data files. Archive members are named 'archive::member'.
+ARCHIVE_SUFFIXES = ('.dat.gz', '.zip', '.tar', '.tar.gz', '.tgz')
+MEMBER_SEPARATOR = '::'
+# errors of damaged or incomplete (still being copied) archives
+ARCHIVE_ERRORS = (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError)
+
+
+def file_keys(file_path):
+    """Get position and filter from data file name.
+
+    Args:
+        file_path (str): data file path. Name pattern is 'mmmYYYYposN_F.dat'
+            (e.g. 'abr2020pos2_V.dat').
+
+    Returns:
+        (tuple): (position, filter_name) or None if name pattern is not valid.
+    """
+    values = FILE_PATTERN.findall(os.path.basename(file_path))
+    if not len(values):
+        return None
+    return int(values[0][2]), values[0][3]
+
+
+@contextlib.contextmanager
+def open_buffer(file_path):
+    """Memory-map 'file_path' for reading.
+
+    Args:
+        file_path (str): data file path.
+
+    Yields:
+        (mmap.mmap or bytes): file content (b'' for empty files).
+    """
+    with open(file_path, 'rb') as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def iter_blocks(fin, chunk_rows):
+    """Read 'fin' in blocks of (at most) 'chunk_rows' lines.
+
+    Only one block is held in memory at a time, so memory usage does not
+    depend on file size.
+
+    Args:
+        fin (file): file object opened in binary mode.
+        chunk_rows (int): maximum number of lines per block.
+
+    Yields:
+        (bytes): consecutive blocks of lines. Every block but the last one
+            ends with a newline.
+    """
+    while True:
+        lines = list(itertools.islice(fin, chunk_rows))
+        if not lines:
+            return
+        yield b''.join(lines)
+
+
+def is_archive(path):
+    """True if 'path' is a compressed data file or archive (ARCHIVE_SUFFIXES)."""
+    return path.endswith(ARCHIVE_SUFFIXES)
+
+
+def member_path(archive_path, name):
+    """Name of member 'name' of archive 'archive_path' (e.g. in manifest)."""
+    return f"{archive_path}{MEMBER_SEPARATOR}{name}"
+
+
+def iter_members(archive_path):
+    """Iterate data files ('*.dat') inside archive 'archive_path' as streams,
+    without extracting them to disk.
+
+    Tar archives are read sequentially (one decompression pass), so every
+    stream must be consumed before asking for the next member.
+
+    Args:
+        archive_path (str): path of a '.dat.gz', '.zip', '.tar', '.tar.gz'
+            or '.tgz' file.
+
+    Yields:
+        (tuple): (member name, binary file object). The name of a gzip data
+            file is its own name without '.gz'.
+    """
+    if archive_path.endswith('.dat.gz'):
+        with gzip.open(archive_path, 'rb') as fin:
+            yield os.path.basename(archive_path)[:-3], fin
+    elif archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith('.dat'):
+                    with archive.open(info) as fin:
+                        yield info.filename, fin
+    else:
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith('.dat'):
+                    with archive.extractfile(member) as fin:
+                        yield member.name, fin
+
+
+def prefetch(iterable, depth=2):
+    """Iterate 'iterable' in a background thread, up to 'depth' items ahead.
+
+    Decompression (zlib) and SQLite release the GIL, so producing the next
+    items overlaps with the work done by the caller on the current one.
+    Exceptions of the producer are raised by the iterator.
+
+    Args:
+        iterable: items to produce (e.g. blocks of a data stream).
+        depth (int): maximum number of items waiting to be consumed.
+
+    Yields:
+        items of 'iterable', in order.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except Exception as e:
+            put((False, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        # consumer stopped early (or failed): producer is released
+        stop.set()
+        thread.join()
+
+
+def epoch_seconds(year, month, day, hour, minute, second):
+    """Convert date fields into UTC epoch seconds (vectorized).
+
+    Args:
+        year, month, day, hour, minute, second (numpy.array): integer fields.
+
+    Returns:
+        (tuple): (epoch, valid). 'epoch' is an int64 array and 'valid' a boolean
+            array flagging calendar-consistent values.
+    """
+    months = (year - 1970) * 12 + (month - 1)
+    first = months.astype('datetime64[M]')
+    month_days = ((first + 1).astype('datetime64[D]') - first.astype('datetime64[D]')).astype(np.int64)
+    days = first.astype('datetime64[D]').astype(np.int64) + day - 1
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days) \
+        & (hour < 24) & (minute < 60) & (second < 60)
+    return days * 86400 + hour * 3600 + minute * 60 + second, valid
+
+
+def _digits(u, columns):
+    """Integer value of the ASCII digits of 'u' (uint8 matrix) in 'columns'."""
+    value = np.zeros(len(u), dtype=np.int64)
+    for col in columns:
+        value = value * 10 + u[:, col] - 48
+    return value
+
+
+def _valid_tokens(u):
+    """Check token shapes (uint8 view with shape (lines, fields, width)).
+
+    Same rules as LINE_PATTERN: 'dd/dd/dddd', 'dd:dd:dd', 'd', 'd.d+', 'd+.d+'.
+    """
+    digit = (u >= 48) & (u <= 57)
+    dot = u == 46
+    empty = u == 0
+    width = u.shape[2]
+    if width < 10:
+        return False
+    date_ok = (digit[:, 0, [0, 1, 3, 4, 6, 7, 8, 9]].all(axis=1)
+               & (u[:, 0, 2] == 47) & (u[:, 0, 5] == 47) & empty[:, 0, 10:].all(axis=1))
+    time_ok = (digit[:, 1, [0, 1, 3, 4, 6, 7]].all(axis=1)
+               & (u[:, 1, 2] == 58) & (u[:, 1, 5] == 58) & empty[:, 1, 8:].all(axis=1))
+    moon_ok = digit[:, 2, 0] & empty[:, 2, 1:].all(axis=1)
+    # numbers: only digits, one dot, trailing padding, digits around the dot
+    number = digit[:, 3:] | dot[:, 3:] | empty[:, 3:]
+    padded = (np.maximum.accumulate(empty[:, 3:], axis=2) == empty[:, 3:]).all(axis=2)
+    one_dot = dot[:, 3:].sum(axis=2) == 1
+    dot_pos = dot[:, 3:].argmax(axis=2)
+    after = np.take_along_axis(digit[:, 3:], np.minimum(dot_pos + 1, width - 1)[:, :, None], axis=2)[:, :, 0]
+    numbers_ok = (number.all(axis=2) & padded & one_dot & after & digit[:, 3:, 0]).all(axis=1) \
+        & (dot_pos[:, 0] == 1)
+    return bool((date_ok & time_ok & moon_ok & numbers_ok).all())
+
+
+def _columns(fields):
+    """Build typed columns from a (lines, 5) bytes array of valid tokens."""
+    u = fields[:, :2].astype('S10').view(np.uint8).reshape(len(fields), 2, 10)
+    epoch, valid = epoch_seconds(_digits(u[:, 0], (6, 7, 8, 9)), _digits(u[:, 0], (3, 4)),
+                                 _digits(u[:, 0], (0, 1)), _digits(u[:, 1], (0, 1)),
+                                 _digits(u[:, 1], (3, 4)), _digits(u[:, 1], (6, 7)))
+    return {'datetime_obs': epoch,
+            'is_moon': fields[:, 2].astype(np.int8),
+            'photo_night': fields[:, 3].astype(np.float64),
+            'sky_bright': fields[:, 4].astype(np.float64)}, valid
+
+
+def parse_buffer(buf, pos=0, endpos=None):
+    """Parse Astmon data lines from 'buf'.
+
+    Lines must verify the pattern
+        dd/mm/yyyy hh:mm:ss is_moon photo_night sky_bright
+    Blank lines are ignored. Any other line (including those with impossible
+    dates) is reported as bad line and skipped.
+
+    Well formed content is split and validated with vectorized numpy
+    operations; a per line regular expression is only used for locating bad
+    lines.
+
+    Args:
+        buf (bytes or mmap.mmap): data content.
+        pos (int): starting position (bytes).
+        endpos (int): final position (bytes). End of buffer if None.
+
+    Returns:
+        (tuple): (columns, bad_lines). 'columns' is a dict with numpy arrays
+            'datetime_obs' (int64, UTC epoch seconds), 'is_moon' (int8),
+            'photo_night' and 'sky_bright' (float64). 'bad_lines' is a list
+            of str.
+    """
+    if endpos is None:
+        endpos = len(buf)
+    content = buf[pos:endpos]
+    tokens = content.split()
+    lines = content.split(b'\n')
+    n_lines = len(lines) - lines.count(b'')
+
+    fields = None
+    if len(tokens) == N_FIELDS * n_lines:
+        fields = np.array(tokens, dtype=bytes).reshape(-1, N_FIELDS)
+        if n_lines and not _valid_tokens(fields.view(np.uint8).reshape(n_lines, N_FIELDS, -1)):
+            fields = None
+
+    bad_lines = []
+    if fields is None:
+        # slow path: find out which lines are wrong
+        rows = []
+        for line in lines:
+            match = LINE_PATTERN.match(line)
+            if match:
+                rows.append(match.groups())
+            elif line.strip():
+                bad_lines.append(line.decode(errors='replace').rstrip('\r'))
+        fields = np.array(rows, dtype=bytes).reshape(-1, N_FIELDS)
+
+    columns, valid = _columns(fields)
+    if not valid.all():
+        for row in fields[~valid]:
+            bad_lines.append(b' '.join(row).decode())
+        columns = {k: v[valid] for k, v in columns.items()}
+
+    return columns, bad_lines
+
+
+def parse_dat(file_path, offset=0):
+    """Read the Astmon data file 'file_path' in one pass.
+
+    The file is memory-mapped and never rewritten.
+
+    Args:
+        file_path (str): data file path. Name pattern is 'mmmYYYYposN_F.dat'.
+        offset (int): starting position (bytes).
+
+    Returns:
+        (tuple): (columns, bad_lines, end_offset). 'columns' has the format
+            given by 'parse_buffer' plus 'position' (int8) and 'filter_name'
+            (str) arrays; it is None if file name pattern is not valid.
+            'end_offset' is the position after the last complete line.
+    """
+    keys = file_keys(file_path)
+    if keys is None:
+        return None, [], offset
+
+    with open_buffer(file_path) as buf:
+        columns, bad_lines = parse_buffer(buf, offset)
+        end_offset = buf.rfind(b'\n', offset) + 1 or offset
+
+    size = len(columns['datetime_obs'])
+    columns['position'] = np.full(size, keys[0], dtype=np.int8)
+    columns['filter_name'] = np.full(size, keys[1])
+
+    return columns, bad_lines, end_offset
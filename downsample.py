@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Reducción de series temporales largas para su representación gráfica
+
+import numpy as np
+
+
+def pixel_bins(x, n_bins, x_range=None):
+    """Bin index (one bin per pixel column) of every 'x' value.
+
+    Args:
+        x (numpy.ndarray): x coordinates.
+        n_bins (int): number of bins.
+        x_range (tuple): (x_min, x_max) of the whole plot. 'x' range if None.
+
+    Returns:
+        (numpy.ndarray): int64 bin indexes in [0, n_bins).
+    """
+    x_min, x_max = (x.min(), x.max()) if x_range is None else x_range
+    if x_max <= x_min:
+        return np.zeros(len(x), dtype=np.int64)
+    bins = ((x - x_min) * (n_bins / (x_max - x_min))).astype(np.int64)
+    return np.clip(bins, 0, n_bins - 1, out=bins)
+
+
+def minmax_bins(x, y, n_bins, x_range=None):
+    """Minimum and maximum 'y' per pixel column.
+
+    Extremes of every column keep the envelope of the series, not the
+    samples in between (see 'pixel_cells'). Samples don't need to be
+    sorted.
+
+    Args:
+        x (numpy.ndarray): x coordinates.
+        y (numpy.ndarray): y coordinates (NaN values are ignored).
+        n_bins (int): number of bins (pixel width of plot).
+        x_range (tuple): (x_min, x_max) of the whole plot. 'x' range if None.
+
+    Returns:
+        (tuple): (x_center, y_min, y_max) arrays of non-empty bins.
+    """
+    valid = ~np.isnan(y)
+    # same type as accumulators: 'ufunc.at' is much slower when casting
+    x, y = x[valid], y[valid].astype(np.float64)
+    if len(x) == 0:
+        empty = np.empty(0)
+        return empty, empty, empty
+    if x_range is None:
+        x_range = (x.min(), x.max())
+    bins = pixel_bins(x, n_bins, x_range)
+    y_min = np.full(n_bins, np.inf)
+    y_max = np.full(n_bins, -np.inf)
+    np.minimum.at(y_min, bins, y)
+    np.maximum.at(y_max, bins, y)
+    used = np.flatnonzero(y_min <= y_max)
+    width = (x_range[1] - x_range[0]) / n_bins
+    return x_range[0] + (used + 0.5) * width, y_min[used], y_max[used]
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Sorted samples are split in 'n_out' - 2 buckets (first and last samples
+    are always kept) and, in every bucket, the sample making the largest
+    triangle with the previously selected one and the mean of next bucket
+    is selected. It keeps the visual shape of the series.
+
+    Args:
+        x (numpy.ndarray): x coordinates, sorted.
+        y (numpy.ndarray): y coordinates.
+        n_out (int): number of output samples.
+
+    Returns:
+        (numpy.ndarray): indexes of selected samples (sorted).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # mean point of next bucket (last sample for the last bucket)
+        nxt = slice(hi, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if not np.isnan(area).all() else lo
+        selected[i + 1] = a
+    return selected
+
+
+def density_grid(x, y, shape, x_range, y_range, chunk_size=2**22):
+    """Number of samples per cell of a regular grid (2D histogram).
+
+    Samples are binned in chunks, so memory doesn't grow with the number
+    of samples. Samples out of 'x_range' or 'y_range' are ignored.
+
+    Args:
+        x (numpy.ndarray): x coordinates.
+        y (numpy.ndarray): y coordinates.
+        shape (tuple): (n_x, n_y) number of cells.
+        x_range (tuple): (x_min, x_max) of grid.
+        y_range (tuple): (y_min, y_max) of grid.
+        chunk_size (int): samples binned at once.
+
+    Returns:
+        (numpy.ndarray): (n_y, n_x) int64 counts (first row is 'y_min').
+    """
+    n_x, n_y = shape
+    counts = np.zeros(n_x * n_y, dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        cx, cy = x[start:start + chunk_size], y[start:start + chunk_size]
+        inside = (cy >= y_range[0]) & (cy <= y_range[1]) & (cx >= x_range[0]) & (cx <= x_range[1])
+        cells = pixel_bins(cy[inside], n_y, y_range) * n_x + pixel_bins(cx[inside], n_x, x_range)
+        counts += np.bincount(cells, minlength=n_x * n_y)
+    return counts.reshape(n_y, n_x)
+
+
+def pixel_cells(x, y, shape, x_range, y_range):
+    """Centers of the cells of a regular grid (one cell per pixel) holding
+    some sample.
+
+    One marker per occupied pixel covers the same pixels as drawing every
+    sample (within half a pixel), and gaps between samples are kept, for any
+    number of samples. Samples out of 'x_range' or 'y_range' are ignored.
+
+    Args:
+        x (numpy.ndarray): x coordinates.
+        y (numpy.ndarray): y coordinates (NaN values are ignored).
+        shape (tuple): (n_x, n_y) number of cells (pixel size of plot).
+        x_range (tuple): (x_min, x_max) of grid.
+        y_range (tuple): (y_min, y_max) of grid.
+
+    Returns:
+        (tuple): (x_center, y_center) arrays of occupied cells.
+    """
+    n_x, n_y = shape
+    rows, cols = np.nonzero(density_grid(x, y, shape, x_range, y_range))
+    return x_range[0] + (cols + 0.5) * ((x_range[1] - x_range[0]) / n_x), \
+        y_range[0] + (rows + 0.5) * ((y_range[1] - y_range[0]) / n_y)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Instrumentación: tiempos por etapa, filas procesadas, memoria y planes de consulta
+
+import os
+import sys
+import json
+import time
+import cProfile
+import contextlib
+
+import sqlite3
+
+# Active report (None: instrumentation disabled, every hook is a no-op)
+_report = None
+# cProfile profiler of the chosen stage
+_profiler = None
+
+
+def peak_memory():
+    """Peak resident memory (RSS high-water mark) of the process, in MiB.
+
+    Returns:
+        (float): memory in MiB or None if not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is given in KiB (Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start(script, profile_stage=None):
+    """Enable instrumentation (see 'stage', 'iterate' and 'explain').
+
+    Args:
+        script (str): program name stored in the report.
+        profile_stage (str): stage run under cProfile (None for no
+            profiling).
+
+    Returns:
+        (dict): new report.
+    """
+    global _report, _profiler
+    _report = {'script': script,
+               'argv': sys.argv[1:],
+               'pid': os.getpid(),
+               'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'stages': {},
+               'queries': {},
+               '_wall': time.perf_counter(),
+               '_cpu': time.process_time()}
+    _profiler = None
+    if profile_stage:
+        _report['profile_stage'] = profile_stage
+        _profiler = cProfile.Profile()
+    return _report
+
+
+def enabled():
+    """True if instrumentation is active."""
+    return _report is not None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a stage of the program (wall and CPU time, peak memory).
+
+    Yields a dict: the number of rows processed by the stage is set in its
+    'rows' key. Repeated stages are accumulated.
+
+    Args:
+        name (str): stage name.
+    """
+    counters = {'rows': None}
+    if _report is None:
+        yield counters
+        return
+    profiled = _profiler is not None and name == _report['profile_stage']
+    if profiled:
+        _profiler.enable()
+    t_wall, t_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield counters
+    finally:
+        wall, cpu = time.perf_counter() - t_wall, time.process_time() - t_cpu
+        if profiled:
+            _profiler.disable()
+        info = _report['stages'].setdefault(name, {'calls': 0, 'wall_seconds': 0., 'cpu_seconds': 0.,
+                                                    'rows': None})
+        info['calls'] += 1
+        info['wall_seconds'] += wall
+        info['cpu_seconds'] += cpu
+        if counters['rows'] is not None:
+            info['rows'] = (info['rows'] or 0) + int(counters['rows'])
+        info['peak_rss_mib'] = peak_memory()
+
+
+def iterate(name, iterable):
+    """Iterate over 'iterable' timing every step as stage 'name' (time spent
+    waiting for items produced by a pool or a generator)."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def explain(conn, sql, params=None):
+    """Register execution of 'sql' and its 'EXPLAIN QUERY PLAN' (only
+    computed the first time every SQL text is seen).
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        sql (str): parameterized SQL statement.
+        params (sequence): query parameters. NULL values are bound if None.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    if _report is None:
+        return 0
+    sql = ' '.join(sql.split())
+    query = _report['queries'].get(sql)
+    if query is None:
+        if params is None:
+            params = [None] * sql.count('?')
+        try:
+            plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        except sqlite3.Error as e:
+            plan = [f"ERROR: {e}"]
+        query = _report['queries'][sql] = {'executions': 0, 'plan': plan}
+    query['executions'] += 1
+    return 0
+
+
+def finish(report_file):
+    """Disable instrumentation and write the JSON report.
+
+    Stages get 'rows_per_second' (rows / wall time). If a stage was
+    profiled, cProfile statistics are dumped next to the report (same name,
+    '.pstats' extension) and the 20 most expensive functions are included.
+
+    Args:
+        report_file (str): output JSON file path.
+
+    Returns:
+        (dict): written report or None if instrumentation was disabled.
+    """
+    global _report, _profiler
+    if _report is None:
+        return None
+    report, _report = _report, None
+    report['wall_seconds'] = time.perf_counter() - report.pop('_wall')
+    report['cpu_seconds'] = time.process_time() - report.pop('_cpu')
+    report['peak_rss_mib'] = peak_memory()
+    try:
+        import resource
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        report['children_cpu_seconds'] = children.ru_utime + children.ru_stime
+    except ImportError:
+        pass
+    for info in report['stages'].values():
+        if info['rows'] is not None and info['wall_seconds'] > 0:
+            info['rows_per_second'] = info['rows'] / info['wall_seconds']
+    report['stages'] = [dict(name=name, **info) for name, info in report['stages'].items()]
+    report['queries'] = [dict(sql=sql, **info) for sql, info in report['queries'].items()]
+
+    if _profiler is not None and not _profiler.getstats():
+        report['profile'] = {'stage': report.pop('profile_stage'), 'error': 'stage was not run'}
+    elif _profiler is not None:
+        import io
+        import pstats
+        pstats_file = os.path.splitext(report_file)[0] + '.pstats'
+        _profiler.dump_stats(pstats_file)
+        out = io.StringIO()
+        pstats.Stats(_profiler, stream=out).sort_stats('cumulative').print_stats(20)
+        report['profile'] = {'stage': report.pop('profile_stage'), 'pstats_file': pstats_file,
+                             'top': out.getvalue().splitlines()}
+    _profiler = None
+
+    with open(report_file, 'w') as fout:
+        json.dump(report, fout, indent=1)
+    return report
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# Intervalos de tiempo de las consultas como rangos epoch (NumPy)
+
+import time
+import calendar
+
+import numpy as np
+
+from rollups import DAY, NIGHT_OFFSET
+
+# Time ranges are (n, 2) int64 arrays of epoch seconds: sorted, disjoint and
+# non adjacent (ini, final) rows, both ends included. 'None' means no time
+# restriction; an empty array selects nothing.
+EMPTY = np.empty((0, 2), dtype=np.int64)
+
+
+def as_array(ranges):
+    """(ini, final) pairs 'ranges' (list or array) as an (n, 2) int64 array."""
+    return np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+
+
+def to_epoch(date_str):
+    """Convert a 'YYYY-MM-DD hh:mm:ss' UTC date string into epoch seconds.
+
+    Args:
+        date_str (str): date. Time part is optional.
+
+    Returns:
+        (int): epoch seconds.
+    """
+    date_str = date_str.strip()
+    fmt = '%Y-%m-%d %H:%M:%S' if ' ' in date_str else '%Y-%m-%d'
+    return calendar.timegm(time.strptime(date_str, fmt))
+
+
+def merge(ranges):
+    """Merge overlapping or adjacent closed ranges.
+
+    Args:
+        ranges (list): (ini, final) integer pairs (list or array), in any
+            order.
+
+    Returns:
+        (numpy.ndarray): minimal sorted (n, 2) int64 array of disjoint ranges.
+    """
+    ranges = as_array(ranges)
+    if len(ranges) == 0:
+        return EMPTY
+    ranges = ranges[np.argsort(ranges[:, 0], kind='stable')]
+    finals = np.maximum.accumulate(ranges[:, 1])
+    # a range opens a new group if it starts after every previous range
+    new = np.ones(len(ranges), dtype=bool)
+    new[1:] = ranges[1:, 0] > finals[:-1] + 1
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(ranges) - 1)
+    return np.column_stack([ranges[first, 0], finals[last]])
+
+
+def intersect(a, b):
+    """Intersection of two sets of closed ranges.
+
+    Range ends are swept at once: the intersection is where both sets
+    cover time.
+
+    Args:
+        a (list): (ini, final) pairs.
+        b (list): (ini, final) pairs.
+
+    Returns:
+        (numpy.ndarray): merged ranges (see 'merge').
+    """
+    a, b = merge(a), merge(b)
+    if len(a) == 0 or len(b) == 0:
+        return EMPTY
+    # half-open [ini, final + 1) boundaries
+    points = np.concatenate([a[:, 0], a[:, 1] + 1, b[:, 0], b[:, 1] + 1])
+    steps = np.concatenate([np.ones(len(a), np.int64), -np.ones(len(a), np.int64),
+                            np.ones(len(b), np.int64), -np.ones(len(b), np.int64)])
+    bounds, inverse = np.unique(points, return_inverse=True)
+    depth = np.zeros(len(bounds), dtype=np.int64)
+    np.add.at(depth, inverse, steps)
+    # depth between bounds[k] and bounds[k + 1] (0 after the last bound)
+    inside = np.flatnonzero(np.cumsum(depth) == 2)
+    return merge(np.column_stack([bounds[inside], bounds[inside + 1] - 1]))
+
+
+def period_ranges(period):
+    """Ranges of explicit periods.
+
+    Args:
+        period (list): [date_ini, date_final, ...] flat list of strings
+            ('YYYY-MM-DD hh:mm:ss'), or list of (date_ini, date_final) pairs.
+
+    Returns:
+        (numpy.ndarray): merged ranges.
+
+    Raises:
+        ValueError: odd number of dates, non valid date or date_ini after
+            date_final.
+    """
+    dates = [d for p in period for d in ([p] if isinstance(p, str) else p)]
+    if len(dates) % 2:
+        raise ValueError(f"Period needs (date_ini, date_final) pairs: {dates}")
+    ranges = as_array([to_epoch(d) for d in dates])
+    if np.any(ranges[:, 0] > ranges[:, 1]):
+        raise ValueError(f"Period ends before it begins: {dates}")
+    return merge(ranges)
+
+
+def calendar_ranges(years, months=None, days=None, nights=False):
+    """Ranges of every combination of 'years', 'months' and 'days'.
+
+    The full cartesian product is expanded (e.g. 2 years and 1 month give
+    2 ranges); days that don't exist in a month (e.g. February 30th) are
+    skipped.
+
+    Args:
+        years (list): integer values.
+        months (list): integer values in [1, 12]. Every month if empty.
+        days (list): integer values in [1, 31]. Whole months if empty.
+        nights (bool): select nights (12:00 to 12:00 UTC, labelled by their
+            first day, see 'rollups.NIGHT_OFFSET') instead of days.
+
+    Returns:
+        (numpy.ndarray): merged ranges.
+
+    Raises:
+        ValueError: month or day out of range.
+    """
+    years = np.unique([int(y) for y in years])
+    months = np.unique([int(m) for m in months]) if months else np.arange(1, 13)
+    if np.any((months < 1) | (months > 12)):
+        raise ValueError(f"Months must be in [1, 12]: {months.tolist()}")
+    # first day of every (year, month), as months since 1970
+    month_start = (((years[:, None] - 1970) * 12 + months[None, :] - 1).ravel()).astype('datetime64[M]')
+    if days:
+        days = np.unique([int(d) for d in days])
+        if np.any((days < 1) | (days > 31)):
+            raise ValueError(f"Days must be in [1, 31]: {days.tolist()}")
+        day = month_start.astype('datetime64[D]')[:, None] + (days[None, :] - 1)
+        day = day[day.astype('datetime64[M]') == month_start[:, None]]
+        ini = day.astype('datetime64[s]').astype(np.int64)
+        final = ini + DAY - 1
+    else:
+        ini = month_start.astype('datetime64[s]').astype(np.int64)
+        final = (month_start + 1).astype('datetime64[s]').astype(np.int64) - 1
+    if nights:
+        ini, final = ini + NIGHT_OFFSET, final + NIGHT_OFFSET
+    return merge(np.column_stack([ini, final]))
+
+
+def hour_ranges(first, last, hours):
+    """Ranges of a daily hour window between epochs 'first' and 'last'.
+
+    Args:
+        first (int): first epoch covered.
+        last (int): last epoch covered.
+        hours (list): (hour_ini, hour_final) UTC hours in [0, 24] (decimal
+            values allowed). The window crosses midnight if hour_final is
+            not after hour_ini (e.g. (20, 4) is 20:00 to 04:00).
+
+    Returns:
+        (numpy.ndarray): one range per day (merged).
+
+    Raises:
+        ValueError: non valid hours.
+    """
+    if len(hours) != 2:
+        raise ValueError(f"Hour window needs (hour_ini, hour_final): {hours}")
+    ini, final = (int(round(float(h) * 3600)) for h in hours)
+    if not (0 <= ini <= DAY and 0 <= final <= DAY):
+        raise ValueError(f"Hours must be in [0, 24]: {hours}")
+    length = final - ini if final > ini else final - ini + DAY
+    # window of the day before 'first' may still be open
+    starts = np.arange(first - first % DAY - DAY, last + 1, DAY, dtype=np.int64) + ini
+    return merge(np.column_stack([starts, starts + length - 1]))
+
+
+def build(period=None, years=None, months=None, days=None, hours=None, nights=False):
+    """Time ranges selected by query parameters.
+
+    Args:
+        period (list): explicit periods (see 'period_ranges'). If given,
+            'years', 'months', 'days' and 'nights' are ignored.
+        years (list): integer values.
+        months (list): integer values in [1, 12]. Ignored without 'years'
+            or 'period'.
+        days (list): integer values in [1, 31]. Ignored without 'years' or
+            'period'.
+        hours (list): daily (hour_ini, hour_final) window (see
+            'hour_ranges') kept from selected periods or days.
+        nights (bool): days are nights (see 'calendar_ranges').
+
+    Returns:
+        (numpy.ndarray): merged ranges, or None if no time restriction
+            is given.
+
+    Raises:
+        ValueError: non valid parameters, or 'hours' without 'years' or
+            'period'.
+    """
+    if period:
+        ranges = period_ranges(period)
+    elif years:
+        ranges = calendar_ranges(years, months, days, nights)
+    elif hours:
+        raise ValueError("'hours' need 'years' or 'period'")
+    else:
+        # 'months' and 'days' alone never restricted time
+        return None
+    if hours and len(ranges):
+        ranges = intersect(ranges, hour_ranges(ranges[0, 0], ranges[-1, 1], hours))
+    return ranges
+
+
+def overlaps(ranges, first, last):
+    """True if some of merged 'ranges' overlaps (first, last)."""
+    ranges = as_array(ranges)
+    k = np.searchsorted(ranges[:, 1], first, 'left')
+    return bool(k < len(ranges) and ranges[k, 0] <= last)
+
+
+def contains(ranges, values):
+    """Mask of 'values' (epoch array, in any order) inside merged 'ranges'.
+
+    Args:
+        ranges (numpy.ndarray): merged ranges.
+        values (numpy.ndarray): epoch values (e.g. a memory-mapped column).
+
+    Returns:
+        (numpy.ndarray): boolean mask.
+    """
+    ranges = as_array(ranges)
+    values = np.asarray(values)
+    if len(ranges) == 0:
+        return np.zeros(values.shape, dtype=bool)
+    k = np.searchsorted(ranges[:, 0], values, 'right') - 1
+    return (k >= 0) & (values <= ranges[np.maximum(k, 0), 1])
+
+
+def bounds(ranges, values):
+    """Positions of merged 'ranges' in sorted 'values'.
+
+    Args:
+        ranges (numpy.ndarray): merged ranges.
+        values (numpy.ndarray): sorted epoch values.
+
+    Returns:
+        (tuple): (lo, hi) int arrays: 'values[lo[k]:hi[k]]' are the values
+            of the k-th non empty range.
+    """
+    ranges = as_array(ranges)
+    lo = np.searchsorted(values, ranges[:, 0], 'left')
+    hi = np.searchsorted(values, ranges[:, 1], 'right')
+    keep = hi > lo
+    return lo[keep], hi[keep]
+
+
+def take_index(lo, hi):
+    """Positions of every value in slices (lo[k], hi[k]) given by 'bounds'."""
+    lengths = hi - lo
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum(), dtype=np.int64) + np.repeat(lo - offsets, lengths)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Tablas de estadísticas precalculadas (por noche y por mes)
+
+import calendar
+
+import numpy as np
+
+import instrument
+
+# A night runs from 12:00 to 12:00 (UTC) and is labelled with its starting
+# epoch; months are labelled with the epoch of their first day at 00:00.
+NIGHT_OFFSET = 12 * 3600
+DAY = 86400
+
+RESOLUTIONS = {'night': 'rollup_night', 'month': 'rollup_month'}
+
+QUANTILES = {'q25': 0.25, 'q50': 0.5, 'q75': 0.75}
+STATS = ['min', 'max', 'mean'] + list(QUANTILES)
+# rollup value columns (after 'period_start', 'position', 'filter_name')
+VALUE_COLUMNS = ['count'] + [f"{field}_{stat}" for field in ('sky', 'photo') for stat in STATS] \
+    + ['moon_fraction']
+
+ROLLUP_DDL = '''CREATE TABLE IF NOT EXISTS {name}
+                    ([period_start] INTEGER NOT NULL,
+                    [position] INTEGER NOT NULL,
+                    [filter_name] TEXT NOT NULL,
+                    [count] INTEGER NOT NULL,
+                    {values},
+                    PRIMARY KEY ([filter_name], [position], [period_start])) WITHOUT ROWID'''
+
+
+def create_rollups(conn):
+    """Create rollup tables (if they don't exist).
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    values = ',\n                    '.join(f"[{c}] REAL" for c in VALUE_COLUMNS[1:])
+    for name in RESOLUTIONS.values():
+        conn.execute(ROLLUP_DDL.format(name=name, values=values))
+    return 0
+
+
+def night_start(epoch):
+    """Start (epoch) of the night containing 'epoch' (int or numpy array)."""
+    return epoch - (epoch - NIGHT_OFFSET) % DAY
+
+
+def month_start(epoch):
+    """Start (epoch) of the month containing 'epoch' (int or numpy array)."""
+    months = np.asarray(epoch).astype('datetime64[s]').astype('datetime64[M]')
+    return months.astype('datetime64[s]').astype(np.int64)
+
+
+def _next_month(epoch):
+    year, month = map(int, str(np.datetime64(int(epoch), 's').astype('datetime64[M]')).split('-'))
+    return epoch + calendar.monthrange(year, month)[1] * DAY
+
+
+def mark_dirty(dirty, columns):
+    """Register time range of 'columns' as pending of rollup refresh.
+
+    Args:
+        dirty (dict): {(position, filter_name): (first_obs, last_obs)}. Updated
+            in place.
+        columns (dict): numpy columns with 'datetime_obs', 'position' and
+            'filter_name' (one position and filter per call).
+
+    Returns:
+        (dict): 'dirty' input argument.
+    """
+    if len(columns['datetime_obs']) == 0:
+        return dirty
+    key = (int(columns['position'][0]), str(columns['filter_name'][0]))
+    return mark_range(dirty, key, int(columns['datetime_obs'].min()),
+                      int(columns['datetime_obs'].max()))
+
+
+def mark_range(dirty, key, first_obs, last_obs):
+    """Register (first_obs, last_obs) range of 'key' as pending of refresh.
+
+    Args:
+        dirty (dict): {(position, filter_name): (first_obs, last_obs)}.
+        key (tuple): (position, filter_name).
+        first_obs, last_obs (int): epoch range.
+
+    Returns:
+        (dict): 'dirty' input argument.
+    """
+    if key in dirty:
+        first_obs = min(first_obs, dirty[key][0])
+        last_obs = max(last_obs, dirty[key][1])
+    dirty[key] = (first_obs, last_obs)
+    return dirty
+
+
+# Period start of a measurement, as SQL expression of 'datetime_obs'
+PERIOD_SQL = {'night': f"datetime_obs - (datetime_obs - {NIGHT_OFFSET}) % {DAY}",
+              'month': "CAST(strftime('%s', datetime_obs, 'unixepoch', 'start of month') AS INTEGER)"}
+
+# Rollup rows of one (position, filter_name) key: ranks of values within
+# their period give the quantiles (linear interpolation between the values
+# around rank (count - 1) * q, as pandas does). Rows are written by
+# prefixing INSERT_SQL.
+ROLLUP_SQL = '''WITH ranked AS (
+    SELECT {period} AS period_start, is_moon, photo_night, sky_bright,
+        row_number() OVER (PARTITION BY {period} ORDER BY sky_bright) - 1 AS sky_rank,
+        row_number() OVER (PARTITION BY {period} ORDER BY photo_night) - 1 AS photo_rank,
+        count(*) OVER (PARTITION BY {period}) AS n
+    FROM measurement
+    WHERE filter_name = ? AND position = ? AND datetime_obs BETWEEN ? AND ?),
+grouped AS (
+    SELECT period_start, count(*) AS count, {aggregates}, avg(is_moon) AS moon_fraction
+    FROM ranked GROUP BY period_start)
+SELECT period_start, ?, ?, {values} FROM grouped'''
+
+INSERT_SQL = "INSERT OR REPLACE INTO {table} (period_start, position, filter_name, {columns})"
+
+
+def rollup_sql(resolution, table=None):
+    """SQL statement computing rollup rows of 'resolution' (see ROLLUP_SQL),
+    and writing them into 'table' if given. Parameters are (filter_name,
+    position, first_obs, last_obs, position, filter_name)."""
+    aggregates = []
+    values = ['count']
+    for field, column in (('sky', 'sky_bright'), ('photo', 'photo_night')):
+        aggregates += [f"min({column}) AS {field}_min", f"max({column}) AS {field}_max",
+                       f"avg({column}) AS {field}_mean"]
+        values += [f"{field}_min", f"{field}_max", f"{field}_mean"]
+        for name, q in QUANTILES.items():
+            rank = f"CAST((n - 1) * {q} AS INTEGER)"
+            aggregates += [f"max(CASE WHEN {field}_rank = {rank} THEN {column} END) AS {field}_{name}_lo",
+                           f"max(CASE WHEN {field}_rank = min({rank} + 1, n - 1) THEN {column} END) "
+                           f"AS {field}_{name}_hi",
+                           f"max((n - 1) * {q} - {rank}) AS {field}_{name}_frac"]
+            values.append(f"{field}_{name}_lo + ({field}_{name}_hi - {field}_{name}_lo) * {field}_{name}_frac")
+    values.append('moon_fraction')
+    sql = ROLLUP_SQL.format(period=PERIOD_SQL[resolution], aggregates=',\n        '.join(aggregates),
+                            values=',\n    '.join(values))
+    if table is None:
+        return sql
+    return INSERT_SQL.format(table=table, columns=', '.join(VALUE_COLUMNS)) + '\n' + sql
+
+
+def _period_range(resolution, first_obs, last_obs):
+    """[ini, final) epoch range of whole periods covering (first_obs, last_obs)."""
+    if resolution == 'night':
+        return int(night_start(first_obs)), int(night_start(last_obs)) + DAY
+    return int(month_start(first_obs)), _next_month(int(month_start(last_obs)))
+
+
+def refresh_rollups(conn, dirty, source=None):
+    """Recompute rollup rows affected by new or removed measurements.
+
+    Only the nights and months overlapping the dirty ranges are deleted
+    and computed again. Statistics are aggregated by SQLite itself from a
+    primary key range scan (see ROLLUP_SQL): raw rows never reach Python.
+    With a 'source' connection, only the aggregated rows do.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        dirty (dict): {(position, filter_name): (first_obs, last_obs)}.
+        source (sqlite3.Connection): connection whose 'measurement' table
+            (or view) is aggregated, if not 'conn' (e.g. attached shards).
+
+    Returns:
+        (int): number of rollup rows written.
+    """
+    written = 0
+    for (position, filter_name), (first_obs, last_obs) in sorted(dirty.items()):
+        for resolution, table in RESOLUTIONS.items():
+            ini, final = _period_range(resolution, first_obs, last_obs)
+            params = (filter_name, position, ini, final - 1)
+            sql = f"DELETE FROM {table} WHERE filter_name = ? AND position = ? " \
+                "AND period_start BETWEEN ? AND ?"
+            instrument.explain(conn, sql, params)
+            conn.execute(sql, params)
+            if source is not None:
+                sql = rollup_sql(resolution)
+                instrument.explain(source, sql, params + (position, filter_name))
+                rows = source.execute(sql, params + (position, filter_name)).fetchall()
+                conn.executemany(INSERT_SQL.format(table=table, columns=', '.join(VALUE_COLUMNS))
+                                 + f" VALUES ({', '.join('?' * (len(VALUE_COLUMNS) + 3))})", rows)
+                written += len(rows)
+                continue
+            sql = rollup_sql(resolution, table)
+            instrument.explain(conn, sql, params + (position, filter_name))
+            written += conn.execute(sql, params + (position, filter_name)).rowcount
+    return written
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup row from 'measurement' table.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (int): number of rollup rows written.
+    """
+    dirty = {}
+    for position, filter_name, first_obs, last_obs in conn.execute(
+            "SELECT position, filter_name, min(datetime_obs), max(datetime_obs) "
+            "FROM measurement GROUP BY filter_name, position"):
+        dirty[(position, filter_name)] = (first_obs, last_obs)
+    return refresh_rollups(conn, dirty)
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+# Esquema versionado de la base de datos del Astmon y migraciones
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+import rollups
+
+SCHEMA_VERSION = 3
+
+# Version 1 (original): rowid table with primary key led by 'datetime_obs'.
+# Version 2: clustered on (filter_name, position, datetime_obs), which is the
+# access path of 'astmon.get_data', plus a covering index for time-only queries.
+# Version 3: nightly and monthly rollup tables (see 'rollups').
+MEASUREMENT_DDL = '''CREATE TABLE {name}
+                    ([datetime_obs] INTEGER NOT NULL,
+                    [is_moon] INTEGER,
+                    [photo_night] REAL,
+                    [sky_bright] REAL,
+                    [position] INTEGER NOT NULL,
+                    [filter_name] TEXT NOT NULL,
+                    PRIMARY KEY ([filter_name], [position], [datetime_obs])) WITHOUT ROWID'''
+INDEXES_DDL = [
+    # secondary indexes of WITHOUT ROWID tables also store the primary key,
+    # so this one covers every column
+    '''CREATE INDEX IF NOT EXISTS measurement_datetime
+       ON measurement ([datetime_obs], [is_moon], [photo_night], [sky_bright])''',
+]
+
+# Storage layouts of measurements (see 'convert_layout'):
+# * 'standard': 'measurement' table, filter names as TEXT and REAL values.
+# * 'compact': 'measurement_data' table with filter codes (of 'filter_code'
+#   lookup table) and 'photo_night'/'sky_bright' as integers scaled by
+#   10^VALUE_DECIMALS (data files precision), so they round-trip exactly.
+#   'measurement' is a view decoding them: queries don't change.
+LAYOUTS = ['standard', 'compact']
+VALUE_DECIMALS = 6
+VALUE_SCALE = 10 ** VALUE_DECIMALS
+MEASUREMENT_TABLE = {'standard': 'measurement', 'compact': 'measurement_data'}
+FILTER_CODE_DDL = '''CREATE TABLE filter_code
+                    ([code] INTEGER PRIMARY KEY,
+                    [filter_name] TEXT NOT NULL UNIQUE)'''
+COMPACT_DDL = '''CREATE TABLE measurement_data
+                    ([datetime_obs] INTEGER NOT NULL,
+                    [is_moon] INTEGER,
+                    [photo_night] INTEGER,
+                    [sky_bright] INTEGER,
+                    [position] INTEGER NOT NULL,
+                    [filter_name] INTEGER NOT NULL,
+                    PRIMARY KEY ([filter_name], [position], [datetime_obs])) WITHOUT ROWID'''
+COMPACT_INDEXES_DDL = [
+    '''CREATE INDEX IF NOT EXISTS measurement_data_datetime
+       ON measurement_data ([datetime_obs], [is_moon], [photo_night], [sky_bright])''',
+]
+# integer to float division gives back the parsed value (correctly rounded)
+COMPACT_VIEW_DDL = f'''CREATE VIEW measurement AS
+                    SELECT d.datetime_obs, d.is_moon,
+                    d.photo_night / {VALUE_SCALE}.0 AS photo_night,
+                    d.sky_bright / {VALUE_SCALE}.0 AS sky_bright,
+                    d.position, f.filter_name
+                    FROM measurement_data AS d JOIN filter_code AS f ON f.code = d.filter_name'''
+
+# Common 'get_data' query shapes: (sql, params, index constraint). All of them
+# must be solved with index searches bounded by the constraint (time range
+# queries must bound 'datetime_obs' in the index, not read every row of a
+# filter or position).
+TIME_CONSTRAINT = 'datetime_obs>? AND datetime_obs<?'
+QUERY_SHAPES = {
+    'filters + positions + time range': (
+        "SELECT * FROM measurement WHERE filter_name IN (?, ?) AND position IN (?, ?, ?) "
+        "AND datetime_obs BETWEEN ? AND ?",
+        ('B', 'V', 3, 4, 5, 1583020800, 1586995199), TIME_CONSTRAINT),
+    'filters + time range': (
+        "SELECT * FROM measurement WHERE filter_name IN (?, ?) "
+        "AND datetime_obs BETWEEN ? AND ?",
+        ('B', 'V', 1583020800, 1586995199), TIME_CONSTRAINT),
+    'positions + time range': (
+        "SELECT * FROM measurement WHERE position IN (?, ?, ?) "
+        "AND datetime_obs BETWEEN ? AND ?",
+        (3, 4, 5, 1583020800, 1586995199), TIME_CONSTRAINT),
+    'time range': (
+        "SELECT * FROM measurement WHERE datetime_obs BETWEEN ? AND ?",
+        (1583020800, 1586995199), TIME_CONSTRAINT),
+    'filters + positions': (
+        "SELECT * FROM measurement WHERE filter_name IN (?, ?) AND position IN (?, ?, ?)",
+        ('B', 'V', 3, 4, 5), 'filter_name=? AND position=?'),
+}
+
+
+def get_schema_version(conn):
+    """Get schema version of database opened in 'conn'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (int): schema version. 0 for an empty database, 1 for databases
+            created before 'schema_version' table existed.
+    """
+    tables = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'schema_version' in tables:
+        return conn.execute("SELECT max(version) FROM schema_version").fetchone()[0]
+    if 'measurement' in tables:
+        return 1
+    return 0
+
+
+def get_layout(conn, db='main'):
+    """Storage layout ('standard' or 'compact') of database opened in 'conn'
+    (or attached to it as 'db')."""
+    row = conn.execute(f"SELECT 1 FROM {db}.sqlite_master WHERE type = 'table' "
+                       "AND name = 'measurement_data'").fetchone()
+    return 'compact' if row else 'standard'
+
+
+def measurement_table(conn, db='main'):
+    """Name of the table storing measurements (writes go there, reads may
+    use 'measurement' in any layout)."""
+    return MEASUREMENT_TABLE[get_layout(conn, db)]
+
+
+def encode_filters(conn, names, create=False, db='main'):
+    """Stored values of filter 'names' in compact layout.
+
+    Args:
+        conn (sqlite3.Connection): connection to a compact layout database.
+        names (array-like): filter names.
+        create (bool): add unknown filter names to 'filter_code' table.
+            Unknown names are encoded as None otherwise.
+        db (str): schema name of the database ('main' or attached).
+
+    Returns:
+        (list): filter codes.
+    """
+    index, uniques = pd.factorize(np.asarray(names))
+    codes = dict(conn.execute(f"SELECT filter_name, code FROM {db}.filter_code"))
+    for name in uniques:
+        if name not in codes and create:
+            code = conn.execute(f"SELECT coalesce(max(code) + 1, 0) FROM {db}.filter_code").fetchone()[0]
+            conn.execute(f"INSERT INTO {db}.filter_code (code, filter_name) VALUES (?, ?)", (code, str(name)))
+            codes[name] = code
+    return [codes.get(uniques[i]) for i in index.tolist()]
+
+
+def encode_values(values):
+    """Stored values of 'photo_night' or 'sky_bright' in compact layout.
+
+    Args:
+        values (array-like): measured values (NaN for missing values).
+
+    Returns:
+        (list): integers, 'values' scaled by VALUE_SCALE (None for NaN).
+
+    Raises:
+        ValueError: some value has more than VALUE_DECIMALS decimals (it
+            would not round-trip exactly).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = np.rint(values * VALUE_SCALE)
+    valid = ~np.isnan(values)
+    if not np.array_equal(scaled[valid] / VALUE_SCALE, values[valid]):
+        raise ValueError(f"Values with more than {VALUE_DECIMALS} decimals can't be "
+                         "stored in compact layout")
+    encoded = np.where(valid, scaled, 0).astype(np.int64).tolist()
+    if not valid.all():
+        for i in np.flatnonzero(~valid).tolist():
+            encoded[i] = None
+    return encoded
+
+
+def _to_compact(conn):
+    inexact = conn.execute(f"""SELECT count(*) FROM measurement
+                               WHERE round(photo_night * {VALUE_SCALE}) / {VALUE_SCALE}.0 != photo_night
+                               OR round(sky_bright * {VALUE_SCALE}) / {VALUE_SCALE}.0 != sky_bright""").fetchone()[0]
+    if inexact:
+        raise ValueError(f"{inexact} rows have values with more than {VALUE_DECIMALS} decimals")
+    conn.execute(FILTER_CODE_DDL)
+    names = [row[0] for row in conn.execute("SELECT DISTINCT filter_name FROM measurement ORDER BY 1")]
+    # codes 0 and 1 take no space in SQLite records
+    conn.executemany("INSERT INTO filter_code (code, filter_name) VALUES (?, ?)", enumerate(names))
+    conn.execute(COMPACT_DDL)
+    conn.execute(f'''INSERT INTO measurement_data
+                    (datetime_obs, is_moon, photo_night, sky_bright, position, filter_name)
+                    SELECT m.datetime_obs, m.is_moon,
+                    CAST(round(m.photo_night * {VALUE_SCALE}) AS INTEGER),
+                    CAST(round(m.sky_bright * {VALUE_SCALE}) AS INTEGER), m.position, f.code
+                    FROM measurement AS m JOIN filter_code AS f ON f.filter_name = m.filter_name
+                    ORDER BY f.code, m.position, m.datetime_obs''')
+    conn.execute("DROP TABLE measurement")
+    conn.execute(COMPACT_VIEW_DDL)
+    for ddl in COMPACT_INDEXES_DDL:
+        conn.execute(ddl)
+
+
+def _to_standard(conn):
+    conn.execute(MEASUREMENT_DDL.format(name='measurement_standard'))
+    conn.execute('''INSERT INTO measurement_standard
+                    (datetime_obs, is_moon, photo_night, sky_bright, position, filter_name)
+                    SELECT datetime_obs, is_moon, photo_night, sky_bright, position, filter_name
+                    FROM measurement ORDER BY filter_name, position, datetime_obs''')
+    conn.execute("DROP VIEW measurement")
+    conn.execute("DROP TABLE measurement_data")
+    conn.execute("DROP TABLE filter_code")
+    conn.execute("ALTER TABLE measurement_standard RENAME TO measurement")
+    for ddl in INDEXES_DDL:
+        conn.execute(ddl)
+
+
+def convert_layout(conn, layout):
+    """Convert measurements of database opened in 'conn' to 'layout', in
+    place and in one transaction. Run 'VACUUM' later to give back freed
+    pages to the file system.
+
+    Args:
+        conn (sqlite3.Connection): database connection (last schema version).
+        layout (str): one of LAYOUTS.
+
+    Returns:
+        (bool): True if the database was converted, False if it already
+            had 'layout'.
+
+    Raises:
+        ValueError: data can't be stored exactly in compact layout.
+    """
+    if get_layout(conn) == layout:
+        return False
+    conn.execute("BEGIN")
+    try:
+        if layout == 'compact':
+            _to_compact(conn)
+        else:
+            _to_standard(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return True
+
+
+def _set_version(conn, version):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                    ([version] INTEGER PRIMARY KEY,
+                    [applied] TEXT)''')
+    conn.execute("INSERT OR REPLACE INTO schema_version (version, applied) VALUES (?, datetime('now'))",
+                 (version,))
+
+
+def create_schema(conn):
+    """Create last schema version in the empty database opened in 'conn'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    conn.execute(MEASUREMENT_DDL.format(name='measurement'))
+    for ddl in INDEXES_DDL:
+        conn.execute(ddl)
+    rollups.create_rollups(conn)
+    _set_version(conn, SCHEMA_VERSION)
+    conn.commit()
+    return 0
+
+
+def _migrate_v1_v2(conn):
+    """Rebuild 'measurement' as a WITHOUT ROWID table clustered by
+    (filter_name, position, datetime_obs)."""
+    conn.execute(MEASUREMENT_DDL.format(name='measurement_v2'))
+    conn.execute('''INSERT INTO measurement_v2
+                    (datetime_obs, is_moon, photo_night, sky_bright, position, filter_name)
+                    SELECT datetime_obs, is_moon, photo_night, sky_bright, position, filter_name
+                    FROM measurement ORDER BY filter_name, position, datetime_obs''')
+    conn.execute("DROP TABLE measurement")
+    conn.execute("ALTER TABLE measurement_v2 RENAME TO measurement")
+    for ddl in INDEXES_DDL:
+        conn.execute(ddl)
+
+
+def _migrate_v2_v3(conn):
+    """Create rollup tables and fill them from existing measurements."""
+    rollups.create_rollups(conn)
+    rollups.rebuild_rollups(conn)
+
+
+# version reached -> function upgrading from previous version
+MIGRATIONS = {2: _migrate_v1_v2, 3: _migrate_v2_v3}
+
+
+def migrate(conn, verbose=True):
+    """Upgrade database opened in 'conn' to SCHEMA_VERSION, in place.
+
+    Every step runs in its own transaction.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        verbose (bool): print progress information.
+
+    Returns:
+        (int): schema version after migration.
+    """
+    version = get_schema_version(conn)
+    if version == 0:
+        create_schema(conn)
+        return SCHEMA_VERSION
+    while version < SCHEMA_VERSION:
+        t_ini = time.perf_counter()
+        # explicit transaction: sqlite3 does not open one before DDL
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[version + 1](conn)
+            _set_version(conn, version + 1)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        version += 1
+        if verbose:
+            print(f"INFO: Schema upgraded to version {version} in {time.perf_counter() - t_ini:.2f} s")
+    analyze(conn)
+    return version
+
+
+def analyze(conn):
+    """Refresh planner statistics with a full 'ANALYZE'.
+
+    Sampled statistics ('analysis_limit') are not used: they undercount
+    rows per filter and make the primary key look selective for time
+    range queries.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    conn.execute("PRAGMA analysis_limit = 0")
+    conn.execute("ANALYZE")
+    conn.commit()
+    return 0
+
+
+def query_plan(conn, sql, params=()):
+    """Get 'EXPLAIN QUERY PLAN' details for 'sql'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        sql (str): SQL query.
+        params (tuple): query parameters.
+
+    Returns:
+        (list): plan detail strings.
+    """
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def plan_uses(plan, constraint):
+    """True if 'plan' (see 'query_plan') searches an index bounded by
+    'constraint' and has no full scan (but the filter code lookup of the
+    compact layout view, 'f')."""
+    scans = [p for p in plan if p.startswith('SCAN') and p.split()[1] not in ('f', 'filter_code')]
+    searches = [p for p in plan if p.startswith('SEARCH') and constraint in p]
+    return not scans and bool(searches)
+
+
+def check_query_plans(conn):
+    """Check that QUERY_SHAPES are solved by index searches bounded by
+    their constraints.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+
+    Returns:
+        (dict): {shape name: (ok, plan details)}.
+    """
+    results = {}
+    for name, (sql, params, constraint) in QUERY_SHAPES.items():
+        plan = query_plan(conn, sql, params)
+        results[name] = (plan_uses(plan, constraint), plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='schema.py',
+                                     conflict_handler='resolve',
+                                     description=f'''It upgrades an astmon SQLite database
+                                     file to schema version {SCHEMA_VERSION} in place.''')
+    parser.add_argument("db_file", help="SQLite file database path")
+    parser.add_argument("--check",
+                        action="store_true",
+                        dest="check",
+                        help="Check query plans of common queries after migration")
+    parser.add_argument("--layout",
+                        action="store",
+                        dest="layout",
+                        default=None,
+                        choices=LAYOUTS,
+                        help="""Convert measurements to this storage layout ('compact': filter
+                        codes and scaled integer values) [default: %(default)s]""")
+    parser.add_argument("--vacuum",
+                        action="store_true",
+                        dest="vacuum",
+                        help="Run VACUUM after migration")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db_file):
+        print(f"ERROR: Database file '{args.db_file}' not found")
+        return 1
+
+    conn = sqlite3.connect(args.db_file)
+    version = get_schema_version(conn)
+    print(f"INFO: Schema version of '{args.db_file}' is {version}")
+    migrate(conn)
+    if args.layout:
+        t_ini = time.perf_counter()
+        try:
+            if convert_layout(conn, args.layout):
+                print(f"INFO: Converted to '{args.layout}' layout in {time.perf_counter() - t_ini:.2f} s")
+            else:
+                print(f"INFO: Layout is already '{args.layout}'")
+        except ValueError as e:
+            print(f"ERROR: Layout not converted ({e})")
+            conn.close()
+            return 3
+        analyze(conn)
+    if args.vacuum:
+        conn.execute("VACUUM")
+        size = os.path.getsize(args.db_file)
+        print(f"INFO: Database size after VACUUM is {size / 2**20:.1f} MiB")
+
+    status = 0
+    if args.check:
+        for name, (ok, plan) in check_query_plans(conn).items():
+            print(f"{'OK' if ok else 'FAIL'}: {name}")
+            for p in plan:
+                print(f"\t{p}")
+            if not ok:
+                status = 2
+    conn.close()
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
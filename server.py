@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+# Servicio HTTP local de consultas, estadísticas y gráficas del Astmon
+
+import argparse
+import os
+import io
+import sys
+import json
+import time
+import queue
+import threading
+import collections
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import sqlite3
+
+import astmon
+import cache
+import analytics
+
+# Endpoints: path -> (content types by 'format' parameter)
+ENDPOINTS = {'/data': {'json': 'application/json', 'csv': 'text/csv'},
+             '/stats': {'json': 'application/json', 'csv': 'text/csv'},
+             '/summary': {'json': 'application/json'},
+             '/plot': {'png': 'image/png'},
+             '/metrics': {'json': 'application/json'},
+             '/health': {'json': 'application/json'}}
+# Query parameters accepted by 'get_data' (comma separated or repeated values)
+QUERY_PARAMS = ['period', 'years', 'months', 'days', 'hours', 'positions', 'filters']
+# Latencies kept per endpoint for 'metrics' percentiles
+LATENCY_WINDOW = 1000
+
+# Process state (server and rendering workers), set by 'init_state'
+_state = None
+
+
+def init_state(db_file, connections=4, cache_items=32, warm_plots=False):
+    """Open the connection pool and the in-memory result cache of this process.
+
+    Args:
+        db_file (str): path to SQLite database file.
+        connections (int): number of pooled read-only connections.
+        cache_items (int): maximum number of cached query results.
+        warm_plots (bool): import plotting modules now (rendering workers),
+            not in the first request.
+
+    Returns:
+        (dict): process state.
+    """
+    global _state
+    pool = queue.Queue()
+    for _ in range(connections):
+        # read-only: requests never take write locks (WAL readers)
+        pool.put(sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False))
+    _state = {'db_file': db_file,
+              'pool': pool,
+              'cache': collections.OrderedDict(),
+              'cache_items': cache_items,
+              'lock': threading.Lock(),
+              'hits': 0,
+              'misses': 0,
+              'latency': {},
+              'errors': {},
+              'started': time.time()}
+    if warm_plots:
+        astmon._pyplot()
+    return _state
+
+
+@contextlib.contextmanager
+def connection():
+    """Borrow a pooled connection (waits if all of them are in use)."""
+    conn = _state['pool'].get()
+    try:
+        yield conn
+    finally:
+        _state['pool'].put(conn)
+
+
+def parse_query(query):
+    """'get_data' keyword arguments and options from an URL query string.
+
+    Args:
+        query (str): URL query (e.g. 'years=2020&filters=B,V').
+
+    Returns:
+        (tuple): ('get_data' keyword arguments, options dict with
+            'resolution', 'thresholds', 'format', 'render' and 'dpi').
+
+    Raises:
+        ValueError: non valid parameter value.
+    """
+    values = {name: [v for item in items for v in item.split(',') if v]
+              for name, items in parse_qs(query).items()}
+    kwargs = {name: values.get(name) or None for name in QUERY_PARAMS}
+    kwargs['nights'] = values.get('nights', ['0'])[0].lower() in ('1', 'true', 'yes')
+    options = {'resolution': values.get('resolution', ['raw'])[0],
+               'thresholds': tuple(float(v) for v in values.get('thresholds', analytics.THRESHOLDS)),
+               'format': values.get('format', [None])[0],
+               'render': values.get('render', ['auto'])[0],
+               'dpi': int(values.get('dpi', [100])[0])}
+    if options['resolution'] not in ('raw', 'night', 'month'):
+        raise ValueError(f"Non valid resolution '{options['resolution']}'")
+    if len(options['thresholds']) != 2:
+        raise ValueError("'thresholds' needs two values")
+    if options['render'] not in astmon.RENDER_MODES:
+        raise ValueError(f"Non valid render mode '{options['render']}'")
+    if not 10 <= options['dpi'] <= 600:
+        raise ValueError("'dpi' must be in [10, 600]")
+    kwargs['resolution'] = options['resolution']
+    return kwargs, options
+
+
+def cached(key, compute):
+    """Value of 'key' in the in-memory cache, or 'compute()' stored in it.
+
+    Least recently used entries are dropped beyond 'cache_items'.
+
+    Args:
+        key (hashable): cache key.
+        compute (callable): function returning the value (called without
+            holding the cache lock).
+
+    Returns:
+        value (shared: not to be modified).
+    """
+    with _state['lock']:
+        value = _state['cache'].get(key)
+        if value is not None:
+            _state['cache'].move_to_end(key)
+            _state['hits'] += 1
+            return value
+        _state['misses'] += 1
+    value = compute()
+    with _state['lock']:
+        _state['cache'][key] = value
+        while len(_state['cache']) > _state['cache_items']:
+            _state['cache'].popitem(last=False)
+    return value
+
+
+def query_key(kwargs, conn):
+    """Key of 'get_data' query 'kwargs' ('cache.query_key'), including the
+    database version: new ingested data are never hidden by the cache."""
+    db_file = _state['db_file']
+    ranges = astmon.epoch_ranges(kwargs['period'], kwargs['years'], kwargs['months'], kwargs['days'],
+                                 kwargs['hours'], kwargs['nights'])
+    return cache.query_key(db_file, ranges, kwargs['positions'], kwargs['filters'],
+                           kwargs['resolution'], cache.db_version(db_file, conn))
+
+
+def load(kwargs):
+    """'get_data' result for 'kwargs', from the in-memory cache if possible.
+
+    Args:
+        kwargs (dict): 'get_data' keyword arguments ('parse_query').
+
+    Returns:
+        (pandas.DataFrame): query result (shared: not to be modified).
+    """
+    with connection() as conn:
+        return cached(query_key(kwargs, conn),
+                      lambda: astmon.get_data(_state['db_file'], conn=conn, **kwargs))
+
+
+def classified(data, thresholds):
+    """Copy of 'data' columns with 'category_night' column added."""
+    data = data.copy(deep=False)
+    data['category_night'] = astmon.classify(data, thresholds)
+    return data
+
+
+def render_png(kwargs, options, title):
+    """Query and plot as PNG (run in rendering worker processes).
+
+    Args:
+        kwargs (dict): 'get_data' keyword arguments.
+        options (dict): 'parse_query' options.
+        title (str): plot title.
+
+    Returns:
+        (bytes): PNG image (empty if there are no data).
+    """
+    def render():
+        data = load(kwargs)
+        if len(data.index) == 0:
+            return b''
+        data = classified(data, options['thresholds'])
+        data.index = pd.to_datetime(data['datetime_obs'], unit='s')
+        out = io.BytesIO()
+        astmon.plot_data(data, out, title, mode=options['render'], dpi=options['dpi'])
+        return out.getvalue()
+
+    # rendered images are cached too, with the data they were made from
+    with connection() as conn:
+        key = query_key(kwargs, conn)
+    return cached(('png', key, options['thresholds'], options['render'], options['dpi'], title),
+                  render)
+
+
+def start_workers(db_file, workers=2, connections=4, cache_items=32):
+    """Rendering process pool, every process with its own connections and
+    cache ('init_state') and plotting modules imported at start.
+
+    Args:
+        db_file (str): path to SQLite database file.
+        workers (int): number of rendering processes.
+        connections (int): pooled connections (per process).
+        cache_items (int): cached query results (per process).
+
+    Returns:
+        (concurrent.futures.ProcessPoolExecutor): started pool.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_state,
+                               initargs=(db_file, connections, cache_items, True))
+    # start workers now: first plot requests don't pay process start-up
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    return pool
+
+
+def record(endpoint, seconds, error=False):
+    """Store request latency (and error) of 'endpoint'."""
+    with _state['lock']:
+        window = _state['latency'].setdefault(endpoint, collections.deque(maxlen=LATENCY_WINDOW))
+        window.append(seconds)
+        _state['errors'][endpoint] = _state['errors'].get(endpoint, 0) + error
+
+
+def metrics():
+    """Request count, errors and latency percentiles (ms) per endpoint,
+    and in-memory cache statistics of the server process."""
+    with _state['lock']:
+        latency = {k: np.array(v) * 1000 for k, v in _state['latency'].items()}
+        result = {'uptime_seconds': time.time() - _state['started'],
+                  'cache': {'items': len(_state['cache']), 'hits': _state['hits'],
+                            'misses': _state['misses']},
+                  'endpoints': {}}
+        for endpoint, ms in latency.items():
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            result['endpoints'][endpoint] = {'requests': len(ms), 'errors': _state['errors'][endpoint],
+                                             'mean_ms': ms.mean(), 'p50_ms': p50, 'p95_ms': p95,
+                                             'p99_ms': p99, 'max_ms': ms.max()}
+    result['note'] = f"latencies of last {LATENCY_WINDOW} requests per endpoint"
+    return result
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """GET requests of ENDPOINTS (see 'serve')."""
+
+    # Rendering process pool and 'start_workers' arguments, set by 'serve'
+    workers = None
+    workers_args = None
+    workers_lock = threading.Lock()
+    # quiet access log unless verbose
+    verbose = False
+
+    def do_GET(self):
+        t_ini = time.perf_counter()
+        url = urlsplit(self.path)
+        endpoint = url.path.rstrip('/') or '/'
+        error = True
+        try:
+            if endpoint not in ENDPOINTS:
+                self.reply(404, {'error': f"Unknown endpoint '{endpoint}'",
+                                 'endpoints': sorted(ENDPOINTS)})
+                return
+            status, body, content_type = self.handle_endpoint(endpoint, url.query)
+            self.reply(status, body, content_type)
+            error = status >= 400
+        except ValueError as e:
+            self.reply(400, {'error': str(e)})
+        except (sqlite3.Error, OSError) as e:
+            self.reply(500, {'error': str(e)})
+        except Exception as e:
+            # any other failure (e.g. broken rendering pool) is still answered
+            self.reply(500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            if endpoint in ENDPOINTS:
+                record(endpoint, time.perf_counter() - t_ini, error)
+
+    def handle_endpoint(self, endpoint, query):
+        """Response (status, body, content type) of a known endpoint."""
+        if endpoint == '/health':
+            return 200, {'status': 'ok'}, None
+        if endpoint == '/metrics':
+            return 200, metrics(), None
+
+        kwargs, options = parse_query(query)
+        fmt = options['format'] or next(iter(ENDPOINTS[endpoint]))
+        if fmt not in ENDPOINTS[endpoint]:
+            raise ValueError(f"Non valid format '{fmt}' for '{endpoint}'")
+        content_type = ENDPOINTS[endpoint][fmt]
+
+        if endpoint == '/plot':
+            pool = self.workers
+            try:
+                png = pool.submit(render_png, kwargs, options, query or 'all data').result()
+            except BrokenProcessPool:
+                # a rendering process died: next requests get a new pool
+                self.restart_workers(pool)
+                raise
+            if not png:
+                return 404, {'error': 'No data registered for these parameters'}, None
+            return 200, png, content_type
+
+        data = load(kwargs)
+        if endpoint == '/data':
+            out = io.StringIO()
+            astmon.write_data(data, out, fmt)
+            return 200, out.getvalue(), content_type
+        if len(data.index) == 0:
+            return 404, {'error': 'No data registered for these parameters'}, None
+        if endpoint == '/summary':
+            return 200, astmon.summary(classified(data, options['thresholds'])), content_type
+
+        if kwargs['resolution'] != 'raw':
+            raise ValueError("'/stats' needs raw resolution")
+        stats = analytics.night_stats(data, options['thresholds'])
+        stats['night'] = pd.to_datetime(stats['night'], unit='s')
+        out = io.StringIO()
+        astmon.write_data(stats, out, fmt)
+        return 200, out.getvalue(), content_type
+
+    @classmethod
+    def restart_workers(cls, broken):
+        """Replace rendering pool 'broken' (once, whatever the number of
+        requests that found it broken)."""
+        with cls.workers_lock:
+            if cls.workers is broken:
+                broken.shutdown(wait=False)
+                cls.workers = start_workers(*cls.workers_args)
+
+    def reply(self, status, body, content_type=None):
+        """Send 'body' (JSON encoded if it is not str or bytes)."""
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body, default=float)
+            content_type = 'application/json'
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(db_file, host='127.0.0.1', port=8050, workers=2, connections=4, cache_items=32, \
+    verbose=False):
+    """Serve ENDPOINTS until interrupted (Ctrl+C).
+
+    Requests are handled in threads sharing the connection pool and the
+    in-memory cache. Plots are rendered in 'workers' processes, every one
+    with its own connections and cache, and plotting modules imported at
+    start.
+
+    Args:
+        db_file (str): path to SQLite database file.
+        host (str): listening address.
+        port (int): listening port.
+        workers (int): number of rendering processes.
+        connections (int): pooled connections (per process).
+        cache_items (int): cached query results (per process).
+        verbose (bool): print every request.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    init_state(db_file, connections, cache_items)
+    RequestHandler.workers_args = (db_file, workers, connections, cache_items)
+    RequestHandler.workers = start_workers(*RequestHandler.workers_args)
+    RequestHandler.verbose = verbose
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    print(f"INFO: Serving '{db_file}' on http://{host}:{server.server_port} " \
+        f"({workers} rendering processes, {connections} connections)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("INFO: Server stopped")
+    finally:
+        server.server_close()
+        RequestHandler.workers.shutdown()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='server.py',
+                                     description='''Local HTTP service for Astmon queries
+                                     (/data), night statistics (/stats), summaries (/summary)
+                                     and plots (/plot), with request metrics (/metrics).''',
+                                     epilog='''Query parameters (comma separated values):
+                                     period, years, months, days, hours, nights, positions,
+                                     filters, resolution, thresholds, format, render, dpi.
+                                     Example: /plot?years=2020&months=4&filters=B,V''')
+    parser.add_argument("db_file", help="SQLite file database path")
+    parser.add_argument("--host", default='127.0.0.1',
+                        help="Listening address [default: %(default)s]")
+    parser.add_argument("--port", type=int, default=8050,
+                        help="Listening port [default: %(default)s]")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Plot rendering processes [default: %(default)s]")
+    parser.add_argument("--connections", type=int, default=4,
+                        help="Pooled read-only SQLite connections [default: %(default)s]")
+    parser.add_argument("--cache-items", type=int, default=32,
+                        help="Query results kept in memory [default: %(default)s]")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Print every request [default: %(default)s].")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db_file):
+        print(f"ERROR: Database file '{args.db_file}' not found")
+        return 2
+    return serve(args.db_file, args.host, args.port, args.workers, args.connections,
+                 args.cache_items, bool(args.verbose))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
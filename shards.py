@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# Disposición fragmentada: un fichero SQLite por año (o mes) y un catálogo
+
+import os
+import time
+
+import numpy as np
+
+import sqlite3
+
+import schema
+import rollups
+import instrument
+import intervals
+
+# A sharded database is a catalog file (the usual 'astmonDB.db' path) with
+# ingest manifest, rollup tables and the list of shards, plus one database
+# file per period in '<catalog name>_shards/', each with the usual schema.
+PERIODS = ['year', 'month']
+
+# SQLite default limit of attached databases ('SQLITE_MAX_ATTACHED')
+MAX_ATTACHED = 10
+
+CONFIG_DDL = '''CREATE TABLE IF NOT EXISTS shard_config
+                    ([period] TEXT NOT NULL,
+                    [layout] TEXT NOT NULL)'''
+
+SHARD_DDL = '''CREATE TABLE IF NOT EXISTS shard
+                    ([name] TEXT PRIMARY KEY,
+                    [first_obs] INTEGER NOT NULL,
+                    [last_obs] INTEGER NOT NULL,
+                    [file] TEXT NOT NULL,
+                    [updated] REAL NOT NULL)'''
+
+KEYWORDS = ['datetime_obs', 'is_moon', 'photo_night', 'sky_bright', 'position', 'filter_name']
+
+# open shard connections of ingestion catalogs: {id(catalog conn): {name: conn}}
+_writers = {}
+
+
+def is_catalog(conn):
+    """True if database opened in 'conn' is a shard catalog."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                       "AND name = 'shard'").fetchone()
+    return row is not None
+
+
+def create_catalog(conn, period, layout='standard'):
+    """Create an empty shard catalog in the empty database opened in 'conn'.
+
+    Args:
+        conn (sqlite3.Connection): database connection.
+        period (str): time span of every shard (one of PERIODS).
+        layout (str): storage layout of shards ('schema.LAYOUTS').
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    conn.execute(CONFIG_DDL)
+    conn.execute("INSERT INTO shard_config (period, layout) VALUES (?, ?)", (period, layout))
+    conn.execute(SHARD_DDL)
+    rollups.create_rollups(conn)
+    schema._set_version(conn, schema.SCHEMA_VERSION)
+    conn.commit()
+    return 0
+
+
+def get_config(conn):
+    """(period, layout) of the shard catalog opened in 'conn'."""
+    return conn.execute("SELECT period, layout FROM shard_config").fetchone()
+
+
+def shard_names(epoch, period):
+    """Shard names ('YYYY' or 'YYYY-MM') of 'epoch' values (numpy array)."""
+    unit = 'datetime64[Y]' if period == 'year' else 'datetime64[M]'
+    return np.asarray(epoch).astype('datetime64[s]').astype(unit).astype(str)
+
+
+def shard_range(name):
+    """(first_obs, last_obs) epoch range of shard 'name'."""
+    start = np.datetime64(name)
+    end = start + np.timedelta64(1, start.dtype.name[-2])
+    return int(start.astype('datetime64[s]').astype(np.int64)), \
+        int(end.astype('datetime64[s]').astype(np.int64)) - 1
+
+
+def catalog_file(conn):
+    """Path of the main database file opened in 'conn'."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path
+
+
+def shard_file(conn, name):
+    """Path of the file of shard 'name' of catalog opened in 'conn' (it
+    may not exist yet)."""
+    path = catalog_file(conn)
+    return os.path.join(os.path.splitext(path)[0] + '_shards', f"{name}.db")
+
+
+def list_shards(conn, ranges=None):
+    """Shards of catalog opened in 'conn', sorted by time.
+
+    Args:
+        conn (sqlite3.Connection): catalog connection.
+        ranges (numpy.ndarray): merged epoch ranges ('intervals.merge').
+            Only shards overlapping some range are returned if given.
+
+    Returns:
+        (list): (name, first_obs, last_obs, file path) tuples.
+    """
+    sql = "SELECT name, first_obs, last_obs, file FROM shard ORDER BY first_obs"
+    instrument.explain(conn, sql)
+    folder = os.path.dirname(catalog_file(conn))
+    found = []
+    for name, first_obs, last_obs, path in conn.execute(sql):
+        if ranges is None or intervals.overlaps(ranges, first_obs, last_obs):
+            found.append((name, first_obs, last_obs, os.path.join(folder, path)))
+    return found
+
+
+def schema_name(name):
+    """Schema name of attached shard 'name'."""
+    return f"shard_{name.replace('-', '_')}"
+
+
+def attach(conn, shards, read_only=False):
+    """Attach 'shards' to 'conn' (at most MAX_ATTACHED at a time).
+
+    Args:
+        conn (sqlite3.Connection): catalog connection ('uri=True' if
+            'read_only').
+        shards (list): 'list_shards' tuples.
+        read_only (bool): attach files in read-only mode.
+
+    Returns:
+        (list): schema names of attached shards.
+    """
+    names = []
+    for name, _, _, path in shards:
+        if read_only:
+            path = f"file:{path}?mode=ro"
+        conn.execute(f"ATTACH DATABASE ? AS {schema_name(name)}", (path,))
+        names.append(schema_name(name))
+    return names
+
+
+def detach(conn, names):
+    """Detach schemas 'names' (no transaction may be open on them)."""
+    for name in names:
+        conn.execute(f"DETACH DATABASE {name}")
+    return 0
+
+
+def _connect(conn, path):
+    """Open shard 'path' with the journal, synchronous and cache settings
+    of catalog connection 'conn'."""
+    shard_conn = sqlite3.connect(path)
+    for pragma in ('journal_mode', 'synchronous', 'cache_size'):
+        value = conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        shard_conn.execute(f"PRAGMA {pragma} = {value}")
+    return shard_conn
+
+
+def writer(conn, name):
+    """Connection to shard 'name' of ingestion catalog 'conn'. The shard
+    is created (file and catalog row) if needed. Connections stay open,
+    and their transactions pending, until 'commit' and 'close'.
+
+    Args:
+        conn (sqlite3.Connection): catalog connection.
+        name (str): shard name.
+
+    Returns:
+        (sqlite3.Connection): shard connection.
+    """
+    writers = _writers.setdefault(id(conn), {})
+    if name in writers:
+        return writers[name]
+    path = shard_file(conn, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"INFO: Creating shard '{name}' ('{path}')")
+        shard_conn = sqlite3.connect(path)
+        schema.create_schema(shard_conn)
+        schema.convert_layout(shard_conn, get_config(conn)[1])
+        shard_conn.close()
+    first_obs, last_obs = shard_range(name)
+    sql = "INSERT OR REPLACE INTO shard (name, first_obs, last_obs, file, updated) VALUES (?, ?, ?, ?, ?)"
+    instrument.explain(conn, sql)
+    conn.execute(sql, (name, first_obs, last_obs,
+                       os.path.relpath(path, os.path.dirname(catalog_file(conn))), time.time()))
+    writers[name] = _connect(conn, path)
+    return writers[name]
+
+
+def writers(conn):
+    """Open shard connections of ingestion catalog 'conn' ({name: conn})."""
+    return _writers.get(id(conn), {})
+
+
+def route(conn, columns):
+    """Split 'columns' of a catalog ingestion by shard.
+
+    Args:
+        conn (sqlite3.Connection): catalog connection.
+        columns (dict): numpy columns with 'datetime_obs' (see
+            'create_database.columns2db').
+
+    Returns:
+        (list): (shard connection, columns) tuples.
+    """
+    period = get_config(conn)[0]
+    datetime_obs = np.asarray(columns['datetime_obs'])
+    names = shard_names(datetime_obs, period)
+    parts = []
+    for name in np.unique(names).tolist():
+        mask = names == name
+        parts.append((writer(conn, name), {k: np.asarray(v)[mask] for k, v in columns.items()}))
+    return parts
+
+
+def overlapping_writers(conn, first_obs, last_obs):
+    """Connections to existing shards of catalog 'conn' overlapping
+    (first_obs, last_obs) (e.g. to remove data)."""
+    return [writer(conn, name) for name, *_ in list_shards(conn, [(first_obs, last_obs)])]
+
+
+def reset(conn, name):
+    """Empty shard 'name' of catalog 'conn': its file is created again.
+    Other shards are not touched.
+
+    Args:
+        conn (sqlite3.Connection): catalog connection.
+        name (str): shard name.
+
+    Returns:
+        (sqlite3.Connection): connection to the new shard.
+    """
+    shard_conn = writers(conn).pop(name, None)
+    if shard_conn is not None:
+        shard_conn.close()
+    path = shard_file(conn, name)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return writer(conn, name)
+
+
+def commit(conn):
+    """Commit shard connections of 'conn' (if any), then 'conn' itself.
+
+    Args:
+        conn (sqlite3.Connection): catalog (or plain database) connection.
+
+    Returns:
+        (int): 0, if everything was fine.
+    """
+    for shard_conn in writers(conn).values():
+        shard_conn.commit()
+    conn.commit()
+    return 0
+
+
+def close(conn):
+    """Close shard connections of 'conn' (if any), then 'conn' itself."""
+    for shard_conn in _writers.pop(id(conn), {}).values():
+        shard_conn.close()
+    conn.close()
+    return 0
+
+
+def refresh_rollups(conn, dirty):
+    """Recompute rollup rows affected by new or removed measurements
+    ('rollups.refresh_rollups').
+
+    In a catalog, rollups are stored in the catalog itself. Pending shard
+    data are committed, and runs of consecutive shards overlapping 'dirty'
+    ranges are attached (read-only, at most MAX_ATTACHED - 2 per run, next
+    to their neighbour shards for nights crossing shard boundaries) to an
+    in-memory connection, under a temporary 'measurement' view that
+    rollups are aggregated from. The catalog transaction (ingest manifest
+    and rollups) is left pending, so both are committed together.
+
+    Args:
+        conn (sqlite3.Connection): catalog (or plain database) connection.
+        dirty (dict): {(position, filter_name): (first_obs, last_obs)}.
+
+    Returns:
+        (int): number of rollup rows written.
+    """
+    if not is_catalog(conn):
+        return rollups.refresh_rollups(conn, dirty)
+    for shard_conn in writers(conn).values():
+        shard_conn.commit()
+    shards = list_shards(conn)
+    ranges = list(dirty.values())
+    runs = []
+    for i, shard in enumerate(shards):
+        if not any(ini <= shard[2] and final >= shard[1] for ini, final in ranges):
+            continue
+        if runs and runs[-1][-1] == i - 1 and len(runs[-1]) < MAX_ATTACHED - 2:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    source = sqlite3.connect(':memory:', uri=True)
+    written = 0
+    try:
+        for run in runs:
+            first_obs, last_obs = shards[run[0]][1], shards[run[-1]][2]
+            names = attach(source, shards[max(run[0] - 1, 0):run[-1] + 2], read_only=True)
+            source.execute("CREATE TEMP VIEW measurement AS " + " UNION ALL ".join(
+                f"SELECT {', '.join(KEYWORDS)} FROM {name}.measurement" for name in names))
+            clipped = {key: (max(ini, first_obs), min(final, last_obs))
+                       for key, (ini, final) in dirty.items() if ini <= last_obs and final >= first_obs}
+            written += rollups.refresh_rollups(conn, clipped, source)
+            source.execute("DROP VIEW temp.measurement")
+            detach(source, names)
+    finally:
+        source.close()
+    return written
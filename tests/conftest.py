@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Configuración común de las pruebas
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sqlite3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import schema
+import dat_parser
+import create_database
+import generate_data
+
+# 2 filters x 3 positions, one sample every 10 minutes for 60 days
+FILTERS = ['B', 'V']
+POSITIONS = [1, 2, 3]
+FIRST_OBS = 1577836800
+SAMPLES = 60 * 144
+
+
+def fill(conn):
+    """Insert synthetic measurements in 'conn' and analyze it."""
+    datetime_obs = FIRST_OBS + np.arange(SAMPLES, dtype=np.int64) * 600
+    rng = np.random.default_rng(0)
+    for filter_name in FILTERS:
+        for position in POSITIONS:
+            create_database.columns2db({
+                'datetime_obs': datetime_obs,
+                'is_moon': rng.integers(0, 2, SAMPLES).astype(np.int8),
+                'photo_night': np.round(rng.random(SAMPLES), 6),
+                'sky_bright': np.round(rng.uniform(17, 22, SAMPLES), 6),
+                'position': np.full(SAMPLES, position, dtype=np.int8),
+                'filter_name': np.array([filter_name] * SAMPLES)}, conn)
+    conn.commit()
+    schema.analyze(conn)
+
+
+@pytest.fixture(params=schema.LAYOUTS)
+def db(request):
+    """In-memory database (every layout) with synthetic measurements."""
+    conn = sqlite3.connect(':memory:')
+    schema.create_schema(conn)
+    schema.convert_layout(conn, request.param)
+    fill(conn)
+    yield conn
+    conn.close()
+
+
+def ingest(data_dir, output_dir, *options):
+    """Run 'create_database.py' on 'data_dir' with command line 'options'.
+
+    Returns:
+        (int): exit code.
+    """
+    argv = sys.argv
+    sys.argv = ['create_database.py', str(data_dir), '--output_dir', str(output_dir), *options]
+    try:
+        return create_database.main()
+    finally:
+        sys.argv = argv
+
+
+def run_astmon(*options):
+    """Run 'astmon.py' with command line 'options'.
+
+    Returns:
+        (int): exit code.
+    """
+    import astmon
+    argv = sys.argv
+    sys.argv = ['astmon.py', *options]
+    try:
+        return astmon.main()
+    finally:
+        sys.argv = argv
+
+
+def source_values(data_dir):
+    """Parsed values of every data file in 'data_dir', sorted as 'get_data'
+    output sorted by (filter_name, position, datetime_obs)."""
+    frames = []
+    for name in sorted(os.listdir(data_dir)):
+        if name.endswith('.dat'):
+            columns = dat_parser.parse_dat(os.path.join(data_dir, name))[0]
+            frames.append(pd.DataFrame(columns))
+    data = pd.concat(frames, ignore_index=True)
+    return data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Synthetic data files of 2020 (positions 1 and 2, filters B and V,
+    one sample every hour of the night)."""
+    path = tmp_path / 'data'
+    generate_data.generate(str(path), [2020], positions=[1, 2], filters=['B', 'V'],
+                           step=3600, bad_fraction=0)
+    return path
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Estadísticas por noche
+
+import numpy as np
+import pandas as pd
+
+import analytics
+
+from conftest import FIRST_OBS
+
+
+def series(position, filter_name, datetime_obs, is_moon=0):
+    n = len(datetime_obs)
+    return pd.DataFrame({'datetime_obs': datetime_obs, 'is_moon': np.full(n, is_moon),
+                         'photo_night': np.full(n, 0.95), 'sky_bright': np.full(n, 21.),
+                         'position': np.full(n, position), 'filter_name': [filter_name] * n})
+
+
+def test_dark_hours_use_period_of_every_series():
+    # 10 hours sampled every 600 s, the second series 300 s later
+    night = FIRST_OBS + 18 * 3600
+    times = night + np.arange(60, dtype=np.int64) * 600
+    data = pd.concat([series(1, 'B', times), series(1, 'V', times + 300)])
+    stats = analytics.night_stats(data)
+    assert np.allclose(stats['dark_hours'], 10.)
+
+
+def test_dark_hours_of_series_with_different_periods():
+    night = FIRST_OBS + 18 * 3600
+    data = pd.concat([series(1, 'B', night + np.arange(60, dtype=np.int64) * 600),
+                      series(2, 'B', night + np.arange(20, dtype=np.int64) * 60),
+                      series(3, 'B', night + np.arange(60, dtype=np.int64) * 600, is_moon=1)])
+    stats = analytics.night_stats(data).set_index('position')
+    assert np.allclose(stats['dark_hours'].loc[[1, 2, 3]], [10., 20 / 60, 0.])
+
+
+def test_sample_periods():
+    datetime_obs = np.array([0, 600, 1200, 1800, 5, 65, 125, 7], dtype=np.int64)
+    series = np.array([0, 0, 0, 0, 1, 1, 1, 2])
+    assert analytics.sample_periods(datetime_obs, series).tolist() == [600.] * 4 + [60.] * 3 + [0.]
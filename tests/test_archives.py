@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Ingesta de ficheros comprimidos y archivos (gz, zip, tar) sin extraerlos
+
+import gzip
+import shutil
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+
+import astmon
+import dat_parser
+
+from conftest import ingest, source_values
+
+LINE = '31/12/2020 23:59:59      1      0.500000      20.123456\n'
+
+
+def pack(data_dir, archive_dir, suffix):
+    """Pack '*.dat' files of 'data_dir' into 'archive_dir' (one gzip file
+    per data file, or two archives with half of the files each)."""
+    archive_dir.mkdir(exist_ok=True)
+    for path in archive_dir.iterdir():
+        path.unlink()
+    paths = sorted(data_dir.glob('*.dat'))
+    if suffix == '.dat.gz':
+        for path in paths:
+            with open(path, 'rb') as fin, gzip.open(archive_dir / (path.name + '.gz'), 'wb') as fout:
+                shutil.copyfileobj(fin, fout)
+        return
+    for k, part in enumerate((paths[::2], paths[1::2])):
+        archive = archive_dir / f"part{k}{suffix}"
+        if suffix == '.zip':
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as fout:
+                for path in part:
+                    fout.write(path, path.name)
+        else:
+            with tarfile.open(archive, 'w:gz' if suffix.endswith('gz') else 'w') as fout:
+                for path in part:
+                    fout.add(path, path.name)
+
+
+def assert_same_data(db_file, expected):
+    data = astmon.get_data(db_file)
+    data = data.assign(filter_name=np.asarray(data['filter_name'], dtype=str))
+    data = data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+    assert len(data.index) == len(expected.index)
+    for key in astmon.KEYWORDS:
+        assert np.array_equal(np.asarray(data[key]), np.asarray(expected[key])), key
+
+
+@pytest.mark.parametrize('suffix', dat_parser.ARCHIVE_SUFFIXES)
+def test_archives_are_ingested(data_dir, tmp_path, capsys, suffix):
+    archive_dir = tmp_path / 'archives'
+    pack(data_dir, archive_dir, suffix)
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    assert ingest(archive_dir, tmp_path / 'db') == 0
+    assert_same_data(db_file, source_values(data_dir))
+    # unchanged archives are not read again
+    capsys.readouterr()
+    assert ingest(archive_dir, tmp_path / 'db') == 0
+    assert 'INFO: 0 new rows inserted' in capsys.readouterr().out
+    # a member with a new line: only that line is inserted
+    with open(data_dir / 'dic2020pos1_B.dat', 'a') as f:
+        f.write(LINE)
+    pack(data_dir, archive_dir, suffix)
+    assert ingest(archive_dir, tmp_path / 'db') == 0
+    assert 'INFO: 1 new rows inserted' in capsys.readouterr().out
+    assert_same_data(db_file, source_values(data_dir))
+
+
+@pytest.mark.parametrize('suffix', ['.dat.gz', '.zip', '.tar.gz'])
+def test_damaged_archive_is_read_next_time(data_dir, tmp_path, capsys, suffix):
+    archive_dir = tmp_path / 'archives'
+    pack(data_dir, archive_dir, suffix)
+    damaged = sorted(archive_dir.iterdir())[0]
+    content = damaged.read_bytes()
+    # e.g. still being copied
+    damaged.write_bytes(content[:len(content) // 2])
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    assert ingest(archive_dir, tmp_path / 'db') == 0
+    assert f"WARNING: Couldn't read archive '{damaged}'" in capsys.readouterr().out
+    damaged.write_bytes(content)
+    assert ingest(archive_dir, tmp_path / 'db') == 0
+    assert_same_data(db_file, source_values(data_dir))
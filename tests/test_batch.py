@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Gráficas por lotes (astmon.py --batch)
+
+import pytest
+
+import astmon
+
+from conftest import ingest, run_astmon, source_values
+
+
+@pytest.fixture
+def db_file(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    return str(tmp_path / 'db' / 'astmonDB.db')
+
+
+def test_split_data(db_file):
+    data = astmon.get_data(db_file, years=[2020], months=[3, 4])
+    groups = astmon.split_data(data, ['filter', 'month'])
+    assert [labels for labels, _ in groups] == [
+        (('filter', f), ('month', m)) for f in ('B', 'V') for m in ('2020-03', '2020-04')]
+    assert sum(len(group.index) for _, group in groups) == len(data.index)
+    for labels, group in groups:
+        assert set(group['filter_name'].astype(str)) == {labels[0][1]}
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_batch_plots(data_dir, db_file, tmp_path, capsys, workers):
+    out_dir = tmp_path / 'plots'
+    out_dir.mkdir()
+    assert run_astmon('--batch', 'filter', 'position', '--workers', workers,
+                      '--output_plot_dir', str(out_dir), db_file) == 0
+    expected = source_values(data_dir).groupby(['filter_name', 'position']).size()
+    names = {f"sky_measures_filter-{f}_position-{p}.jpg": rows for (f, p), rows in expected.items()}
+    assert sorted(path.name for path in out_dir.iterdir()) == sorted(names)
+    # summary: one line per plot with its number of rows
+    out = capsys.readouterr().out
+    summary = {line.split()[0]: int(line.split()[1]) for line in out.splitlines()
+               if line.startswith('sky_measures_')}
+    assert summary == names
+    assert 'INFO: 4 plots in' in out
+
+
+def test_batch_needs_plot_format(db_file, tmp_path):
+    assert run_astmon('--batch', 'filter', '--format', 'csv',
+                      '--output_plot_dir', str(tmp_path), db_file) != 0
+    assert list(tmp_path.glob('*.jpg')) == []
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Consultas de 'astmon.get_data' con muchos intervalos de tiempo
+
+import numpy as np
+import pytest
+
+import astmon
+import schema
+import intervals
+
+from conftest import FIRST_OBS, SAMPLES
+
+
+def query(conn, ranges, positions=None, filters=None):
+    """(sql, params) of 'astmon.query_db' for 'conn', loading 'ranges'."""
+    table = schema.measurement_table(conn)
+    if filters and table == 'measurement_data':
+        filters = schema.encode_filters(conn, filters)
+    sql, params, use_table = astmon.build_query(positions, filters, ranges, table=table)
+    if use_table:
+        astmon.load_ranges(conn, ranges)
+    return sql, params
+
+
+def nights(days):
+    """Night ranges of 'days' of the test data months."""
+    return intervals.build(years=[2020], months=[1, 2], days=days, nights=True)
+
+
+@pytest.mark.parametrize('stats', ['full', 'sampled', 'none'])
+def test_filters_many_ranges_use_time_index(db, stats):
+    if stats == 'sampled':
+        db.execute("PRAGMA analysis_limit = 100")
+        db.execute("ANALYZE")
+    elif stats == 'none':
+        db.execute("DROP TABLE IF EXISTS sqlite_stat1")
+        # planner statistics are reloaded (none for measurements)
+        db.execute("ANALYZE sqlite_schema")
+    ranges = nights(list(range(1, 29, 2)))
+    assert len(ranges) > 16
+    sql, params = query(db, ranges, filters=['V'])
+    plan = schema.query_plan(db, sql, params)
+    assert 'CROSS JOIN' in sql
+    assert any('_datetime' in p and schema.TIME_CONSTRAINT in p for p in plan), plan
+    assert not any('PRIMARY KEY (filter_name=?)' in p for p in plan), plan
+
+
+def test_filters_positions_many_ranges_use_primary_key(db):
+    ranges = nights(list(range(1, 29, 2)))
+    sql, params = query(db, ranges, positions=[2], filters=['V'])
+    plan = schema.query_plan(db, sql, params)
+    assert any('PRIMARY KEY' in p and schema.TIME_CONSTRAINT in p for p in plan), plan
+
+
+@pytest.mark.parametrize('days', [[3], list(range(1, 29, 2))])
+def test_filters_ranges_result(db, days):
+    ranges = nights(days)
+    df = astmon.query_db(db, ranges, filters=['V'])
+    datetime_obs = FIRST_OBS + np.arange(SAMPLES, dtype=np.int64) * 600
+    expected = datetime_obs[intervals.contains(ranges, datetime_obs)]
+    assert set(df['filter_name'].astype(str)) == {'V'}
+    assert np.array_equal(np.sort(df['datetime_obs'].values), np.sort(np.tile(expected, 3)))
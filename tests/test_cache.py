@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Caché persistente de resultados de consultas
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import astmon
+import cache
+
+from conftest import ingest
+
+
+def append_line(data_dir, name, line):
+    with open(data_dir / name, 'a') as fout:
+        fout.write(line + '\n')
+
+
+def test_version_changes_after_ingest(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    version = cache.db_version(db_file)
+    key = cache.query_key(db_file, None, [1], ['V'])
+    assert cache.db_version(db_file) == version
+    # same query, normalized
+    assert cache.query_key(db_file, None, ['1', 1], ['V', 'V']) == key
+    append_line(data_dir, 'dic2020pos1_V.dat', '31/12/2020 23:30:00      0      0.912345      21.123456')
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    assert cache.db_version(db_file) != version
+    assert cache.query_key(db_file, None, [1], ['V']) != key
+
+
+def test_cached_results_follow_ingestion(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    cache_dir = str(tmp_path / 'cache')
+    first = astmon.get_data(db_file, positions=[1], filters=['V'], cache_dir=cache_dir)
+    again = astmon.get_data(db_file, positions=[1], filters=['V'], cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(first, again)
+    assert cache.update_stats(cache_dir, True) == {'hits': 2, 'misses': 1}
+    append_line(data_dir, 'dic2020pos1_V.dat', '31/12/2020 23:30:00      0      0.912345      21.123456')
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    new = astmon.get_data(db_file, positions=[1], filters=['V'], cache_dir=cache_dir)
+    assert len(new.index) == len(first.index) + 1
+    assert new['sky_bright'].max() >= 21.123456
+
+
+def test_no_cache_by_default(data_dir, tmp_path, monkeypatch):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+
+    def fail(*args, **kwargs):
+        raise AssertionError('cache used without cache_dir')
+    for name in ('load', 'store', 'update_stats', 'query_key'):
+        monkeypatch.setattr(cache, name, fail)
+    assert len(astmon.get_data(str(tmp_path / 'db' / 'astmonDB.db')).index) > 0
+
+
+def count_queries(cache_dir, n):
+    for i in range(n):
+        cache.update_stats(cache_dir, i % 2 == 0)
+    return n
+
+
+def test_concurrent_stats_are_not_lost(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        assert sum(pool.map(count_queries, [cache_dir] * 8, [50] * 8)) == 400
+    assert cache.update_stats(cache_dir, False) == {'hits': 200, 'misses': 201}
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
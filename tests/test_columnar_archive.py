@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Archivo columnar (archive.py) frente a la base de datos
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import astmon
+import schema
+import archive
+
+from conftest import ingest
+
+
+def sorted_data(data):
+    data = data.assign(filter_name=np.asarray(data['filter_name'], dtype=str))
+    return data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+
+
+@pytest.fixture(params=['standard', 'compact'])
+def exported(data_dir, tmp_path, request):
+    """(database file, archive directory) of the synthetic data."""
+    assert ingest(data_dir, tmp_path / 'db', '--layout', request.param) == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    conn = sqlite3.connect(db_file)
+    try:
+        archive.export_archive(conn, str(tmp_path / 'archive'), verbose=False)
+    finally:
+        conn.close()
+    return db_file, str(tmp_path / 'archive')
+
+
+@pytest.mark.parametrize('query', [{}, {'filters': ['V'], 'positions': [2]},
+                                   {'years': [2020], 'months': [2, 11], 'filters': ['B']},
+                                   {'years': [2020], 'months': [6], 'hours': [22, 2], 'nights': True}])
+def test_archive_gives_database_data(exported, query):
+    db_file, archive_dir = exported
+    expected = astmon.get_data(db_file, **query)
+    data = astmon.get_data(archive_dir, source='archive', **query)
+    assert len(data.index) > 0
+    assert data['sky_bright'].dtype == np.float64
+    pd.testing.assert_frame_equal(sorted_data(data)[astmon.KEYWORDS],
+                                  sorted_data(expected)[astmon.KEYWORDS], check_dtype=False)
+
+
+def test_archive_index(exported):
+    db_file, archive_dir = exported
+    index = archive.read_index(archive_dir)
+    assert index['version'] == archive.ARCHIVE_VERSION
+    conn = sqlite3.connect(db_file)
+    counts = dict(((f, p), n) for f, p, n in conn.execute(
+        "SELECT filter_name, position, count(*) FROM measurement GROUP BY filter_name, position"))
+    conn.close()
+    rows = {}
+    for part in index['partitions']:
+        key = (part['filter_name'], part['position'])
+        rows[key] = rows.get(key, 0) + part['rows']
+    assert rows == counts
+    assert archive.select_partitions(index, positions=[1], filters=['B']) == \
+        [p for p in index['partitions'] if p['position'] == 1 and p['filter_name'] == 'B']
+
+
+def test_export_replaces_archive(exported):
+    db_file, archive_dir = exported
+    version = archive.archive_version(archive_dir)
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"DELETE FROM {schema.measurement_table(conn)} WHERE position = 2")
+    conn.commit()
+    archive.export_archive(conn, archive_dir, verbose=False)
+    conn.close()
+    assert archive.archive_version(archive_dir) != version
+    data = astmon.get_data(archive_dir, source='archive')
+    assert len(data.index) == len(astmon.get_data(db_file).index)
+    assert set(data['position']) == {1}
+
+
+def test_archive_resolution(exported):
+    with pytest.raises(ValueError):
+        astmon.get_data(exported[1], source='archive', resolution='night')
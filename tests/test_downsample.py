@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Reducción de series largas al tamaño en píxeles del gráfico
+
+import numpy as np
+
+import downsample
+
+
+def test_pixel_cells_keep_gaps():
+    # two clusters in the same pixel column, far apart in y
+    x = np.array([0.1, 0.1, 0.1, 0.1, 9.9])
+    y = np.array([17.1, 17.2, 22.8, 22.9, 20.])
+    xc, yc = downsample.pixel_cells(x, y, (10, 6), (0, 10), (17, 23))
+    assert sorted(zip(xc.tolist(), yc.tolist())) == [(0.5, 17.5), (0.5, 22.5), (9.5, 20.5)]
+
+
+def test_pixel_cells_match_every_sample():
+    rng = np.random.default_rng(0)
+    x, y = rng.random(100000) * 100, 17 + rng.random(100000) * 6
+    shape, x_range, y_range = (50, 30), (0, 100), (17, 23)
+    xc, yc = downsample.pixel_cells(x, y, shape, x_range, y_range)
+    cells = set(zip(downsample.pixel_bins(x, shape[0], x_range).tolist(),
+                    downsample.pixel_bins(y, shape[1], y_range).tolist()))
+    assert set(zip(downsample.pixel_bins(xc, shape[0], x_range).tolist(),
+                   downsample.pixel_bins(yc, shape[1], y_range).tolist())) == cells
+
+
+def test_minmax_bins():
+    x = np.array([0.1, 0.2, 5.5, 9.9])
+    y = np.array([18., 21., np.nan, 19.])
+    xc, y_min, y_max = downsample.minmax_bins(x, y, 10, (0, 10))
+    assert xc.tolist() == [0.5, 9.5]
+    assert y_min.tolist() == [18., 19.] and y_max.tolist() == [21., 19.]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Resultados de get_data frente a los ficheros de datos
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import astmon
+
+from conftest import ingest, source_values
+
+
+def sorted_data(data):
+    data = data.assign(filter_name=np.asarray(data['filter_name'], dtype=str))
+    return data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+
+
+def test_values_are_those_of_data_files(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    data = astmon.get_data(str(tmp_path / 'db' / 'astmonDB.db'))
+    assert data['sky_bright'].dtype == np.float64
+    assert data['photo_night'].dtype == np.float64
+    data, expected = sorted_data(data), source_values(data_dir)
+    for key in astmon.KEYWORDS:
+        assert np.array_equal(np.asarray(data[key]), np.asarray(expected[key])), key
+
+
+@pytest.mark.parametrize('query', [{}, {'filters': ['V'], 'positions': [2]},
+                                   {'years': [2020], 'months': [2, 11], 'filters': ['B']}])
+def test_layouts_give_same_data(data_dir, tmp_path, query):
+    for layout in ('standard', 'compact'):
+        assert ingest(data_dir, tmp_path / layout, '--layout', layout) == 0
+    standard, compact = (astmon.get_data(str(tmp_path / layout / 'astmonDB.db'), **query)
+                         for layout in ('standard', 'compact'))
+    assert len(standard.index) > 0
+    pd.testing.assert_frame_equal(sorted_data(standard), sorted_data(compact))
+
+
+def test_positional_arguments_of_baseline(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    # get_data(db_file, period, years, months, days, positions, filters)
+    data = astmon.get_data(db_file, None, [2020], [3], None, [2], ['V'])
+    expected = astmon.get_data(db_file, years=[2020], months=[3], positions=[2], filters=['V'])
+    assert len(data.index) > 0
+    assert set(data['position']) == {2} and set(data['filter_name']) == {'V'}
+    pd.testing.assert_frame_equal(data, expected)
+
+
+def test_months_without_years_select_every_time(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    assert len(astmon.get_data(db_file, months=[4], days=[1]).index) \
+        == len(astmon.get_data(db_file).index)
+    with pytest.raises(ValueError):
+        astmon.get_data(db_file, hours=[20, 4])
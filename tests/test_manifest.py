@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Manifiesto de ingesta: ficheros sin cambios, reescritos y solapados
+
+import numpy as np
+import pytest
+
+import astmon
+
+from conftest import ingest, source_values
+
+# batch and streaming ingestion
+MODES = [(), ('--chunk-rows', '1000')]
+
+
+def assert_same_data(db_file, expected):
+    data = astmon.get_data(db_file)
+    data = data.assign(filter_name=np.asarray(data['filter_name'], dtype=str))
+    data = data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+    assert len(data.index) == len(expected.index)
+    for key in astmon.KEYWORDS:
+        assert np.array_equal(np.asarray(data[key]), np.asarray(expected[key])), key
+
+
+@pytest.mark.parametrize('options', MODES)
+def test_unchanged_files_are_skipped(data_dir, tmp_path, capsys, options):
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    capsys.readouterr()
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    out = capsys.readouterr().out
+    assert out.count('INFO: Skipping unchanged data file') == len(list(data_dir.glob('*.dat')))
+    assert 'INFO: 0 new rows inserted' in out
+    assert_same_data(str(tmp_path / 'db' / 'astmonDB.db'), source_values(data_dir))
+
+
+@pytest.mark.parametrize('options', MODES)
+def test_modified_file_is_ingested_again(data_dir, tmp_path, options):
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    path = data_dir / 'mar2020pos2_V.dat'
+    lines = path.read_text().splitlines(keepends=True)
+    # first value changed (same size) and last lines removed
+    head, sky = lines[0].rstrip('\n').rsplit(' ', 1)
+    lines[0] = f"{head} {float(sky) + 1:.6f}\n"
+    path.write_text(''.join(lines[:-3]))
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    assert_same_data(str(tmp_path / 'db' / 'astmonDB.db'), source_values(data_dir))
+
+
+@pytest.mark.parametrize('options', MODES)
+def test_overlapping_files_are_restored(data_dir, tmp_path, options):
+    expected = source_values(data_dir)
+    # yearly dump of monthly files of position 1, filter B
+    dump = data_dir / 'all2020pos1_B.dat'
+    dump.write_text(''.join((data_dir / f"{month}2020pos1_B.dat").read_text()
+                            for month in ('ene', 'feb', 'mar', 'abr', 'may', 'jun',
+                                          'jul', 'ago', 'sep', 'oct', 'nov', 'dic')))
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    # truncated dump: its whole range is removed, monthly rows must come back
+    lines = dump.read_text().splitlines(keepends=True)
+    dump.write_text(''.join(lines[:len(lines) // 4]))
+    assert ingest(data_dir, tmp_path / 'db', *options) == 0
+    assert_same_data(str(tmp_path / 'db' / 'astmonDB.db'), expected)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Exportación de resultados sin gráficos (--format csv/json)
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ingest, run_astmon, source_values
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'json'])
+def test_export_writes_source_values(data_dir, tmp_path, fmt):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    assert run_astmon(str(tmp_path / 'db' / 'astmonDB.db'), '--format', fmt, '--no-cache',
+                      '--output_plot_dir', str(out_dir)) == 0
+    out_file = out_dir / f"sky_measures_positions-all_filters-all.{fmt}"
+    if fmt == 'csv':
+        data = pd.read_csv(out_file, float_precision='round_trip')
+    else:
+        data = pd.DataFrame(json.loads(out_file.read_text()))
+    data = data.sort_values(['filter_name', 'position', 'datetime_obs'], ignore_index=True)
+    expected = source_values(data_dir)
+    assert len(data.index) == len(expected.index)
+    for key in ('datetime_obs', 'is_moon', 'position', 'photo_night', 'sky_bright'):
+        assert np.array_equal(data[key].to_numpy(), expected[key].to_numpy()), key
+    assert data['filter_name'].tolist() == expected['filter_name'].tolist()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Planes de consulta (EXPLAIN QUERY PLAN) de las consultas habituales
+
+import pytest
+
+import schema
+
+from conftest import SAMPLES, FILTERS, POSITIONS
+
+
+@pytest.mark.parametrize('name', list(schema.QUERY_SHAPES))
+def test_query_shape_uses_bounded_index(db, name):
+    sql, params, constraint = schema.QUERY_SHAPES[name]
+    plan = schema.query_plan(db, sql, params)
+    assert schema.plan_uses(plan, constraint), plan
+
+
+@pytest.mark.parametrize('name', [n for n, shape in schema.QUERY_SHAPES.items()
+                                  if shape[2] == schema.TIME_CONSTRAINT])
+def test_time_range_shapes_bound_datetime(db, name):
+    sql, params, _ = schema.QUERY_SHAPES[name]
+    plan = schema.query_plan(db, sql, params)
+    assert any('datetime_obs>? AND datetime_obs<?' in p for p in plan if p.startswith('SEARCH')), plan
+
+
+def test_filter_only_search_is_rejected():
+    plan = ['SEARCH measurement USING PRIMARY KEY (filter_name=?)']
+    assert not schema.plan_uses(plan, schema.TIME_CONSTRAINT)
+
+
+def test_analyze_is_not_sampled(db):
+    table = schema.measurement_table(db)
+    stats = dict(db.execute("SELECT idx, stat FROM sqlite_stat1 WHERE tbl = ?", (table,)))
+    rows = SAMPLES * len(FILTERS) * len(POSITIONS)
+    assert all(int(stat.split()[0]) == rows for stat in stats.values()), stats
+    # rows per filter of the primary key
+    assert int(stats[table].split()[1]) == rows // len(FILTERS)
+
+
+def test_check_query_plans(db):
+    results = schema.check_query_plans(db)
+    assert all(ok for ok, _ in results.values()), results
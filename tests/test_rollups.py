@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Tablas de estadísticas precalculadas comparadas con pandas
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rollups
+
+from conftest import SAMPLES, FILTERS, POSITIONS
+
+
+def reference(conn, resolution):
+    """Rollup rows of 'resolution' computed with pandas."""
+    data = pd.read_sql_query("SELECT * FROM measurement", conn)
+    period = rollups.night_start if resolution == 'night' else rollups.month_start
+    data['period_start'] = period(data['datetime_obs'].to_numpy())
+    groups = data.groupby(['filter_name', 'position', 'period_start'])
+    result = {'count': groups.size()}
+    for field, column in (('sky', 'sky_bright'), ('photo', 'photo_night')):
+        result[f"{field}_min"] = groups[column].min()
+        result[f"{field}_max"] = groups[column].max()
+        result[f"{field}_mean"] = groups[column].mean()
+        for name, q in rollups.QUANTILES.items():
+            result[f"{field}_{name}"] = groups[column].quantile(q)
+    result['moon_fraction'] = groups['is_moon'].mean()
+    return pd.DataFrame(result).reset_index()
+
+
+@pytest.mark.parametrize('resolution', list(rollups.RESOLUTIONS))
+def test_rollups_match_pandas(db, resolution):
+    written = rollups.rebuild_rollups(db)
+    expected = reference(db, resolution)
+    table = rollups.RESOLUTIONS[resolution]
+    columns = ['filter_name', 'position', 'period_start'] + rollups.VALUE_COLUMNS
+    got = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} "
+                            "ORDER BY filter_name, position, period_start", db)
+    assert written == sum(db.execute(f"SELECT count(*) FROM {t}").fetchone()[0]
+                          for t in rollups.RESOLUTIONS.values())
+    assert got['count'].sum() == SAMPLES * len(FILTERS) * len(POSITIONS)
+    assert got[columns[:4]].values.tolist() == expected[columns[:4]].values.tolist()
+    np.testing.assert_allclose(got[columns[4:]].to_numpy(float),
+                               expected[columns[4:]].to_numpy(float), rtol=1e-12)
+
+
+def test_refresh_only_touches_dirty_nights(db):
+    rollups.rebuild_rollups(db)
+    night = rollups.night_start(int(db.execute("SELECT max(datetime_obs) FROM measurement")
+                                    .fetchone()[0]))
+    db.execute("UPDATE rollup_night SET count = -1")
+    written = rollups.refresh_rollups(db, {(POSITIONS[0], FILTERS[0]): (night, night + 1)})
+    # one night and one month
+    assert written == 2
+    counts = dict(db.execute("SELECT period_start, count FROM rollup_night "
+                             "WHERE filter_name = ? AND position = ?", (FILTERS[0], POSITIONS[0])))
+    assert counts[night] > 0
+    assert sum(c == -1 for c in counts.values()) == len(counts) - 1
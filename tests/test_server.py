@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Servicio HTTP local (server.py)
+
+import io
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import server
+import analytics
+import generate_data
+
+from conftest import ingest, source_values
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('server') / 'data'
+    generate_data.generate(str(path), [2020], positions=[1, 2], filters=['B', 'V'],
+                           step=3600, bad_fraction=0)
+    return path
+
+
+@pytest.fixture(scope='module')
+def url(data_dir):
+    """Base URL of a server on the ingested synthetic data (one per module)."""
+    assert ingest(data_dir, data_dir.parent / 'db') == 0
+    db_file = str(data_dir.parent / 'db' / 'astmonDB.db')
+    server.init_state(db_file, connections=2)
+    server.RequestHandler.workers_args = (db_file, 1, 2, 32)
+    server.RequestHandler.workers = server.start_workers(*server.RequestHandler.workers_args)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), server.RequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+    server.RequestHandler.workers.shutdown()
+
+
+def get(url):
+    """(status, content type, body) of a GET request."""
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.headers['Content-Type'], response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers['Content-Type'], e.read()
+
+
+def test_data_endpoint(url, data_dir):
+    status, content_type, body = get(f"{url}/data?positions=1&filters=V&format=csv")
+    assert (status, content_type) == (200, 'text/csv')
+    data = pd.read_csv(io.BytesIO(body), float_precision='round_trip')
+    expected = source_values(data_dir)
+    expected = expected[(expected['position'] == 1) & (expected['filter_name'] == 'V')]
+    assert data['sky_bright'].tolist() == expected['sky_bright'].tolist()
+
+
+@pytest.mark.parametrize('path', ['/stats?years=2020&months=4', '/summary?years=2020',
+                                  '/data?years=2020&months=4&resolution=night', '/health'])
+def test_json_endpoints(url, path):
+    status, content_type, body = get(url + path)
+    assert (status, content_type) == (200, 'application/json')
+    assert json.loads(body)
+
+
+def test_plot_endpoint(url):
+    status, content_type, body = get(f"{url}/plot?years=2020&months=4&filters=B")
+    assert (status, content_type) == (200, 'image/png')
+    assert body.startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('path, status', [('/nothing', 404), ('/data?resolution=year', 400),
+                                          ('/data?dpi=2', 400), ('/plot?years=1990', 404)])
+def test_errors(url, path, status):
+    assert get(url + path)[:2] == (status, 'application/json')
+
+
+def test_metrics(url):
+    def counts():
+        endpoints = json.loads(get(f"{url}/metrics")[2])['endpoints']
+        return {k: (endpoints.get(k, {}).get('requests', 0), endpoints.get(k, {}).get('errors', 0))
+                for k in ('/health', '/data')}
+    before = counts()
+    get(f"{url}/health")
+    get(f"{url}/data?resolution=year")
+    after = counts()
+    assert after['/health'] == (before['/health'][0] + 1, before['/health'][1])
+    assert after['/data'] == (before['/data'][0] + 1, before['/data'][1] + 1)
+
+
+def test_unexpected_error_is_answered(url, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('unexpected')
+    monkeypatch.setattr(analytics, 'night_stats', fail)
+    status, content_type, body = get(f"{url}/stats?years=2020")
+    assert (status, content_type) == (500, 'application/json')
+    assert json.loads(body) == {'error': 'RuntimeError: unexpected'}
+
+
+def test_broken_rendering_pool_is_restarted(url):
+    broken = server.RequestHandler.workers
+    # a rendering process dies
+    with pytest.raises(Exception):
+        broken.submit(os._exit, 1).result()
+    status, content_type, body = get(f"{url}/plot?years=2020&months=4")
+    assert (status, content_type) == (500, 'application/json')
+    assert 'BrokenProcessPool' in json.loads(body)['error']
+    assert server.RequestHandler.workers is not broken
+    assert get(f"{url}/plot?years=2020&months=4")[0] == 200
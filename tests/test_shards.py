@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Base de datos fragmentada por meses: reingesta y tablas de estadísticas
+
+import sqlite3
+
+import pandas as pd
+
+import rollups
+import generate_data
+
+from conftest import ingest
+
+
+def rollup_tables(db_file):
+    """{resolution: rollup rows} of database 'db_file'."""
+    conn = sqlite3.connect(db_file)
+    try:
+        return {resolution: pd.read_sql_query(f"SELECT * FROM {table} "
+                                              "ORDER BY filter_name, position, period_start", conn)
+                for resolution, table in rollups.RESOLUTIONS.items()}
+    finally:
+        conn.close()
+
+
+def test_sparse_dirty_shards(tmp_path):
+    data_dir = tmp_path / 'data'
+    generate_data.generate(str(data_dir), [2020, 2021], positions=[1], filters=['B', 'V'],
+                           step=3600, bad_fraction=0)
+    assert ingest(data_dir, tmp_path / 'sharded', '--shard', 'month') == 0
+    # first and last of 24 monthly shards are dirty: more than attachable at once
+    for name, line in (('ene2020pos1_B.dat', '31/01/2020 23:59:59      0      0.500000      20.000000\n'),
+                       ('dic2021pos1_V.dat', '31/12/2021 23:59:59      1      0.400000      19.000000\n')):
+        with open(data_dir / name, 'a') as f:
+            f.write(line)
+    assert ingest(data_dir, tmp_path / 'sharded', '--shard', 'month') == 0
+    assert ingest(data_dir, tmp_path / 'plain') == 0
+    sharded = rollup_tables(str(tmp_path / 'sharded' / 'astmonDB.db'))
+    plain = rollup_tables(str(tmp_path / 'plain' / 'astmonDB.db'))
+    for resolution in rollups.RESOLUTIONS:
+        pd.testing.assert_frame_equal(sharded[resolution], plain[resolution], rtol=1e-12)
+    conn = sqlite3.connect(str(tmp_path / 'plain' / 'astmonDB.db'))
+    counts = dict(conn.execute("SELECT filter_name, count(*) FROM measurement GROUP BY filter_name"))
+    conn.close()
+    assert sharded['night'].groupby('filter_name')['count'].sum().to_dict() == counts
+
+
+def test_manifest_waits_for_rollups(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'data'
+    generate_data.generate(str(data_dir), [2020], positions=[1], filters=['B'],
+                           step=3600, bad_fraction=0)
+    assert ingest(data_dir, tmp_path / 'sharded', '--shard', 'month') == 0
+    with open(data_dir / 'jun2020pos1_B.dat', 'a') as f:
+        f.write('30/06/2020 23:59:59      0      0.500000      20.000000\n')
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError('rollups failed')
+    with monkeypatch.context() as m:
+        m.setattr(rollups, 'refresh_rollups', fail)
+        assert ingest(data_dir, tmp_path / 'sharded', '--shard', 'month') == 6
+    # the appended line is still pending: read (and rolled up) again
+    assert ingest(data_dir, tmp_path / 'sharded', '--shard', 'month') == 0
+    assert ingest(data_dir, tmp_path / 'plain') == 0
+    sharded = rollup_tables(str(tmp_path / 'sharded' / 'astmonDB.db'))
+    plain = rollup_tables(str(tmp_path / 'plain' / 'astmonDB.db'))
+    for resolution in rollups.RESOLUTIONS:
+        pd.testing.assert_frame_equal(sharded[resolution], plain[resolution], rtol=1e-12)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Vigilancia del directorio de datos (watch_dir) con líneas a medio escribir
+
+import sqlite3
+
+import create_database
+
+from conftest import ingest, source_values
+
+LINE = '31/12/2020 23:59:59      1      0.500000      20.123456\n'
+
+
+def rows(db_file, epoch):
+    """sky_bright values of 'epoch' measurements (position 1, filter B)."""
+    conn = sqlite3.connect(db_file)
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT sky_bright FROM measurement WHERE position = 1 AND filter_name = 'B' "
+            "AND datetime_obs = ?", (epoch,))]
+    finally:
+        conn.close()
+
+
+def test_partial_line_waits_until_completed(data_dir, tmp_path):
+    assert ingest(data_dir, tmp_path / 'db') == 0
+    db_file = str(tmp_path / 'db' / 'astmonDB.db')
+    epoch = 1609459199  # 2020-12-31 23:59:59
+    path = data_dir / 'dic2020pos1_B.dat'
+    conn = create_database.connect_db(db_file)
+    try:
+        # line still being written (a valid but truncated value): nothing is ingested
+        with open(path, 'a', newline='') as f:
+            f.write(LINE[:-4])
+        assert create_database.watch_dir(conn, str(data_dir), 0, cycles=1) == 0
+        assert rows(db_file, epoch) == []
+        # completed line is ingested once, in a later cycle
+        with open(path, 'a', newline='') as f:
+            f.write(LINE[-4:])
+        assert create_database.watch_dir(conn, str(data_dir), 0, cycles=2) == 1
+        assert rows(db_file, epoch) == [20.123456]
+    finally:
+        conn.close()
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT count(*) FROM measurement").fetchone()[0] \
+        == len(source_values(data_dir).index)
+    conn.close()